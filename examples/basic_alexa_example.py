@@ -68,7 +68,11 @@ def main():
 
             if avs_response:
                 print('Playing AVS response')
-                echo.play(avs_response)  # , stop_on=['alexa', 'stop'])
+
+                if echo.play(avs_response, stop_on=['alexa']):
+                    print('Interrupted by hotword: alexa')
+                    initial_query = True
+                    continue
             #  expects_more_dialog = avs_response.expects_more_dialog
 
 
@@ -0,0 +1,62 @@
+""" sample to demonstrate Tabitha running as Alexa with a Conversation """
+
+from __future__ import print_function
+import os
+import io
+import sys
+import signal
+import yaml
+
+# import logging
+# logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+import tabitha
+from tabitha.conversation import Conversation
+from tabitha.handlers.alexa import AlexaVoiceService
+
+_EXAMPLES_DIR = os.path.dirname(__file__)
+_CONFIG_PATH = os.path.join(_EXAMPLES_DIR, 'client_config.yml')
+
+
+def main():
+    """ runs as Amazon Echo, uploading while the user speaks """
+
+    with io.open(_CONFIG_PATH, 'r') as cfile:
+        config = yaml.load(cfile)
+
+    config.setdefault('capture.from_trigger', True)
+    config.setdefault('conversation.stop_on', ['alexa'])
+
+    echo = tabitha.VoiceClient(config)
+    avs = AlexaVoiceService(config)
+    conversation = Conversation(echo, avs, config)
+
+    def _terminate(dummy1, dummy2):
+        print('Quitting...')
+        avs.terminate()
+        echo.terminate()
+        exit()
+
+    # capture SIGINT signal, e.g., Ctrl+C
+    signal.signal(signal.SIGINT, _terminate)
+
+    echo.listen()
+    print('Echo has started, press Ctrl+C to quit')
+
+    while echo.is_listening:
+        if not conversation.expects_follow_up:
+            print('Listening for "Alexa"...')
+
+        turn = conversation.run_turn()
+
+        if not turn:
+            return
+
+        print(', '.join('%s %.3fs' % event for event in turn.timeline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+""" Tabitha asyncio client class """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import asyncio
+import functools
+import os
+from tabitha.metrics import monotonic_time
+from tabitha.voiceclient import VoiceClient
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _wakeup(loop, future):
+    """ called from the audio thread, hops onto the loop at most once per
+        wait rather than once per audio frame """
+    try:
+        loop.call_soon_threadsafe(_resolve, future, None)
+    except RuntimeError:
+        # the loop was closed while the wakeup was pending
+        pass
+
+
+def _finish_playback(loop, future, audio_buffer):
+    """ called by the output, also wakes a coroutine waiting for audio """
+    _wakeup(loop, future)
+    audio_buffer.interrupt()
+
+
+class AsyncVoiceClient(VoiceClient):
+    """ VoiceClient whose trigger, capture, ask and play are awaitable
+
+        Audio is read on the event loop and handed to the detectors in the
+        default executor, so a slow detector does not hold up the loop.
+        The source thread only calls into the loop when a coroutine is
+        actually waiting for audio, so many clients can share one loop.
+        Cancelling any of the coroutines
+        (directly or via asyncio.wait_for) stops the capture or playback
+        it started. Handlers providing ask_async/respond_to_async are
+        awaited directly, other handlers run in the default executor.
+    """
+
+    def __init__(self, config=None):
+        super(AsyncVoiceClient, self).__init__(config)
+        self._audio_arrived = None
+
+    async def _wait_for_audio(self):
+        if self._source_exhausted():
+            self.is_listening = False
+            return
+
+        loop = asyncio.get_running_loop()
+        arrived = self._audio_arrived
+        audio_buffer = self._source.buffer
+
+        # a wait that timed out leaves its wakeup registered, reuse it
+        # rather than adding another one each time
+        if arrived is None or arrived.done() or arrived.get_loop() is not loop:
+            arrived = loop.create_future()
+            self._audio_arrived = arrived
+            audio_buffer.add_wakeup(functools.partial(_wakeup, loop, arrived))
+
+        if audio_buffer.snapshot_reader.available() or not self.is_listening:
+            return
+
+        await asyncio.wait([arrived], timeout=self._config.wait_timeout)
+
+    @staticmethod
+    async def _run_detector(method, data):
+        """ runs _detect or _is_break on data in the default executor """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, method, data)
+
+    async def _call_handler(self, handler, name, *args):
+        async_method = getattr(handler, name + '_async', None)
+
+        if async_method:
+            return await async_method(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(getattr(handler, name), *args))
+
+    async def wait_for_hotword(self, watchfor=None, timeout=None):
+        """ alias for wait_for_trigger """
+        return await self.wait_for_trigger(watchfor, timeout)
+
+    async def wait_for_trigger(self, watchfor=None, timeout=None):
+        """ waits until a trigger is detected, returns None if the client
+            stops listening or timeout seconds pass on the client clock """
+
+        if not self.is_listening:
+            raise ValueError('VoiceClient must be listening to be triggered')
+
+        audio_buffer = self._source.buffer
+        audio_buffer.sync_snapshot()
+        self._timings.detect_cpu = 0.0
+
+        if timeout is not None:
+            timeout += self.clock.time()
+
+        while self.is_listening:
+            if timeout is not None and self.clock.time() >= timeout:
+                return None
+
+            data = audio_buffer.get_snapshot_data()
+
+            if len(data) == 0:
+                await self._wait_for_audio()
+                continue
+
+            trigger_result = await self._run_detector(self._detect, data)
+
+            if trigger_result:
+                return self._accept_trigger(trigger_result)
+
+        return None
+
+    async def capture_until_break(self, preroll_ms=None):
+        """ captures audio until a break is detected, see
+            VoiceClient.capture_until_break """
+
+        if not self.is_listening:
+            raise ValueError('VoiceClient must be listening to be triggered')
+
+        audio_buffer = self._source.buffer
+        self._start_capture(preroll_ms)
+        self._start_capture_encoding()
+
+        try:
+            while audio_buffer.is_capturing:
+                if not self.is_listening:
+                    return None
+
+                data = audio_buffer.get_snapshot_data()
+
+                if len(data) == 0:
+                    await self._wait_for_audio()
+                    continue
+
+                if await self._run_detector(self._is_break, data):
+                    break
+
+                self._encode_capture()
+        finally:
+            audio_buffer.stop_capture()
+
+        audio_data = audio_buffer.get_capture_data()
+        self._current_context.capture = audio_data
+        self._finish_capture_encoding()
+
+        return audio_data
+
+    async def ask(self, handler, audio_data=None):
+        """ sends the audio data to the handler and awaits the response """
+        if not audio_data:
+            audio_data = self._current_context.capture
+
+        audio_data = self._handler_audio(handler, 'ask', audio_data)
+        start_time = monotonic_time()
+        response = await self._call_handler(handler, 'ask', audio_data)
+        self.metrics.since('handler.ask', start_time)
+        self._current_context.response = response
+
+        return response
+
+    async def respond_to(self, handler, audio_data=None,
+                         response_context=None):
+        """ sends the audio data to the handler and awaits the response """
+        if not audio_data:
+            audio_data = self._current_context.capture
+
+        if not response_context:
+            response_context = self._current_context.response
+
+        audio_data = self._handler_audio(handler, 'respond_to', audio_data)
+        start_time = monotonic_time()
+        response = await self._call_handler(
+            handler, 'respond_to', audio_data, response_context)
+        self.metrics.since('handler.respond_to', start_time)
+        self._current_context.response = response
+
+        return response
+
+    async def play(self, audio_response, stop_on=None):
+        """ plays the audio response while listening for triggers, see
+            VoiceClient.play, cancelling stops the output """
+
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+        audio_buffer = self._source.buffer
+        temp_file = None
+
+        try:
+            temp_file = self._start_output(audio_response, functools.partial(
+                _finish_playback, loop, finished, audio_buffer))
+
+            if self.is_listening and stop_on != []:
+                audio_buffer.sync_snapshot()
+
+            while not finished.done():
+                if not self.is_listening or stop_on == []:
+                    await finished
+                    break
+
+                data = audio_buffer.get_snapshot_data()
+
+                if len(data) == 0:
+                    await self._wait_for_audio()
+                    continue
+
+                trigger_result = await self._run_detector(self._detect,
+                                                          data)
+
+                if (trigger_result and
+                        self._stops_playback(trigger_result, stop_on)):
+                    return self._barge_in(trigger_result)
+
+            self._note_playback_finished()
+            return None
+        except asyncio.CancelledError:
+            self._output.stop()
+            raise
+        finally:
+            if temp_file:
+                os.remove(temp_file)
@@ -3,11 +3,21 @@
 from __future__ import division
 from __future__ import absolute_import
 from __future__ import unicode_literals
-import collections
+import logging
+from tabitha.metrics import monotonic_time
+from tabitha.ringbuffer import RingBuffer
 
 
 class AudioBuffer(object):
-    """ AudioBuffer holds audio data to be post processed """
+    """ AudioBuffer holds audio data to be post processed
+
+        Audio is written once into a preallocated RingBuffer. The snapshot
+        stream and any extra readers are cursors into that ring and receive
+        memoryview slices of it, the capture is a range of ring positions.
+        last_write_time is the monotonic time of the newest write, detection
+        latency is measured from it. With audio.buffer.shared the ring is a
+        SharedRingBuffer which other processes can attach to by shared_name.
+    """
 
     def __init__(self, config=None):
         config = config or {}
@@ -15,50 +25,196 @@ class AudioBuffer(object):
         max_capture_ms = config.get('audio.buffer.max_capture_ms', 6000)
         sample_rate = config.get('audio.sample_rate', 16000)
         audio_width = config.get('audio.width', 2)
+        ring_ms = config.get('audio.buffer.ring_ms',
+                             max(max_capture_ms or 0, 2000) + snapshot_ms)
 
-        capture_buffer_size = None
-        snapshot_buffer_size = audio_width * snapshot_ms * sample_rate / 1000
+        self._audio_width = audio_width
+        self._bytes_per_ms = audio_width * sample_rate / 1000
+        self._snapshot_bytes = self._ms_to_bytes(snapshot_ms)
+        self._capture_bytes = None
 
         if max_capture_ms:
-            capture_buffer_size = (audio_width * max_capture_ms *
-                                   sample_rate / 1000)
+            self._capture_bytes = self._ms_to_bytes(max_capture_ms)
+            ring_ms = max(ring_ms, max_capture_ms + snapshot_ms)
 
         self.is_capturing = False
-        self._snapshot_buffer = collections.deque(maxlen=snapshot_buffer_size)
-        self._capture_buffer = collections.deque(maxlen=capture_buffer_size)
+        self.last_write_time = None
+        if config.get('audio.buffer.shared', False):
+            from tabitha.sharedringbuffer import SharedRingBuffer
+            self._ring = SharedRingBuffer(
+                self._ms_to_bytes(ring_ms),
+                config.get('audio.buffer.shared_name', None))
+        else:
+            self._ring = RingBuffer(self._ms_to_bytes(ring_ms))
+
+        self._snapshot_reader = self._ring.reader()
+        self._capture_start = 0
+        self._capture_end = 0
+        self._unbounded_capture = bytearray()
+
+    @property
+    def snapshot_reader(self):
+        """ the cursor used by get_snapshot_data """
+        return self._snapshot_reader
+
+    @property
+    def ring(self):
+        """ the RingBuffer holding the audio """
+        return self._ring
+
+    @property
+    def shared_name(self):
+        """ the shared memory name of the ring, None unless shared """
+        return getattr(self._ring, 'name', None)
+
+    @property
+    def written(self):
+        """ absolute ring position of the newest audio """
+        return self._ring.written
+
+    @property
+    def nbytes(self):
+        """ memory held by the buffer's audio storage """
+        return self._ring.nbytes + len(self._unbounded_capture)
+
+    def duration_ms(self, byte_count):
+        """ converts a number of bytes of audio to milliseconds """
+        return byte_count / self._bytes_per_ms
+
+    def reader(self, history_ms=0):
+        """ returns a new independent cursor starting history_ms back """
+
+        reader = self._ring.reader()
+        reader.seek_latest(self._ms_to_bytes(history_ms))
+        return reader
 
     def extend(self, data):
         """ add new audio data to the buffer """
 
-        self._snapshot_buffer.extend(data)
+        self.last_write_time = monotonic_time()
+        self._ring.write(data)
 
         if self.is_capturing:
-            self._capture_buffer.extend(data)
+            if self._capture_bytes is None:
+                self._unbounded_capture.extend(data)
+
             self._check_if_capture_complete()
 
     def get_snapshot_data(self):
-        """ returns a small snapshot of the most recent audio data """
+        """ returns the audio data received since the last snapshot
+
+            the result is a memoryview into the ring, it should be consumed
+            before the writer laps it """
+
+        reader = self._snapshot_reader
+        overruns = reader.overruns
+        data = reader.read()
+
+        if reader.overruns != overruns:
+            logging.warning('snapshot overrun, %d bytes dropped so far',
+                            reader.dropped_bytes)
+
+        return data
+
+    def wait_for_snapshot(self, timeout=None):
+        """ blocks until new snapshot data arrives or interrupt() is called,
+            returns False if there is still nothing to read """
+        return self._snapshot_reader.wait(timeout)
+
+    def add_wakeup(self, callback):
+        """ calls callback once, from the writer thread, when new audio
+            arrives or interrupt() is called """
+        self._ring.add_wakeup(callback)
+
+    def set_feeder(self, feeder):
+        """ lets a replaying source write audio on demand, see RingBuffer """
+        self._ring.set_feeder(feeder)
+
+    def interrupt(self):
+        """ wakes any thread blocked waiting for audio data """
+        self._ring.interrupt()
+
+    def close(self):
+        """ releases a shared ring, the buffer can not be used afterwards """
+
+        if hasattr(self._ring, 'close'):
+            self._ring.close()
+
+    def sync_snapshot(self):
+        """ discards unread snapshot data older than audio.buffer.snapshot_ms
+        """
+        self._snapshot_reader.seek_latest(self._snapshot_bytes)
+
+    def start_capture(self, position=None, preroll_ms=0):
+        """ starts capturing audio data into a larger capture buffer
 
-        tmp = bytes(bytearray(self._snapshot_buffer))
-        self._snapshot_buffer.clear()
-        return tmp
+            the capture starts preroll_ms before the absolute ring
+            position, by default the newest audio, e.g. the end of a
+            detected trigger, as far back as the ring still holds """
 
-    def start_capture(self):
-        """ starts capturing audio data into a larger capture buffer """
+        written = self._ring.written
+        start = written if position is None else min(position, written)
+        start = max(start - self._ms_to_bytes(preroll_ms), self._ring.oldest)
 
-        self._capture_buffer.clear()
+        del self._unbounded_capture[:]
+
+        if self._capture_bytes is None:
+            self._unbounded_capture.extend(self._ring.view(start, written))
+
+        self._capture_start = start
+        self._capture_end = start
         self.is_capturing = True
+        self._check_if_capture_complete()
 
     def stop_capture(self):
         """ stops capturing audio into the capture buffer """
 
+        self._capture_end = self._capture_limit()
         self.is_capturing = False
 
+    @property
+    def capture_end(self):
+        """ absolute ring position of the end of the captured data """
+        if self.is_capturing:
+            return self._capture_limit()
+
+        return self._capture_end
+
+    def capture_reader(self):
+        """ returns a new cursor positioned at the start of the capture """
+        return self._ring.reader(self._capture_start)
+
+    def get_capture_view(self, offset=0):
+        """ returns the captured audio data from offset bytes into the
+            capture as a memoryview without copying """
+
+        if self._capture_bytes is None:
+            # a view would pin the growing bytearray, so hand out a copy
+            return memoryview(bytes(self._unbounded_capture[offset:]))
+
+        return self._ring.view(self._capture_start + offset,
+                               self.capture_end)
+
     def get_capture_data(self):
         """ returns the captured audio data """
 
-        return bytes(bytearray(self._capture_buffer))
+        return bytes(self.get_capture_view())
+
+    def _ms_to_bytes(self, duration_ms):
+        samples = int(self._bytes_per_ms * duration_ms) // self._audio_width
+        return samples * self._audio_width
+
+    def _capture_limit(self):
+        if self._capture_bytes is None:
+            return self._ring.written
+
+        return min(self._ring.written,
+                   self._capture_start + self._capture_bytes)
 
     def _check_if_capture_complete(self):
-        if len(self._capture_buffer) == self._capture_buffer.maxlen:
+        if self._capture_bytes is None:
+            return
+
+        if self._ring.written >= self._capture_start + self._capture_bytes:
+            self._capture_end = self._capture_start + self._capture_bytes
             self.is_capturing = False
@@ -0,0 +1,114 @@
+""" splits a stream of audio chunks into fixed size frames """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import logging
+
+
+class Framer(object):
+    """ splits a stream of audio chunks into fixed size frames
+
+        Complete frames are memoryview slices of the chunk passed in, only
+        a frame straddling two chunks is copied, into a preallocated
+        buffer. Frames are only valid until the next one is requested.
+
+        Frames a caller stops short of taking are kept in a preallocated
+        carry buffer of carry_frames frames. When a caller keeps stopping
+        early the oldest whole frames are dropped rather than letting the
+        carry grow, dropped_bytes counts them.
+    """
+
+    def __init__(self, frame_bytes, carry_frames=100):
+        self.frame_bytes = frame_bytes
+        self._partial = memoryview(bytearray(frame_bytes))
+        self._partial_len = 0
+        self._carry = memoryview(bytearray(frame_bytes * carry_frames))
+        self._carry_start = 0
+        self._carry_end = 0
+        self._consumed = 0
+        self.dropped_bytes = 0
+
+    def reset(self):
+        """ discards any partial frame """
+        self._partial_len = 0
+        self._carry_start = 0
+        self._carry_end = 0
+
+    def _split(self, data):
+        """ yields the frames completed by data, self._consumed is how much
+            of data the frames yielded so far used """
+
+        frame_bytes = self.frame_bytes
+        size = len(data)
+        offset = 0
+        self._consumed = 0
+
+        if self._partial_len:
+            start = self._partial_len
+            offset = min(frame_bytes - start, size)
+            self._partial[start:start + offset] = data[:offset]
+            self._partial_len += offset
+
+            if self._partial_len < frame_bytes:
+                self._consumed = size
+                return
+
+            self._partial_len = 0
+            self._consumed = offset
+            yield self._partial
+
+        while offset + frame_bytes <= size:
+            offset += frame_bytes
+            self._consumed = offset
+            yield data[offset - frame_bytes:offset]
+
+        self._partial_len = size - offset
+        self._partial[:self._partial_len] = data[offset:]
+        self._consumed = size
+
+    def _keep(self, start, end, data):
+        """ carries self._carry[start:end] followed by data to the next
+            call, dropping the oldest whole frames if they do not fit """
+
+        excess = end - start + len(data) - len(self._carry)
+
+        if excess > 0:
+            drop = -(-excess // self.frame_bytes) * self.frame_bytes
+            from_carry = min(drop, end - start)
+            start += from_carry
+            data = data[drop - from_carry:]
+            self.dropped_bytes += drop
+            logging.debug('framer carry is full, dropped %d bytes', drop)
+
+        kept = end - start
+        self._carry[:kept] = self._carry[start:end]
+        self._carry[kept:kept + len(data)] = data
+        self._carry_start = 0
+        self._carry_end = kept + len(data)
+
+    def frames(self, data):
+        """ yields every frame completed by data, keeping any remainder
+
+            When the caller stops iterating early the frames it did not
+            take are kept too, and yielded first by the next call.
+        """
+
+        data = memoryview(data)
+        start, end = self._carry_start, self._carry_end
+        self._carry_start = self._carry_end = 0
+        in_carry = end > start
+
+        try:
+            if in_carry:
+                for frame in self._split(self._carry[start:end]):
+                    yield frame
+
+                in_carry = False
+
+            for frame in self._split(data):
+                yield frame
+        finally:
+            if in_carry:
+                self._keep(start + self._consumed, end, data)
+            elif self._consumed < len(data):
+                self._keep(0, 0, data[self._consumed:])
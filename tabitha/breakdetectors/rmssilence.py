@@ -5,41 +5,89 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 from __future__ import division
 import logging
-import audioop
+import math
+import numpy
+from tabitha.metrics import thread_time
 from tabitha.objectdict import ObjectDict
+from tabitha.pcm import SAMPLE_TYPES, NoiseFloor
 
 
 class RmsSilenceDetector(object):
-    """ detects a run of audio silence in an audio data stream """
+    """ detects a run of audio silence in an audio data stream
+
+        The RMS of every complete frame in a chunk is computed in one numpy
+        pass over a view of the chunk, only a partial trailing frame is
+        copied. Unless break.rms.silence_rms fixes the threshold, a frame
+        is silent when its RMS is below noise_ratio times a NoiseFloor
+        starting at break.rms.noise_floor (default min_rms), as the first
+        audio seen during a capture is speech, and rising by at most
+        noise_rise_db per second.
+        The cost of each call is kept in stats.
+    """
 
     def __init__(self, config=None):
         config = config or {}
         drop_start_ms = config.get('break.rms.drop_start_ms', 60)
+        audio_width = config.get('audio.width', 2)
+
+        if audio_width not in SAMPLE_TYPES:
+            raise ValueError('RmsSilenceDetector does not support ' +
+                             'audio.width %s' % audio_width)
 
         self._config = ObjectDict({
             'frame_ms': config.get('break.rms.frame_ms', 30),
             'silence_ms': config.get('break.rms.silence_ms', 200),
-            'silence_rms': config.get('break.rms.silence_rms', 0.5),
+            'silence_rms': config.get('break.rms.silence_rms', None),
+            'noise_ratio': config.get('break.rms.noise_ratio', 2.0),
+            'noise_rise_db': config.get('break.rms.noise_rise_db', 3.0),
+            'min_rms': config.get('break.rms.min_rms', 50),
             'sample_rate': config.get('audio.sample_rate', 16000),
-            'audio_width': config.get('audio.width', 2)})
+            'audio_width': audio_width})
+
+        self._sample_type = numpy.dtype(SAMPLE_TYPES[audio_width])
+        self._frame_samples = int(self._config.frame_ms *
+                                  self._config.sample_rate / 1000)
+        self._frame_bytes = self._frame_samples * audio_width
+        self._drop_start_bytes = int(drop_start_ms *
+                                     self._config.sample_rate /
+                                     1000) * audio_width
+        self._silence_frames = int(math.ceil(self._config.silence_ms /
+                                             self._config.frame_ms))
 
         self._dropped_bytes = 0
-        self._silence_run_ms = 0
-        self._data = ''
+        self._silence_run = 0
+        self._partial = bytearray()
+        self._noise = NoiseFloor(
+            config.get('break.rms.noise_floor', self._config.min_rms),
+            self._config.noise_rise_db, self._config.frame_ms)
+        self.stats = ObjectDict({'chunks': 0, 'frames': 0,
+                                 'cpu_seconds': 0.0,
+                                 'last_chunk_cpu_seconds': 0.0})
 
-        self._frame_bytes = (self._config.audio_width * self._config.frame_ms *
-                             self._config.sample_rate / 1000)
-        self._drop_start_bytes = (self._config.audio_width * drop_start_ms *
-                                  self._config.sample_rate / 1000)
+        logging.debug('__init__ with: %s', config)
+
+    @property
+    def noise_floor(self):
+        """ the tracked RMS of the background noise """
+        return self._noise.level
+
+    @property
+    def cpu_per_audio_second(self):
+        """ CPU seconds spent per second of audio analysed so far """
 
-        logging.debug('__init__ with: ' + config)
+        audio_seconds = self.stats.frames * self._config.frame_ms / 1000
+
+        if not audio_seconds:
+            return 0.0
+
+        return self.stats.cpu_seconds / audio_seconds
 
     def reset(self):
-        """ resets the stream buffer """
+        """ resets the stream buffer, the noise floor is kept """
 
-        self._silence_run_ms = 0
+        self._silence_run = 0
         self._dropped_bytes = 0
-        self._data = ''
+        del self._partial[:]
         logging.debug('reset()')
 
     def is_break(self, data):
@@ -48,24 +96,77 @@ class RmsSilenceDetector(object):
         if not data:
             return False
 
+        start_time = thread_time()
+        data = memoryview(data)
+
         if self._dropped_bytes < self._drop_start_bytes:
-            self._dropped_bytes += len(data)
-            return False
+            drop = min(len(data), self._drop_start_bytes - self._dropped_bytes)
+            self._dropped_bytes += drop
+            data = data[drop:]
+
+        rms = self._frame_rms(data)
+        found_break = False
+
+        if rms.size:
+            found_break = self._update_silence_run(rms)
+            self._noise.update(rms)
+
+        cpu_seconds = thread_time() - start_time
+        self.stats.chunks += 1
+        self.stats.frames += rms.size
+        self.stats.cpu_seconds += cpu_seconds
+        self.stats.last_chunk_cpu_seconds = cpu_seconds
+
+        return found_break
+
+    def _frame_rms(self, data):
+        """ returns the RMS of every frame completed by data """
+
+        frame_bytes = self._frame_bytes
+        head = []
+
+        if self._partial:
+            needed = frame_bytes - len(self._partial)
+            self._partial.extend(data[:needed])
+            data = data[needed:]
+
+            if len(self._partial) < frame_bytes:
+                return numpy.empty(0)
+
+            head.append(bytes(self._partial))
+            del self._partial[:]
+
+        frame_count = len(data) // frame_bytes
+        self._partial.extend(data[frame_count * frame_bytes:])
+
+        frames = [numpy.frombuffer(frame, self._sample_type)
+                  for frame in head]
+        frames.append(numpy.frombuffer(data, self._sample_type,
+                                       frame_count * self._frame_samples))
+        samples = numpy.concatenate(frames) if head else frames[0]
+        samples = samples.astype(numpy.float32).reshape(
+            -1, self._frame_samples)
+
+        return numpy.sqrt(numpy.einsum('ij,ij->i', samples, samples) /
+                          self._frame_samples)
 
-        self._data += data
+    def _threshold(self):
+        if self._config.silence_rms is not None:
+            return self._config.silence_rms
 
-        while len(self._data) >= self._frame_bytes:
-            frame = self._data[:self._frame_bytes]
-            self._data = self._data[self._frame_bytes:]
+        return self._noise.threshold(self._config.noise_ratio,
+                                     self._config.min_rms)
 
-            rms = audioop.rms(frame, self._config.audio_width)
+    def _update_silence_run(self, rms):
+        """ tracks the run of silent frames, True once it is long enough """
 
-            if rms > self._config.silence_rms:
-                self._silence_run_ms = 0
-            else:
-                self._silence_run_ms += self._config.frame_ms
+        speech = rms > self._threshold()
+        indices = numpy.arange(rms.size)
+        last_speech = numpy.maximum.accumulate(
+            numpy.where(speech, indices, -1))
+        runs = indices - last_speech
+        runs[last_speech < 0] += self._silence_run
 
-            if self._silence_run_ms >= self._config.silence_ms:
-                return True
+        self._silence_run = int(runs[-1])
 
-        return False
+        return bool((runs >= self._silence_frames).any())
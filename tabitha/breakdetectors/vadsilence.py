@@ -6,33 +6,33 @@ from __future__ import unicode_literals
 from __future__ import division
 import logging
 import webrtcvad
-from tabitha.objectdict import ObjectDict
+from tabitha.breakdetectors.framer import Framer
 
 
 class VadSilenceDetector(object):
-    """ detects a run of vocal silence in an audio data stream """
+    """ detects a run of vocal silence in an audio data stream
+
+        Frames are handed to webrtcvad as memoryviews by a Framer, so a
+        large backlog costs the same per frame as a single chunk.
+    """
 
     def __init__(self, config=None):
         config = config or {}
         aggressiveness_mode = config.get('break.vad.aggressiveness_mode', 2)
         drop_start_ms = config.get('break.vad.drop_start_ms', 60)
+        audio_width = config.get('audio.width', 2)
 
-        self._config = ObjectDict({
-            'frame_ms': config.get('break.vad.frame_ms', 30),
-            'silence_ms': config.get('break.vad.silence_ms', 400),
-            'sample_rate': config.get('audio.sample_rate', 16000),
-            'audio_width': config.get('audio.width', 2)})
+        self._frame_ms = config.get('break.vad.frame_ms', 30)
+        self._silence_ms = config.get('break.vad.silence_ms', 400)
+        self._sample_rate = config.get('audio.sample_rate', 16000)
 
         self._dropped_bytes = 0
         self._silence_run_ms = 0
-        self._data = b''
 
-        self._frame_bytes = int(self._config.audio_width *
-                                self._config.frame_ms *
-                                self._config.sample_rate / 1000)
-        self._drop_start_bytes = int(self._config.audio_width *
-                                     drop_start_ms *
-                                     self._config.sample_rate / 1000)
+        self._framer = Framer(int(self._frame_ms * self._sample_rate /
+                                  1000) * audio_width)
+        self._drop_start_bytes = int(drop_start_ms * self._sample_rate /
+                                     1000) * audio_width
 
         self._vad = webrtcvad.Vad(aggressiveness_mode)
 
@@ -43,7 +43,7 @@ class VadSilenceDetector(object):
 
         self._silence_run_ms = 0
         self._dropped_bytes = 0
-        self._data = b''
+        self._framer.reset()
         logging.debug('reset()')
 
     def is_break(self, data):
@@ -53,23 +53,25 @@ class VadSilenceDetector(object):
             return False
 
         if self._dropped_bytes < self._drop_start_bytes:
-            self._dropped_bytes += len(data)
-            return False
-
-        self._data += data
-
-        while len(self._data) >= self._frame_bytes:
-            frame = self._data[:self._frame_bytes]
-            self._data = self._data[self._frame_bytes:]
-
-            is_speech = self._vad.is_speech(frame, self._config.sample_rate)
-
-            if is_speech:
-                self._silence_run_ms = 0
+            drop = min(len(data), self._drop_start_bytes - self._dropped_bytes)
+            self._dropped_bytes += drop
+            data = memoryview(data)[drop:]
+
+        is_speech = self._vad.is_speech
+        sample_rate = self._sample_rate
+        frame_ms = self._frame_ms
+        silence_ms = self._silence_ms
+        silence_run_ms = self._silence_run_ms
+
+        for frame in self._framer.frames(data):
+            if is_speech(frame, sample_rate):
+                silence_run_ms = 0
             else:
-                self._silence_run_ms += self._config.frame_ms
+                silence_run_ms += frame_ms
 
-            if self._silence_run_ms >= self._config.silence_ms:
+            if silence_run_ms >= silence_ms:
+                self._silence_run_ms = silence_run_ms
                 return True
 
+        self._silence_run_ms = silence_run_ms
         return False
@@ -0,0 +1,103 @@
+""" CaptureStream hands out captured audio while it is still being spoken """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from tabitha.metrics import monotonic_time
+
+
+class CaptureStream(object):
+    """ iterator and file-like view of a capture that ends at a break
+
+        Each chunk is passed to is_break, usually a break detector's
+        is_break, as it is pulled, so a handler reading the stream drives
+        endpointing itself and can upload while the user is still talking.
+        read(size) behaves like a raw stream: it blocks until some audio is
+        available and returns at most size bytes, b'' means the capture is
+        complete. first_read_time is the monotonic time audio was first
+        pulled, when a handler streaming the capture opened its request.
+    """
+
+    def __init__(self, audio_buffer, is_break, is_active,
+                 wait_timeout=0.5, on_complete=None):
+        self._buffer = audio_buffer
+        self._is_break = is_break
+        self._is_active = is_active
+        self._wait_timeout = wait_timeout
+        self._on_complete = on_complete
+        self._reader = audio_buffer.capture_reader()
+        self._pending = bytearray()
+        self.closed = False
+        self.first_read_time = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = self._next_chunk()
+
+        if chunk is None:
+            raise StopIteration
+
+        return chunk
+
+    next = __next__
+
+    def _next_chunk(self):
+        if self.first_read_time is None:
+            self.first_read_time = monotonic_time()
+
+        while not self.closed:
+            remaining = self._buffer.capture_end - self._reader.position
+
+            if remaining > 0:
+                data = self._reader.read(remaining)
+
+                if self._is_break(data):
+                    self._buffer.stop_capture()
+                    self._finish()
+
+                return bytes(data)
+
+            if not self._buffer.is_capturing or not self._is_active():
+                self._finish()
+                break
+
+            self._reader.wait(self._wait_timeout)
+
+        return None
+
+    def _finish(self):
+        if self.closed:
+            return
+
+        self.closed = True
+
+        if self._on_complete:
+            self._on_complete(self._buffer.get_capture_data())
+
+    def read(self, size=-1):
+        """ returns up to size bytes of audio, or everything left if size is
+            negative, b'' once the capture has ended """
+
+        if size is None or size < 0:
+            for chunk in self:
+                self._pending.extend(chunk)
+        elif not self._pending:
+            chunk = self._next_chunk()
+
+            if chunk is not None:
+                self._pending.extend(chunk)
+
+        if size is None or size < 0:
+            size = len(self._pending)
+
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+
+        return data
+
+    def close(self):
+        """ stops capturing and ends the stream """
+
+        self._buffer.stop_capture()
+        self._finish()
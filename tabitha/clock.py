@@ -0,0 +1,46 @@
+""" clocks used to measure timeouts against the audio being processed """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import threading
+import time
+
+
+class SystemClock(object):
+    """ wall clock time, used for live audio sources """
+
+    @staticmethod
+    def time():
+        """ returns the current time in seconds """
+        return time.time()
+
+    @staticmethod
+    def sleep(seconds):
+        """ blocks for the given number of seconds """
+        time.sleep(seconds)
+
+
+class VirtualClock(object):
+    """ time that only moves when audio is delivered
+
+        sources replaying recordings faster than real time advance it by
+        the duration of each chunk, so timeouts measured with it behave as
+        if the recording was being spoken live """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def time(self):
+        """ returns the current virtual time in seconds """
+        return self._now
+
+    def advance(self, seconds):
+        """ moves the clock forward """
+
+        with self._lock:
+            self._now += seconds
+
+    def sleep(self, seconds):
+        """ advances the clock instead of blocking """
+        self.advance(seconds)
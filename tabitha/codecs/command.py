@@ -0,0 +1,91 @@
+""" encodes captures with an external program, e.g. opusenc or flac """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import logging
+import resource
+import subprocess
+import threading
+from tabitha.codecs.encoder import Encoder
+
+
+class CommandEncoder(Encoder):
+    """ pipes the capture through an encoder program as it arrives
+
+        command reads raw PCM on stdin and writes the encoding to stdout,
+        e.g. ['flac', '--silent', '--force-raw-format', '--endian=little',
+        '--sign=signed', '--channels=1', '--bps=16', '--sample-rate=16000',
+        '-'] or an opusenc --raw equivalent. Encoded output is collected by
+        a thread and handed out by encode() as it becomes available. The
+        program's CPU is taken from the children's resource usage when it
+        exits, so it only appears in stats after finish().
+    """
+
+    name = None
+
+    def __init__(self, config=None, name=None, command=None):
+        super(CommandEncoder, self).__init__(config)
+
+        if not command:
+            raise ValueError('CommandEncoder requires a command')
+
+        self.name = name
+        self._output = bytearray()
+        self._lock = threading.Lock()
+        self._children_cpu = self._child_cpu_seconds()
+        self._process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+
+        self._read_thread = threading.Thread(target=self._read_output)
+        self._read_thread.daemon = True
+        self._read_thread.start()
+
+    @staticmethod
+    def _child_cpu_seconds():
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    def _read_output(self):
+        while True:
+            data = self._process.stdout.read1(65536)
+
+            if not data:
+                break
+
+            with self._lock:
+                self._output.extend(data)
+
+    def _take_output(self):
+        with self._lock:
+            data = bytes(self._output)
+            del self._output[:]
+
+        return data
+
+    def _encode(self, data):
+        try:
+            self._process.stdin.write(data)
+            self._process.stdin.flush()
+        except (IOError, OSError):
+            logging.warning('%s encoder exited early', self.name)
+
+        return self._take_output()
+
+    def _finish(self):
+        try:
+            self._process.stdin.close()
+        except (IOError, OSError):
+            pass
+
+        self._process.wait()
+        self._read_thread.join()
+
+        if self._process.returncode != 0:
+            logging.warning('%s encoder exited with %s', self.name,
+                            self._process.returncode)
+
+        self.stats.cpu_seconds += (self._child_cpu_seconds() -
+                                   self._children_cpu)
+
+        return self._take_output()
@@ -0,0 +1,156 @@
+""" the shared parts of capture encoders """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+from tabitha.metrics import thread_time
+from tabitha.objectdict import ObjectDict
+
+
+class EncodedAudio(bytes):
+    """ encoded capture data, codec names the encoding """
+
+    codec = 'pcm'
+
+    def __new__(cls, data, codec):
+        encoded = super(EncodedAudio, cls).__new__(cls, data)
+        encoded.codec = codec
+        return encoded
+
+
+class Encoder(object):
+    """ incremental encoder of 16-bit PCM audio
+
+        Subclasses implement _encode(data) and may implement _finish().
+        encode() can be called with each chunk as it is captured, so only
+        the last chunk and finish() remain at the end of speech. stats
+        counts the PCM and encoded bytes and the thread CPU spent, from
+        which compression_ratio and cpu_per_audio_second are derived.
+    """
+
+    name = None
+
+    def __init__(self, config=None):
+        config = config or {}
+        self._bytes_per_second = (config.get('audio.sample_rate', 16000) *
+                                  config.get('audio.width', 2) *
+                                  config.get('audio.channels', 1))
+        self.stats = ObjectDict({'input_bytes': 0, 'output_bytes': 0,
+                                 'cpu_seconds': 0.0})
+
+    @property
+    def compression_ratio(self):
+        """ PCM bytes per encoded byte """
+
+        if not self.stats.output_bytes:
+            return None
+
+        return self.stats.input_bytes / self.stats.output_bytes
+
+    @property
+    def cpu_per_audio_second(self):
+        """ encoder CPU seconds per second of audio """
+
+        if not self.stats.input_bytes:
+            return None
+
+        return self.stats.cpu_seconds / (self.stats.input_bytes /
+                                         self._bytes_per_second)
+
+    def encode(self, data):
+        """ returns the encoding of the next chunk of PCM """
+
+        start_time = thread_time()
+        encoded = self._encode(data)
+        self.stats.cpu_seconds += thread_time() - start_time
+        self.stats.input_bytes += len(data)
+        self.stats.output_bytes += len(encoded)
+
+        return encoded
+
+    def finish(self):
+        """ returns any encoded data still held back by the encoder """
+
+        start_time = thread_time()
+        encoded = self._finish()
+        self.stats.cpu_seconds += thread_time() - start_time
+        self.stats.output_bytes += len(encoded)
+
+        return encoded
+
+    def _encode(self, data):
+        raise NotImplementedError()
+
+    def _finish(self):
+        # pylint: disable=no-self-use
+        return b''
+
+
+class CaptureEncoder(object):
+    """ encodes an AudioBuffer's capture while it is being captured
+
+        update() encodes the audio captured since the last call and is
+        called by the client as each chunk arrives; finish() encodes the
+        rest once the capture has stopped and returns the complete
+        EncodedAudio.
+    """
+
+    def __init__(self, audio_buffer, encoder):
+        self._buffer = audio_buffer
+        self._encoded = bytearray()
+        self._position = 0
+        self.encoder = encoder
+
+    def update(self):
+        """ encodes newly captured audio """
+
+        data = self._buffer.get_capture_view(self._position)
+
+        if len(data):
+            self._position += len(data)
+            self._encoded.extend(self.encoder.encode(data))
+
+    def finish(self):
+        """ returns the encoded capture """
+
+        self.update()
+        self._encoded.extend(self.encoder.finish())
+
+        return EncodedAudio(self._encoded, self.encoder.name)
+
+
+class EncodingStream(object):
+    """ file-like stream of the encoding of a CaptureStream """
+
+    def __init__(self, stream, encoder):
+        self._stream = stream
+        self._pending = bytearray()
+        self.encoder = encoder
+        self.codec = encoder.name
+        self.closed = False
+
+    def read(self, size=-1):
+        """ returns up to size bytes of encoded audio, b'' at the end """
+
+        read_all = size is None or size < 0
+
+        while not self.closed and (read_all or not self._pending):
+            data = self._stream.read(-1 if read_all else size)
+
+            if data:
+                self._pending.extend(self.encoder.encode(data))
+            else:
+                self._pending.extend(self.encoder.finish())
+                self.closed = True
+
+        if read_all:
+            size = len(self._pending)
+
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+
+        return data
+
+    def close(self):
+        """ ends the underlying capture """
+        self._stream.close()
@@ -0,0 +1,14 @@
+""" passes PCM capture audio through unchanged """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from tabitha.codecs.encoder import Encoder
+
+
+class PcmEncoder(Encoder):
+    """ passes audio through, the encoding every handler accepts """
+
+    name = 'pcm'
+
+    def _encode(self, data):
+        return bytes(data)
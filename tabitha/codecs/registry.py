@@ -0,0 +1,61 @@
+""" looks up capture encoders by name and picks one for a handler """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import importlib
+from tabitha.codecs.command import CommandEncoder
+from tabitha.codecs.pcm import PcmEncoder
+
+# 'module:attribute' factories are imported when first created
+_CODECS = {'pcm': PcmEncoder, 'ulaw': 'tabitha.codecs.ulaw:MuLawEncoder'}
+
+
+def register_codec(name, factory):
+    """ makes factory(config) available as the encoder for name, e.g. an
+        Opus or FLAC Encoder subclass or a 'module:attribute' string """
+    _CODECS[name] = factory
+
+
+def create_encoder(name, config=None):
+    """ returns a new encoder for the named codec
+
+        codecs.commands maps further names to CommandEncoder commands """
+
+    config = config or {}
+    command = config.get('codecs.commands', {}).get(name)
+
+    if command:
+        return CommandEncoder(config, name, command)
+
+    if name not in _CODECS:
+        raise ValueError('unknown codec %s' % name)
+
+    factory = _CODECS[name]
+
+    if isinstance(factory, str):
+        module_name, _, attribute = factory.partition(':')
+        factory = getattr(importlib.import_module(module_name), attribute)
+        _CODECS[name] = factory
+
+    return factory(config)
+
+
+def available_codecs(config=None):
+    """ returns the names of all codecs which can be created """
+
+    config = config or {}
+    return set(_CODECS) | set(config.get('codecs.commands', {}))
+
+
+def negotiate(handler, preferred, config=None):
+    """ returns the first codec in the handler's codecs, in the handler's
+        order of preference, which is also in preferred and available,
+        falling back to pcm which every handler accepts """
+
+    available = available_codecs(config)
+
+    for name in getattr(handler, 'codecs', ('pcm',)):
+        if name in preferred and name in available:
+            return name
+
+    return 'pcm'
@@ -0,0 +1,60 @@
+""" G.711 mu-law, halving capture uploads with numpy alone """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import numpy
+from tabitha.codecs.encoder import Encoder
+
+_BIAS = 0x84
+_BIAS_14 = 0x21
+
+
+def encode(data):
+    """ returns the mu-law encoding of 16-bit little endian PCM, the same
+        as audioop.lin2ulaw """
+
+    samples = numpy.frombuffer(data, '<i2', len(data) // 2).astype(
+        numpy.int32) >> 2
+    negative = samples < 0
+    magnitude = numpy.minimum(numpy.where(negative, -samples, samples) +
+                              _BIAS_14, 0x1FFF)
+    exponent = numpy.frexp(magnitude)[1] - 6
+    mantissa = (magnitude >> (exponent + 1)) & 0x0F
+    mask = numpy.where(negative, 0x7F, 0xFF)
+
+    return (((exponent << 4) | mantissa) ^ mask).astype(
+        numpy.uint8).tobytes()
+
+
+def decode(data):
+    """ returns 16-bit little endian PCM from mu-law data """
+
+    codes = ~numpy.frombuffer(data, numpy.uint8).astype(numpy.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    magnitude = ((((codes & 0x0F) << 3) + _BIAS) << exponent) - _BIAS
+    samples = numpy.where(codes & 0x80, -magnitude, magnitude)
+
+    return samples.astype('<i2').tobytes()
+
+
+class MuLawEncoder(Encoder):
+    """ encodes 16-bit PCM as 8-bit G.711 mu-law, a 2:1 reduction at a
+        fraction of a millisecond of CPU per second of audio """
+
+    name = 'ulaw'
+
+    def __init__(self, config=None):
+        config = config or {}
+
+        if config.get('audio.width', 2) != 2:
+            raise ValueError('MuLawEncoder only encodes 16-bit audio')
+
+        super(MuLawEncoder, self).__init__(config)
+        self._odd_byte = b''
+
+    def _encode(self, data):
+        data = self._odd_byte + bytes(data)
+        even_length = len(data) & ~1
+        self._odd_byte = data[even_length:]
+
+        return encode(data[:even_length])
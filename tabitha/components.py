@@ -0,0 +1,140 @@
+""" looks up sources, detectors, outputs and handlers by name and builds
+    them on first use """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import importlib
+import threading
+from tabitha.metrics import monotonic_time
+from tabitha.objectdict import ObjectDict
+
+# factories are 'module:attribute' strings until first used, so importing
+# tabitha does not import pyaudio, webrtcvad or the snowboy library
+_COMPONENTS = {
+    'source': {
+        'pyaudio': 'tabitha.sources.pyaudiosource:PyAudioSource'},
+    'trigger': {
+        'snowboy': 'tabitha.triggers.snowboy:SnowboyTriggerDetector',
+        'gated': 'tabitha.triggers.gated:GatedTriggerDetector',
+        'process': 'tabitha.detectorprocess:ProcessTriggerDetector'},
+    'break': {
+        'vad': 'tabitha.breakdetectors.vadsilence:VadSilenceDetector',
+        'rms': 'tabitha.breakdetectors.rmssilence:RmsSilenceDetector',
+        'process': 'tabitha.detectorprocess:ProcessBreakDetector'},
+    # outputs return from play_audio(audio, on_finish_cb), or from
+    # play(path, on_finish_cb) when they have no play_audio, straight away
+    # and call on_finish_cb when playback ends, as VoiceClient expects
+    'output': {
+        'vlc': 'tabitha.outputs.vlcoutput:VlcOutput',
+        'vlc.persistent': 'tabitha.outputs.vlcoutput:PersistentVlcOutput',
+        'mixer': 'tabitha.outputs.mixeroutput:MixerOutput',
+        'pyaudio': 'tabitha.outputs.pyaudiooutput:PyAudioOutput'},
+    'handler': {
+        'alexa': 'tabitha.handlers.alexa:AlexaVoiceService'}}
+
+# reentrant, as modules imported by resolve() may register components
+_LOCK = threading.RLock()
+
+# 'kind.name' to the seconds its import and its last construction took
+load_times = {}
+
+
+def register_component(kind, name, factory):
+    """ makes factory(config, *args) available as the named component of
+        kind, factory may be a 'module:attribute' string imported on first
+        use """
+
+    with _LOCK:
+        _COMPONENTS.setdefault(kind, {})[name] = factory
+
+
+def available_components(kind):
+    """ returns the names registered for kind """
+    return set(_COMPONENTS.get(kind, {}))
+
+
+def component_name(kind, config=None):
+    """ returns the name of the component of kind that config selects,
+        <kind>.component if set, otherwise the default, which the older
+        trigger.process, break.process, output.mixer and
+        output.vlc.persistent flags still choose """
+
+    config = config or {}
+    name = config.get(kind + '.component')
+
+    if name:
+        return name
+
+    if kind in ('trigger', 'break') and config.get(kind + '.process'):
+        return 'process'
+
+    if kind == 'output':
+        if config.get('output.mixer'):
+            return 'mixer'
+
+        if config.get('output.vlc.persistent'):
+            return 'vlc.persistent'
+
+    return {'source': 'pyaudio', 'trigger': 'snowboy', 'break': 'vad',
+            'output': 'vlc', 'handler': 'alexa'}.get(kind)
+
+
+def _times(kind, name):
+    key = '%s.%s' % (kind, name)
+
+    if key not in load_times:
+        load_times[key] = ObjectDict({'import_seconds': 0.0,
+                                      'construct_seconds': None})
+
+    return load_times[key]
+
+
+def resolve(kind, name):
+    """ returns the factory of the named component, importing it once """
+
+    with _LOCK:
+        factories = _COMPONENTS.get(kind, {})
+
+        if name not in factories:
+            raise ValueError('unknown %s component %s' % (kind, name))
+
+        factory = factories[name]
+
+        if not isinstance(factory, str):
+            return factory
+
+        module_name, _, attribute = factory.partition(':')
+        start_time = monotonic_time()
+        factory = getattr(importlib.import_module(module_name), attribute)
+        _times(kind, name).import_seconds = monotonic_time() - start_time
+        factories[name] = factory
+
+        return factory
+
+
+def create_component(kind, config=None, *args, **kwargs):
+    """ builds the component of kind that config selects, or the one
+        named by name, passing config and args to its factory
+
+        The import and construction times are kept in load_times and,
+        given metrics, observed as startup.<kind>.import and
+        startup.<kind>.construct """
+
+    config = config or {}
+    name = kwargs.pop('name', None) or component_name(kind, config)
+    metrics = kwargs.pop('metrics', None)
+    first_use = isinstance(_COMPONENTS.get(kind, {}).get(name), str)
+    factory = resolve(kind, name)
+    start_time = monotonic_time()
+    component = factory(config, *args, **kwargs)
+    times = _times(kind, name)
+    times.construct_seconds = monotonic_time() - start_time
+
+    if metrics is not None:
+        if first_use:
+            metrics.observe('startup.%s.import' % kind, times.import_seconds)
+
+        metrics.observe('startup.%s.construct' % kind,
+                        times.construct_seconds)
+
+    return component
@@ -0,0 +1,245 @@
+""" runs dialogs with a handler, overlapping their stages """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import collections
+from tabitha.metrics import monotonic_time
+from tabitha.objectdict import ObjectDict
+
+# derived durations, each the time between two timeline events
+_DURATIONS = (
+    ('capture_s', 'capture_start', 'capture_end'),
+    ('upload_overlap_s', 'request_open', 'capture_end'),
+    ('response_wait_s', 'capture_end', 'response'),
+    ('output_start_s', 'response', 'output_start'),
+    ('playback_s', 'output_start', 'playback_end'),
+    ('turn_s', 'start', 'playback_end'))
+
+
+def _expects_more_dialog(response):
+    if hasattr(response, 'get'):
+        return bool(response.get('expects_more_dialog'))
+
+    return bool(getattr(response, 'expects_more_dialog', False))
+
+
+class Turn(object):
+    """ one request and response of a conversation
+
+        timeline lists (event, seconds) in the order the events happened,
+        seconds counted from the turn's start: the trigger, or the end of
+        the previous turn's playback for follow-ups.
+    """
+
+    def __init__(self, index, follow_up, start):
+        self.index = index
+        self.follow_up = follow_up
+        self.start = start
+        self.timeline = []
+        self.response = None
+        self.interrupted = None
+
+    def mark(self, event, at=None):
+        """ records an event, at a monotonic time or now """
+
+        if at is None:
+            at = monotonic_time()
+
+        self.timeline.append((event, at - self.start))
+
+    def at(self, event):
+        """ seconds from the start to the event, None if it did not happen """
+
+        if event == 'start':
+            return 0.0
+
+        for name, seconds in self.timeline:
+            if name == event:
+                return seconds
+
+        return None
+
+    @property
+    def summary(self):
+        """ durations between the timeline's events, None where missing
+
+            upload_overlap_s is how long the handler request was open while
+            the user was still speaking, None when it only opened after the
+            capture, and rearm_s how long after the previous playback ended
+            the follow-up capture started """
+
+        summary = ObjectDict({'index': self.index,
+                              'follow_up': self.follow_up,
+                              'interrupted': self.interrupted is not None})
+
+        for name, first, last in _DURATIONS:
+            first_at, last_at = self.at(first), self.at(last)
+            summary[name] = (last_at - first_at
+                             if first_at is not None and last_at is not None
+                             else None)
+
+        if summary.upload_overlap_s is not None and \
+                summary.upload_overlap_s <= 0:
+            summary.upload_overlap_s = None
+
+        summary.rearm_s = self.at('capture_start') if self.follow_up else None
+
+        return summary
+
+
+class Conversation(object):
+    """ runs the trigger, capture, ask and play loop of a voice assistant
+
+        Unlike calling VoiceClient's methods one after another each stage
+        starts as early as it can. Handlers with ask_stream() are given a
+        capture stream as soon as the capture starts, so the request is
+        open and uploading while the user speaks. Responses with an
+        audio_stream are decoded by outputs with play_audio() while they
+        arrive. When a response expects more dialog, and
+        conversation.follow_up is set (the default), the follow-up is sent
+        with respond_to() from a capture starting where playback ended,
+        whatever audio arrived since is not lost. A trigger during
+        playback interrupts it and starts a new dialog straight away.
+
+        Each turn's Turn, with its timeline, is kept in turns, the last
+        conversation.history (default 100) of them.
+    """
+
+    def __init__(self, client, handler, config=None):
+        config = config or {}
+        self._client = client
+        self._handler = handler
+        self._config = ObjectDict({
+            'follow_up': config.get('conversation.follow_up', True),
+            'stop_on': config.get('conversation.stop_on', None),
+            'trigger_timeout': config.get('conversation.trigger_timeout',
+                                          None)})
+        self.turns = collections.deque(
+            maxlen=config.get('conversation.history', 100))
+        self._pending = ObjectDict({'trigger': None, 'follow_up': None})
+
+    @property
+    def expects_follow_up(self):
+        """ True if the next turn continues the dialog without a trigger """
+        return self._pending.follow_up is not None
+
+    def _start_turn(self):
+        """ waits for a trigger unless one is pending, returns the Turn """
+
+        client = self._client
+        follow_up = self._pending.follow_up is not None
+
+        if follow_up:
+            return Turn(len(self.turns), True,
+                        client.timings.playback_end or monotonic_time())
+
+        trigger_result = self._pending.trigger
+
+        if trigger_result is None:
+            trigger_result = client.wait_for_trigger(
+                timeout=self._config.trigger_timeout)
+
+            if not trigger_result:
+                return None
+
+        turn = Turn(len(self.turns), False, monotonic_time())
+        turn.mark('trigger', turn.start)
+
+        return turn
+
+    def _preroll_ms(self, turn):
+        """ a follow-up's capture starts at the end of the playback """
+
+        return self._client.ms_since_playback if turn.follow_up else None
+
+    def _request(self, turn):
+        client = self._client
+        handler = self._handler
+        name = 'respond_to' if turn.follow_up else 'ask'
+        preroll_ms = self._preroll_ms(turn)
+
+        if hasattr(handler, name + '_stream'):
+            audio_data = client.capture_stream(preroll_ms)
+            turn.mark('capture_start', client.timings.capture_start)
+        else:
+            audio_data = client.capture_until_break(preroll_ms)
+            turn.mark('capture_start', client.timings.capture_start)
+
+            if not audio_data:
+                return None
+
+            turn.mark('capture_end', client.timings.break_time)
+
+        if turn.follow_up:
+            response = client.respond_to(handler, audio_data,
+                                         self._pending.follow_up)
+        else:
+            response = client.ask(handler, audio_data)
+
+        if turn.at('capture_end') is None and client.timings.break_time:
+            turn.mark('capture_end', client.timings.break_time)
+
+        # the request opened when the handler first read the stream
+        request_open = getattr(audio_data, 'first_read_time', None)
+
+        if request_open is not None:
+            turn.mark('request_open', request_open)
+
+        turn.mark('response')
+
+        return response
+
+    def run_turn(self):
+        """ runs one turn, returns its Turn or None when the client stops
+            listening or no trigger came within conversation.trigger_timeout
+        """
+
+        turn = self._start_turn()
+
+        if turn is None:
+            return None
+
+        self._pending.trigger = None
+        response = self._request(turn)
+        self._pending.follow_up = None
+        turn.response = response
+        self.turns.append(turn)
+
+        if response is None:
+            return turn
+
+        client = self._client
+        turn.interrupted = client.play(response, self._config.stop_on)
+        timings = client.timings
+        turn.mark('play_start', timings.play_start)
+        turn.mark('output_start', timings.output_start)
+
+        if turn.interrupted:
+            turn.mark('interrupted')
+            self._pending.trigger = turn.interrupted
+        else:
+            turn.mark('playback_end', timings.playback_end)
+
+            if self._config.follow_up and _expects_more_dialog(response):
+                self._pending.follow_up = response
+
+        turn.timeline.sort(key=lambda event: event[1])
+
+        return turn
+
+    def run(self, max_turns=None):
+        """ runs turns while the client listens, at most max_turns """
+
+        turns = 0
+
+        while self._client.is_listening:
+            if max_turns is not None and turns >= max_turns:
+                break
+
+            if self.run_turn() is None:
+                break
+
+            turns += 1
+
+        return turns
@@ -0,0 +1,222 @@
+""" runs trigger and break detectors in worker processes """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+
+# config values which can be handed to a worker, i.e. not live objects
+_PLAIN_TYPES = (bool, int, float, str, bytes, list, tuple, dict, type(None))
+# the sequence of the reply a worker sends once its detector is built
+_READY = -1
+
+
+def _worker_main(connection, factory, config, ring_name):
+    """ serves detector calls until told to stop """
+
+    ring = None
+
+    try:
+        if ring_name:
+            from tabitha.sharedringbuffer import SharedRingBuffer
+            ring = SharedRingBuffer.attach(ring_name)
+
+        detector = factory(config)
+    except Exception as error:  # pylint: disable=broad-except
+        connection.send((_READY, '%s: %s' % (type(error).__name__, error)))
+        return
+
+    connection.send((_READY, None))
+
+    try:
+        while True:
+            message = connection.recv()
+
+            if message is None:
+                break
+
+            sequence, method, start, end, data = message
+
+            if method == 'reset':
+                reset = getattr(detector, 'reset', None)
+                connection.send((sequence, reset() if reset else None))
+                continue
+
+            if data is None:
+                data = ring.copy(start, end)
+
+                if data is None:
+                    logging.warning('detector worker was lapped, skipping ' +
+                                    'audio %d-%d', start, end)
+                    connection.send((sequence, None))
+                    continue
+
+            connection.send((sequence, getattr(detector, method)(data)))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        if ring:
+            ring.close()
+
+
+class DetectorProcess(object):
+    """ hosts a detector in a worker process
+
+        factory(config) builds the detector inside the worker, so its
+        native library and its CPU use stay out of the client's process
+        and GIL. When audio_buffer is shared (audio.buffer.shared) and the
+        data passed in is a view of its ring, only the ring positions
+        cross the pipe and the worker reads the audio from shared memory,
+        other data is sent over the pipe. Calls block until the worker
+        replies, which releases the GIL while the detector runs. Requests
+        carry a sequence number, so a reply arriving after its call timed
+        out is discarded rather than taken as the next call's.
+
+        start() waits up to detector.process.start_timeout (default 60)
+        seconds for the worker to build its detector, e.g. load a model,
+        so only the calls themselves are held to detector.process.timeout.
+    """
+
+    def __init__(self, factory, config=None, audio_buffer=None):
+        config = dict((key, value) for key, value in (config or {}).items()
+                      if isinstance(value, _PLAIN_TYPES))
+
+        self._timeout = config.get('detector.process.timeout', 2.0)
+        self._start_timeout = config.get('detector.process.start_timeout',
+                                         60.0)
+        self._ring = audio_buffer.ring if audio_buffer else None
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+        if not hasattr(self._ring, 'position_of'):
+            self._ring = None
+
+        self._connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_worker_main,
+            args=(child_connection, factory, config,
+                  self._ring.name if self._ring else None))
+        self._process.daemon = True
+
+        try:
+            self.start()
+        finally:
+            child_connection.close()
+
+    def start(self):
+        """ starts the worker, returns once its detector is built """
+
+        self._process.start()
+        deadline = time.time() + self._start_timeout
+
+        while not self._connection.poll(0.1):
+            if not self._process.is_alive():
+                raise ValueError('detector process exited while starting')
+
+            if time.time() >= deadline:
+                self.terminate()
+                raise ValueError('detector process did not start within ' +
+                                 '%s seconds' % self._start_timeout)
+
+        _, error = self._connection.recv()
+
+        if error:
+            self._process.join(self._timeout)
+            raise ValueError('detector process failed to start, %s' % error)
+
+    def call(self, method, data=None):
+        """ calls method on the worker's detector with data """
+
+        start, end = None, None
+
+        if method != 'reset':
+            position = self._ring.position_of(data) if self._ring else None
+
+            if position:
+                start, end = position
+                data = None
+            else:
+                data = bytes(data)
+
+        with self._lock:
+            sequence = next(self._sequence)
+            self._connection.send((sequence, method, start, end, data))
+            deadline = time.time() + self._timeout
+
+            while True:
+                remaining = deadline - time.time()
+
+                if remaining <= 0 or not self._connection.poll(remaining):
+                    raise ValueError('detector process did not reply ' +
+                                     'within %s seconds' % self._timeout)
+
+                reply_sequence, result = self._connection.recv()
+
+                if reply_sequence == sequence:
+                    return result
+
+                logging.debug('discarding late detector reply %d',
+                              reply_sequence)
+
+    def terminate(self):
+        """ stops the worker process """
+
+        if not self._process.is_alive():
+            return
+
+        with self._lock:
+            self._connection.send(None)
+
+        self._process.join(self._timeout)
+
+        if self._process.is_alive():
+            self._process.terminate()
+
+        self._connection.close()
+
+
+class ProcessTriggerDetector(DetectorProcess):
+    """ trigger detector whose detect() runs in a worker process """
+
+    def __init__(self, config=None, audio_buffer=None, factory=None):
+        if factory is None:
+            from tabitha.triggers.snowboy import SnowboyTriggerDetector
+            factory = SnowboyTriggerDetector
+
+        super(ProcessTriggerDetector, self).__init__(factory, config,
+                                                     audio_buffer)
+
+    def reset(self):
+        """ resets the worker's detector """
+        self.call('reset')
+
+    def detect(self, data):
+        """ returns the 1-based index of the word detected """
+        return self.call('detect', data)
+
+
+class ProcessBreakDetector(DetectorProcess):
+    """ break detector whose is_break() runs in a worker process """
+
+    def __init__(self, config=None, audio_buffer=None, factory=None):
+        if factory is None:
+            from tabitha.breakdetectors.vadsilence import VadSilenceDetector
+            factory = VadSilenceDetector
+
+        super(ProcessBreakDetector, self).__init__(factory, config,
+                                                   audio_buffer)
+
+    def reset(self):
+        """ resets the worker's detector """
+        self.call('reset')
+
+    def is_break(self, data):
+        """ returns True once the worker's detector finds a break """
+
+        if not data:
+            return False
+
+        return self.call('is_break', data)
@@ -3,12 +3,94 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from __future__ import division
+import asyncio
+import collections
+import contextlib
+import functools
+import json
+import logging
 import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import simpleavs
+from tabitha.metrics import monotonic_time
+from tabitha.objectdict import ObjectDict
+
+# how often a dialog waiting for a pooled client checks it was cancelled
+_CANCEL_POLL = 0.1
+
+class _Cancelled(Exception):
+    """ raised in the upload thread once its dialog was cancelled """
+
+
+def _check_cancelled(cancelled):
+    if cancelled is not None and cancelled.is_set():
+        raise _Cancelled()
+
+
+class _StreamingBody(object):
+    """ file-like multipart body whose audio part is read from a stream
+
+        hyper takes a read shorter than it asked for as the end of the
+        body, so read(size) only returns less than size at the end. Once
+        cancelled is set read() raises _Cancelled, which aborts the
+        request rather than uploading the rest of the capture.
+    """
+
+    def __init__(self, header, audio_stream, footer, cancelled=None):
+        self._parts = [header, audio_stream, footer]
+        self._cancelled = cancelled
+
+    def read(self, size=-1):
+        """ returns the next size bytes of the body, b'' at the end """
+
+        block = bytearray()
+
+        while self._parts and (size < 0 or len(block) < size):
+            _check_cancelled(self._cancelled)
+            part = self._parts[0]
+            wanted = -1 if size < 0 else size - len(block)
+
+            if hasattr(part, 'read'):
+                data = part.read(wanted)
+            else:
+                data = part if wanted < 0 else part[:wanted]
+                self._parts[0] = part[len(data):]
+
+            if data:
+                block.extend(data)
+            else:
+                self._parts.pop(0)
+
+        return bytes(block)
 
 
 class AlexaVoiceService(object):
-    """ interface to Amazon Alexa Voice Services """
+    """ interface to Amazon Alexa Voice Services
+
+        ask/respond_to block the calling thread, ask_async/respond_to_async
+        are the async handler protocol used by AsyncVoiceClient and
+        ask_stream/respond_to_stream upload a CaptureStream while it is
+        still being captured.
+
+        Any number of dialogs can be in flight at once. Each has a Future,
+        resolved by the Speak directive carrying its dialog request id
+        whichever connection it arrives on, and a deadline of
+        handlers.alexa.response_timeout_ms from when it was asked, which
+        includes waiting for a connection. Uploads use a pool of
+        handlers.alexa.connections clients, connected and authenticated up
+        front. AVS expects one connection per device, so only raise it for
+        stand-ins such as FakeAvsClient, set as
+        handlers.alexa.client_factory. stats counts dialogs, timeouts and
+        Speak directives that matched no dialog.
+        Cancelling an ask_async/respond_to_async task stops its upload
+        and returns its client to the pool.
+    """
+
+    # simpleavs only sends AUDIO_L16_RATE_16000_CHANNELS_1
+    codecs = ('pcm',)
+
+    # pylint: disable=too-many-instance-attributes
 
     def __init__(self, config):
         avs_config = {
@@ -16,43 +98,234 @@ class AlexaVoiceService(object):
             'client_secret': config['handlers.alexa.client_secret'],
             'refresh_token': config['handlers.alexa.refresh_token'],
         }
+        self._audio_format = 'AUDIO_L16_RATE_%d_CHANNELS_1' % \
+            config.get('audio.sample_rate', 16000)
         self._response_timeout_ms = int(config.get(
             'handlers.alexa.response_timeout_ms', '30000')) / 1000
-        self._avs_client = simpleavs.AvsClient(avs_config)
-        self._avs_client.speech_synthesizer.speak_event += self._capture_speak
-        self._avs_client.connect()
-        self._current_dialog_id = None
-        self._dialog_response = None
-        self._got_dialog_response = threading.Event()
+        client_factory = config.get('handlers.alexa.client_factory',
+                                    simpleavs.AvsClient)
+        connections = int(config.get('handlers.alexa.connections', 1))
+
+        self._dialogs = {}
+        self._dialogs_lock = threading.Lock()
+        self._idle_clients = collections.deque()
+        self._client_waiters = collections.deque()
+        self._pool_lock = threading.Lock()
+        self.stats = ObjectDict({'dialogs': 0, 'in_flight': 0,
+                                 'max_in_flight': 0, 'timeouts': 0,
+                                 'unmatched_directives': 0})
+
+        def _connect(dummy_index):
+            client = client_factory(avs_config)
+            client.speech_synthesizer.speak_event += self._capture_speak
+            client.connect()
+            return client
+
+        with ThreadPoolExecutor(connections) as pool:
+            self._clients = list(pool.map(_connect, range(connections)))
+
+        self._idle_clients.extend(self._clients)
+        # a dialog's id is registered before a client is checked out, and
+        # its Speak directive may arrive on any connection, so every id
+        # comes from the first client's id service
+        self._id_service = self._clients[0].id_service
 
     def _capture_speak(self, speak_directive):
-        if speak_directive.dialog_request_id != self._current_dialog_id:
+        dialog_id = getattr(speak_directive, 'dialog_request_id', None)
+
+        with self._dialogs_lock:
+            future = self._dialogs.get(dialog_id)
+
+            if future is None:
+                self.stats.unmatched_directives += 1
+
+        if future is None:
+            logging.debug('Speak directive for unknown dialog %s', dialog_id)
             return
 
-        self._dialog_response = speak_directive
-        self._got_dialog_response.set()
+        if not future.done():
+            future.set_result(speak_directive)
 
-    def _speak_to_alexa(self, audio_data, dialog_id):
-        self._current_dialog_id = dialog_id
+    def _open_dialog(self, dialog_id):
+        """ registers a dialog, returns its future and deadline """
+
+        future = Future()
+
+        with self._dialogs_lock:
+            self._dialogs[dialog_id] = future
+            self.stats.dialogs += 1
+            self.stats.in_flight = len(self._dialogs)
+            self.stats.max_in_flight = max(self.stats.max_in_flight,
+                                           self.stats.in_flight)
+
+        return future, monotonic_time() + self._response_timeout_ms
+
+    def _close_dialog(self, dialog_id, timed_out):
+        with self._dialogs_lock:
+            self._dialogs.pop(dialog_id, None)
+            self.stats.in_flight = len(self._dialogs)
+
+            if timed_out:
+                self.stats.timeouts += 1
+
+    @staticmethod
+    def _remaining(deadline):
+        return max(0.0, deadline - monotonic_time())
 
-        self._avs_client.speech_recognizer.recognize(
-            audio_data=audio_data, profile='NEAR_FIELD',
-            dialog_request_id=dialog_id)
+    @contextlib.contextmanager
+    def _client(self, deadline, cancelled=None):
+        """ checks out a pooled client, waiting until the deadline or
+            until cancelled is set
 
-        got_response = self._got_dialog_response.wait(
-            self._response_timeout_ms)
-        self._got_dialog_response.clear()
+            clients are handed to waiters first come first served, so a
+            busy pool adds the same queueing delay to every dialog """
 
-        if got_response:
-            return self._dialog_response
+        with self._pool_lock:
+            if self._idle_clients and not self._client_waiters:
+                waiter = ObjectDict({'client': self._idle_clients.pop()})
+            else:
+                waiter = ObjectDict({'client': None,
+                                     'ready': threading.Event()})
+                self._client_waiters.append(waiter)
 
-        return None
+        if waiter.client is None:
+            # wake up now and then to notice a cancelled dialog
+            while not waiter.ready.wait(min(_CANCEL_POLL,
+                                            self._remaining(deadline))):
+                if (not self._remaining(deadline) or
+                        (cancelled is not None and cancelled.is_set())):
+                    break
+
+            with self._pool_lock:
+                if waiter.client is None:
+                    self._client_waiters.remove(waiter)
+                    _check_cancelled(cancelled)
+                    raise FutureTimeoutError()
+
+        try:
+            yield waiter.client
+        finally:
+            self._release_client(waiter.client)
+
+    def _release_client(self, client):
+        with self._pool_lock:
+            if not self._client_waiters:
+                self._idle_clients.append(client)
+                return
+
+            waiter = self._client_waiters.popleft()
+            waiter.client = client
+
+        waiter.ready.set()
+
+    def new_dialog_id(self):
+        """ returns an id for a new dialog, unique across the pool """
+
+        with self._dialogs_lock:
+            return self._id_service.get_new_dialog_id()
+
+    def _recognize(self, audio_data, dialog_id, deadline, cancelled=None):
+        """ uploads the audio, stopping early once cancelled is set, the
+            client goes back to the pool either way """
+
+        try:
+            with self._client(deadline, cancelled) as client:
+                _check_cancelled(cancelled)
+
+                if hasattr(audio_data, 'read'):
+                    self._recognize_stream(client, audio_data, dialog_id,
+                                           cancelled)
+                    return
+
+                client.speech_recognizer.recognize(
+                    audio_data=audio_data, profile='NEAR_FIELD',
+                    dialog_request_id=dialog_id)
+        except _Cancelled:
+            logging.debug('dialog %s was cancelled, upload stopped',
+                          dialog_id)
+
+    def _recognize_stream(self, client, audio_stream, dialog_id,
+                          cancelled=None):
+        # simpleavs only sends complete bodies, so build the Recognize
+        # event here with its internals and let hyper pull the audio part
+        # from the stream, or upload the complete capture without them
+        # pylint: disable=protected-access
+        try:
+            from simpleavs.connection import (
+                _START_AUDIO, _START_JSON, _SIMPLE_AVS_BOUNDARY)
+            connection = client._connection
+            send_request = connection._send_request
+            get_response = connection._get_response
+            process_response = connection._process_response
+            fetch_context = client._fetch_context
+        except (ImportError, AttributeError):
+            logging.warning('simpleavs cannot stream, uploading the ' +
+                            'complete capture')
+            client.speech_recognizer.recognize(
+                audio_data=audio_stream.read(), profile='NEAR_FIELD',
+                dialog_request_id=dialog_id)
+            return
+
+        header = {'namespace': 'SpeechRecognizer',
+                  'name': 'Recognize',
+                  'dialogRequestId': dialog_id,
+                  'messageId': client.id_service.get_new_message_id()}
+        event = {
+            'event': {
+                'header': header,
+                'payload': {'profile': 'NEAR_FIELD',
+                            'format': self._audio_format}
+            },
+            'context': fetch_context()
+        }
+
+        body = _StreamingBody(
+            _START_JSON + json.dumps(event).encode() + _START_AUDIO,
+            audio_stream, ('--' + _SIMPLE_AVS_BOUNDARY + '--').encode(),
+            cancelled)
+
+        stream_id = send_request('POST', '/events', body=body)
+        process_response(get_response(stream_id))
+
+    def _speak_to_alexa(self, audio_data, dialog_id):
+        future, deadline = self._open_dialog(dialog_id)
+        timed_out = False
+
+        try:
+            self._recognize(audio_data, dialog_id, deadline)
+            return future.result(self._remaining(deadline))
+        except FutureTimeoutError:
+            timed_out = True
+            return None
+        finally:
+            self._close_dialog(dialog_id, timed_out)
+
+    async def _speak_to_alexa_async(self, audio_data, dialog_id):
+        loop = asyncio.get_running_loop()
+        future, deadline = self._open_dialog(dialog_id)
+        # cancelling the task cannot interrupt the executor thread, so
+        # the upload checks this event and stops on its own
+        cancelled = threading.Event()
+        recognize = functools.partial(self._recognize, audio_data, dialog_id,
+                                      deadline, cancelled)
+        timed_out = False
+
+        try:
+            await loop.run_in_executor(None, recognize)
+            return await asyncio.wait_for(asyncio.wrap_future(future),
+                                          self._remaining(deadline))
+        except (asyncio.TimeoutError, FutureTimeoutError):
+            timed_out = True
+            return None
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        finally:
+            self._close_dialog(dialog_id, timed_out)
 
     def ask(self, audio_data, dummy_context=None):
         """ uses AVS to process the audio and get a response """
-        dialog_id = self._avs_client.id_service.get_new_dialog_id()
-
-        return self._speak_to_alexa(audio_data, dialog_id)
+        return self._speak_to_alexa(audio_data, self.new_dialog_id())
 
     def respond_to(self, audio_data, context):
         """ responds to AVS with audio_data related to previous ask() """
@@ -63,6 +336,30 @@ class AlexaVoiceService(object):
 
         return self._speak_to_alexa(audio_data, dialog_id)
 
+    def ask_stream(self, audio_stream, dummy_context=None):
+        """ like ask() but uploads audio_stream while it is captured """
+        return self.ask(audio_stream)
+
+    def respond_to_stream(self, audio_stream, context):
+        """ like respond_to() but uploads audio_stream while it is captured
+        """
+        return self.respond_to(audio_stream, context)
+
+    async def ask_async(self, audio_data, dummy_context=None):
+        """ awaitable version of ask() """
+        return await self._speak_to_alexa_async(audio_data,
+                                                self.new_dialog_id())
+
+    async def respond_to_async(self, audio_data, context):
+        """ awaitable version of respond_to() """
+        if 'dialog_id' not in context:
+            raise ValueError('respond_to requires a valid dialog_id')
+
+        return await self._speak_to_alexa_async(audio_data,
+                                                context['dialog_id'])
+
     def terminate(self):
         """ release resources """
-        self._avs_client.disconnect()
+
+        for client in self._clients:
+            client.disconnect()
@@ -0,0 +1,185 @@
+""" an in-process stand-in for Alexa Voice Services """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import functools
+import itertools
+import json
+import random
+import threading
+import time
+from tabitha.objectdict import ObjectDict
+
+# 16 kHz 16-bit mono, the only format AlexaVoiceService uploads
+_BYTES_PER_SECOND = 32000
+
+
+class _EventHook(object):
+    """ the += subscription used by simpleavs events """
+
+    def __init__(self):
+        self._handlers = []
+
+    def __iadd__(self, handler):
+        self._handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        self._handlers.remove(handler)
+        return self
+
+    def fire(self, *args):
+        """ calls every subscribed handler """
+
+        for handler in list(self._handlers):
+            handler(*args)
+
+
+class _IdService(object):
+    """ hands out unique dialog and message ids """
+
+    _ids = itertools.count(1)
+
+    def get_new_dialog_id(self):
+        """ returns a new dialog request id """
+        return 'dialog-%d' % next(self._ids)
+
+    def get_new_message_id(self):
+        """ returns a new message id """
+        return 'message-%d' % next(self._ids)
+
+
+class _SpeechRecognizer(object):
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, client):
+        self._client = client
+
+    def recognize(self, audio_data, profile=None, dialog_request_id=None):
+        """ sends a Recognize event, returns once it has been answered """
+
+        # pylint: disable=protected-access,unused-argument
+        self._client._serve(dialog_request_id, len(audio_data))
+
+
+class _Connection(object):
+    """ the private connection calls used to stream Recognize events """
+
+    def __init__(self, client):
+        self._client = client
+        self._requests = {}
+        self._stream_ids = itertools.count(1)
+
+    def _send_request(self, dummy_method, dummy_path, body=None):
+        data = bytearray()
+        block = body.read(8192)
+
+        while block:
+            data.extend(block)
+            block = body.read(8192)
+
+        json_start = data.index(b'{')
+        event, json_end = json.JSONDecoder().raw_decode(
+            data[json_start:].decode('latin-1'))
+        stream_id = next(self._stream_ids)
+        self._requests[stream_id] = (
+            event['event']['header']['dialogRequestId'],
+            len(data) - json_start - json_end)
+
+        return stream_id
+
+    def _get_response(self, stream_id):
+        return self._requests.pop(stream_id)
+
+    def _process_response(self, response):
+        # pylint: disable=protected-access
+        self._client._serve(*response)
+
+
+class FakeAvsClient(object):
+    """ stands in for simpleavs.AvsClient without a network or an account
+
+        Recognize events, sent by speech_recognizer.recognize() or
+        streamed through the connection like AlexaVoiceService does, are
+        answered with a Speak directive after a simulated service time:
+        fakeavs.latency_ms, plus fakeavs.ms_per_audio_s for each second of
+        uploaded audio, plus exponentially distributed jitter averaging
+        fakeavs.jitter_ms for a realistic tail. fakeavs.drop_rate of the
+        events are never answered. Like a connection a client serves one
+        event at a time; connect() takes fakeavs.connect_ms, as if it were
+        authenticating. The Speak directive's audio_data is
+        fakeavs.response_audio. Use factory() to pass the settings as
+        handlers.alexa.client_factory.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, dummy_avs_config=None, settings=None):
+        settings = settings or {}
+
+        self._settings = ObjectDict({
+            'latency_ms': settings.get('fakeavs.latency_ms', 300),
+            'ms_per_audio_s': settings.get('fakeavs.ms_per_audio_s', 50),
+            'jitter_ms': settings.get('fakeavs.jitter_ms', 100),
+            'drop_rate': settings.get('fakeavs.drop_rate', 0.0),
+            'connect_ms': settings.get('fakeavs.connect_ms', 0),
+            'response_audio': settings.get('fakeavs.response_audio', b'')})
+
+        self._random = random.Random(settings.get('fakeavs.seed'))
+        self._busy = threading.Lock()
+        self._connection = _Connection(self)
+        self.speech_synthesizer = ObjectDict({'speak_event': _EventHook()})
+        self.speech_recognizer = _SpeechRecognizer(self)
+        self.id_service = _IdService()
+        self.connected = False
+        self.stats = ObjectDict({'events': 0, 'dropped': 0,
+                                 'audio_bytes': 0})
+
+    @classmethod
+    def factory(cls, settings):
+        """ returns a handlers.alexa.client_factory using settings """
+        return functools.partial(cls, settings=settings)
+
+    def connect(self):
+        """ simulates connecting and authenticating """
+
+        time.sleep(self._settings.connect_ms / 1000)
+        self.connected = True
+
+    def disconnect(self):
+        """ simulates disconnecting """
+        self.connected = False
+
+    def _fetch_context(self):
+        # pylint: disable=no-self-use
+        return []
+
+    def _service_seconds(self, audio_bytes):
+        settings = self._settings
+        jitter = (self._random.expovariate(1000 / settings.jitter_ms)
+                  if settings.jitter_ms else 0.0)
+
+        return (settings.latency_ms / 1000 + jitter +
+                settings.ms_per_audio_s / 1000 *
+                audio_bytes / _BYTES_PER_SECOND)
+
+    def _serve(self, dialog_id, audio_bytes):
+        """ answers a Recognize event on this connection """
+
+        if not self.connected:
+            raise ValueError('FakeAvsClient is not connected')
+
+        with self._busy:
+            self.stats.events += 1
+            self.stats.audio_bytes += audio_bytes
+            time.sleep(self._service_seconds(audio_bytes))
+
+            if self._random.random() < self._settings.drop_rate:
+                self.stats.dropped += 1
+                return
+
+        self.speech_synthesizer.speak_event.fire(ObjectDict({
+            'dialog_request_id': dialog_id,
+            'dialog_id': dialog_id,
+            'audio_data': self._settings.response_audio}))
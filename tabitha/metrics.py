@@ -0,0 +1,232 @@
+""" Metrics records pipeline stage timings into histograms and exporters """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import bisect
+import io
+import json
+import logging
+import socket
+import threading
+import time
+from tabitha.objectdict import ObjectDict
+
+monotonic_time = getattr(time, 'monotonic', time.time)
+thread_time = getattr(time, 'thread_time', time.perf_counter)
+
+# bucket upper bounds in seconds, 10us to ~170s in steps of 25%
+_BUCKET_BOUNDS = [0.00001 * 1.25 ** index for index in range(76)]
+
+
+class Histogram(object):
+    """ fixed log bucket histogram of durations in seconds
+
+        Observing is a bisect and a few additions under a lock, so it is
+        cheap enough to call for every audio chunk. Percentiles are
+        estimated from the bucket bounds, within 25% of the true value.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """ records one duration """
+
+        bucket = bisect.bisect_left(_BUCKET_BOUNDS, value)
+
+        with self._lock:
+            self._counts[bucket] += 1
+            self.count += 1
+            self.total += value
+
+            if self.min is None or value < self.min:
+                self.min = value
+
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        """ estimates the duration below which percent% of values fall """
+
+        with self._lock:
+            if not self.count:
+                return None
+
+            rank = percent / 100 * self.count
+            seen = 0
+
+            for bucket, count in enumerate(self._counts):
+                seen += count
+
+                if count and seen >= rank:
+                    if bucket == len(_BUCKET_BOUNDS):
+                        return self.max
+
+                    return min(max(_BUCKET_BOUNDS[bucket], self.min),
+                               self.max)
+
+        return self.max
+
+    def summary(self):
+        """ returns count, mean, min, max and common percentiles """
+
+        return ObjectDict({
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99)})
+
+
+class CallbackExporter(object):
+    """ passes every exported timing to callback(name, seconds) """
+
+    def __init__(self, callback):
+        self._callback = callback
+
+    def export(self, name, value):
+        """ exports one timing """
+        self._callback(name, value)
+
+    def close(self):
+        """ nothing to release """
+        pass
+
+
+class StatsdExporter(object):
+    """ sends timings as statsd 'ms' metrics over UDP, fire and forget """
+
+    def __init__(self, address=('127.0.0.1', 8125), prefix='tabitha'):
+        self._address = tuple(address)
+        self._prefix = prefix + '.' if prefix else ''
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def export(self, name, value):
+        """ exports one timing """
+
+        packet = '%s%s:%.3f|ms' % (self._prefix, name, value * 1000)
+
+        try:
+            self._socket.sendto(packet.encode('ascii'), self._address)
+        except (OSError, socket.error):
+            # a missing or slow collector must never stall the pipeline
+            pass
+
+    def close(self):
+        """ closes the socket """
+        self._socket.close()
+
+
+class JsonLinesExporter(object):
+    """ appends one JSON object per timing to a file """
+
+    def __init__(self, path):
+        self._file = io.open(path, 'a', buffering=1)
+        self._lock = threading.Lock()
+
+    def export(self, name, value):
+        """ exports one timing """
+
+        line = json.dumps({'time': time.time(), 'name': name,
+                           'seconds': value})
+
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        """ closes the file """
+
+        with self._lock:
+            self._file.close()
+
+
+class Metrics(object):
+    """ in-process histograms of stage timings plus pluggable exporters
+
+        observe() records into the named histogram and passes the value to
+        every exporter. Per chunk detector CPU timings are only kept in the
+        histograms, exporters receive the per interaction totals. Exporters
+        are built from metrics.statsd ('host:port') and metrics.jsonl_path,
+        more can be added with add_exporter. With metrics.enabled False
+        observe() returns immediately.
+    """
+
+    def __init__(self, config=None, exporters=None):
+        config = config or {}
+
+        self.enabled = config.get('metrics.enabled', True)
+        self._histograms = {}
+        self._histograms_lock = threading.Lock()
+        self._exporters = list(exporters or [])
+
+        statsd = config.get('metrics.statsd')
+
+        if statsd:
+            host, _, port = statsd.rpartition(':')
+            self._exporters.append(StatsdExporter(
+                (host or '127.0.0.1', int(port)),
+                config.get('metrics.statsd_prefix', 'tabitha')))
+
+        if config.get('metrics.jsonl_path'):
+            self._exporters.append(
+                JsonLinesExporter(config['metrics.jsonl_path']))
+
+    def add_exporter(self, exporter):
+        """ adds an object with export(name, seconds) and close() """
+        self._exporters.append(exporter)
+
+    def histogram(self, name):
+        """ returns the histogram for name, creating it if needed """
+
+        histogram = self._histograms.get(name)
+
+        if histogram is None:
+            with self._histograms_lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+
+        return histogram
+
+    def observe(self, name, value, export=True):
+        """ records a duration in seconds """
+
+        if not self.enabled:
+            return
+
+        self.histogram(name).observe(value)
+
+        if not export:
+            return
+
+        for exporter in self._exporters:
+            # pylint: disable=broad-except
+            try:
+                exporter.export(name, value)
+            except Exception:
+                logging.exception('metrics exporter %s failed', exporter)
+
+    def since(self, name, start_time, export=True):
+        """ records the time elapsed since a monotonic_time() value """
+
+        if start_time is not None:
+            self.observe(name, monotonic_time() - start_time, export)
+
+    def summary(self):
+        """ returns the summary of every histogram by name """
+
+        return dict((name, histogram.summary())
+                    for name, histogram in list(self._histograms.items()))
+
+    def close(self):
+        """ closes all exporters """
+
+        for exporter in self._exporters:
+            exporter.close()
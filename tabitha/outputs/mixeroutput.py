@@ -0,0 +1,498 @@
+""" provides a mixing audio output using pyaudio """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import io
+import itertools
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+import wave
+import numpy
+import pyaudio
+from tabitha.objectdict import ObjectDict
+from tabitha.outputs.streamreader import StreamReader
+from tabitha.pcm import SAMPLE_TYPES
+
+_RESOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '../../resources/snowboy/')
+_DEFAULT_CLIPS = {'ding': os.path.join(_RESOURCES_DIR, 'ding.wav'),
+                  'dong': os.path.join(_RESOURCES_DIR, 'dong.wav')}
+
+
+def _to_float(data, audio_width, channels):
+    """ converts interleaved PCM to (frames, channels) float32 samples """
+
+    if audio_width not in SAMPLE_TYPES:
+        raise ValueError('MixerOutput does not support audio width %s' %
+                         audio_width)
+
+    samples = numpy.frombuffer(data, SAMPLE_TYPES[audio_width],
+                               len(data) // audio_width)
+    frames = samples.size // channels
+    scale = 1 / float(2 ** (8 * audio_width - 1))
+
+    return (samples[:frames * channels].reshape(frames, channels)
+            .astype(numpy.float32) * scale)
+
+
+class _Voice(object):
+    """ one source being mixed """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, voice_id, gain, ducks, on_finish_cb):
+        self.voice_id = voice_id
+        self.gain = gain
+        self.ducks = ducks
+        self.on_finish_cb = on_finish_cb
+        self.requested = time.time()
+        self.started = False
+        self.clip = None
+        self.position = 0
+        self.blocks = None
+        self.pending = None
+        self.ended = False
+        self.finished = False
+
+    def read(self, frames, channels):
+        """ returns up to frames frames, and whether it ran dry before
+            the end of its audio """
+
+        if self.clip is not None:
+            block = self.clip[self.position:self.position + frames]
+            self.position += len(block)
+            self.finished = self.position >= len(self.clip)
+            return block, False
+
+        parts = []
+        wanted = frames
+
+        while wanted:
+            if self.pending is None or not len(self.pending):
+                try:
+                    self.pending = self.blocks.get_nowait()
+                except queue.Empty:
+                    break
+
+                if self.pending is None:
+                    self.ended = True
+                    break
+
+            parts.append(self.pending[:wanted])
+            self.pending = self.pending[wanted:]
+            wanted -= len(parts[-1])
+
+        self.finished = self.ended and not (self.pending is not None and
+                                            len(self.pending))
+
+        if not parts:
+            return numpy.zeros((0, channels), numpy.float32), \
+                not self.finished
+
+        return numpy.concatenate(parts), bool(wanted and not self.ended)
+
+
+class MixerOutput(object):
+    """ plays any number of sounds at once through one open PyAudio stream
+
+        The output stream is opened once, in the audio.* format, and kept
+        running; every output.mixer.frames_per_buffer frames its callback
+        sums the active voices with numpy, applies each voice's gain and
+        output.mixer.gain, and clips the result. Short clips, by default
+        the ding and dong earcons, are decoded to float PCM up front so
+        play_clip() is heard from the next period, which stats records
+        in last_clip_start_seconds. Clips duck the other voices to
+        output.mixer.duck_gain, ramping over output.mixer.duck_ms.
+
+        play_stream() mixes WAV or raw PCM in the output format from a
+        file-like object or an iterator of chunks, fed by a thread with
+        output.mixer.buffer_periods periods of look ahead. play_audio()
+        and play() accept WAV directly and pipe anything else, e.g. AVS's
+        MP3 responses, through output.mixer.decoder_command, which must
+        write raw PCM in the output format. stop() stops these but lets
+        clips play out, so an earcon started on barge-in is still heard.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, config=None):
+        config = config or {}
+
+        self._config = ObjectDict({
+            'audio_width': config.get('audio.width', 2),
+            'channels': config.get('audio.channels', 1),
+            'sample_rate': config.get('audio.sample_rate', 16000),
+            'output_device_index':
+                config.get('output.mixer.output_device_index', None),
+            'frames_per_buffer':
+                config.get('output.mixer.frames_per_buffer', 256),
+            'buffer_periods': config.get('output.mixer.buffer_periods', 4),
+            'gain': config.get('output.mixer.gain', 1.0),
+            'duck_gain': config.get('output.mixer.duck_gain', 0.3),
+            'duck_ms': config.get('output.mixer.duck_ms', 50),
+            'decoder_command':
+                config.get('output.mixer.decoder_command', None)})
+
+        if self._config.audio_width not in SAMPLE_TYPES:
+            raise ValueError('MixerOutput does not support audio.width %s' %
+                             self._config.audio_width)
+
+        frames_per_buffer = self._config.frames_per_buffer
+        channels = self._config.channels
+        full_scale = 2 ** (8 * self._config.audio_width - 1)
+
+        self._mix = numpy.zeros((frames_per_buffer, channels), numpy.float32)
+        self._limits = (-full_scale, full_scale - 1)
+        self._scale = full_scale
+        self._sample_type = numpy.dtype(SAMPLE_TYPES[
+            self._config.audio_width])
+        self._duck_step = (frames_per_buffer / self._config.sample_rate /
+                           max(self._config.duck_ms / 1000, 1e-6) *
+                           (1 - self._config.duck_gain))
+        self._duck_level = 1.0
+        self._voices = []
+        self._voice_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self.clips = {}
+        self.stats = ObjectDict({'blocks': 0, 'underruns': 0,
+                                 'mix_seconds': 0.0,
+                                 'last_clip_start_seconds': None,
+                                 'max_clip_start_seconds': 0.0})
+
+        for name, path in config.get('output.mixer.clips',
+                                     _DEFAULT_CLIPS).items():
+            self.load_clip(name, path)
+
+        self._pyaudio = pyaudio.PyAudio()
+        self._audio_stream = self._pyaudio.open(
+            input=False,
+            output=True,
+            format=pyaudio.get_format_from_width(self._config.audio_width),
+            channels=channels,
+            rate=self._config.sample_rate,
+            frames_per_buffer=frames_per_buffer,
+            output_device_index=self._config.output_device_index,
+            stream_callback=self._stream_callback)
+
+        if not self._audio_stream.is_active():
+            self._audio_stream.start_stream()
+
+    @property
+    def playing(self):
+        """ True while anything other than a clip is playing """
+
+        return not self._idle.is_set()
+
+    def load_clip(self, name, source):
+        """ decodes a WAV file or WAV data and keeps it for play_clip() """
+
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+
+        wav_data = wave.open(source, 'rb')
+
+        try:
+            samples = self._convert(
+                _to_float(wav_data.readframes(wav_data.getnframes()),
+                          wav_data.getsampwidth(), wav_data.getnchannels()),
+                wav_data.getframerate())
+        finally:
+            wav_data.close()
+
+        self.clips[name] = samples
+
+    def _convert(self, samples, sample_rate):
+        """ maps samples to the output's channels and sample rate """
+
+        channels = self._config.channels
+
+        if samples.shape[1] != channels:
+            if samples.shape[1] == 1:
+                samples = numpy.repeat(samples, channels, axis=1)
+            elif channels == 1:
+                samples = samples.mean(axis=1, keepdims=True)
+            else:
+                raise ValueError('can not mix %d channels into %d' %
+                                 (samples.shape[1], channels))
+
+        if sample_rate != self._config.sample_rate and len(samples):
+            frames = int(round(len(samples) * self._config.sample_rate /
+                               sample_rate))
+            times = numpy.arange(frames) * (sample_rate /
+                                            self._config.sample_rate)
+            samples = numpy.stack(
+                [numpy.interp(times, numpy.arange(len(samples)),
+                              samples[:, channel])
+                 for channel in range(channels)], axis=1)
+
+        return numpy.ascontiguousarray(samples, numpy.float32)
+
+    def _add_voice(self, voice):
+        with self._lock:
+            self._voices.append(voice)
+
+            if voice.clip is None:
+                self._idle.clear()
+
+        return voice.voice_id
+
+    def play_clip(self, name, gain=1.0, on_finish_cb=None, ducks=True):
+        """ mixes a loaded clip in from the next period, returns its voice
+            id, with ducks set the other voices are turned down meanwhile """
+
+        voice = _Voice(next(self._voice_ids), gain, ducks, on_finish_cb)
+        voice.clip = self.clips[name]
+
+        return self._add_voice(voice)
+
+    def play_stream(self, stream, on_finish_cb=None, gain=1.0):
+        """ starts mixing WAV or raw PCM from a file-like object or an
+            iterator of chunks, returns its voice id """
+
+        voice = _Voice(next(self._voice_ids), gain, False, on_finish_cb)
+        voice.blocks = queue.Queue(self._config.buffer_periods)
+
+        feed_thread = threading.Thread(target=self._feed_thread,
+                                       args=(voice, StreamReader(stream)))
+        feed_thread.daemon = True
+        feed_thread.start()
+
+        return self._add_voice(voice)
+
+    def play_audio(self, audio_data, on_finish_cb=None):
+        """ stops other playback and starts playing response audio, bytes
+            or, while it is still arriving, a file-like object or an
+            iterator of chunks """
+
+        self.stop()
+
+        if isinstance(audio_data, (bytes, bytearray)):
+            audio_data = io.BytesIO(audio_data)
+
+        reader = StreamReader(audio_data)
+
+        if reader.peek(4) == b'RIFF':
+            return self.play_stream(reader, on_finish_cb)
+
+        if not self._config.decoder_command:
+            raise ValueError('MixerOutput needs ' +
+                             'output.mixer.decoder_command to play ' +
+                             'compressed audio')
+
+        decoder = subprocess.Popen(
+            self._config.decoder_command, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        def _write_input():
+            try:
+                for chunk in iter(lambda: reader.read(4096), b''):
+                    decoder.stdin.write(chunk)
+                    decoder.stdin.flush()
+
+                decoder.stdin.close()
+            except (IOError, OSError):
+                pass
+
+        write_thread = threading.Thread(target=_write_input)
+        write_thread.daemon = True
+        write_thread.start()
+
+        def _on_finish():
+            if decoder.poll() is None:
+                decoder.kill()
+
+            decoder.wait()
+
+            if on_finish_cb:
+                on_finish_cb()
+
+        return self.play_stream(decoder.stdout, _on_finish)
+
+    def play(self, audio_path, on_finish_cb=None):
+        """ stops other playback and starts playing an audio file """
+
+        with io.open(audio_path, 'rb') as audio_file:
+            return self.play_audio(audio_file.read(), on_finish_cb)
+
+    def blocking_play(self, audio_path):
+        """ plays an audio file, returns once it has finished """
+
+        self.play(audio_path)
+        self.wait()
+
+    def wait(self, timeout=None):
+        """ blocks until everything but clips has finished """
+        return self._idle.wait(timeout)
+
+    def _feed_thread(self, voice, reader):
+        # pylint: disable=broad-except
+        try:
+            audio_width = self._config.audio_width
+            channels = self._config.channels
+
+            if reader.peek(4) == b'RIFF':
+                wav_data = wave.open(reader, 'rb')
+
+                if wav_data.getframerate() != self._config.sample_rate:
+                    raise ValueError('stream sample rate %d does not ' %
+                                     wav_data.getframerate() +
+                                     'match the output')
+
+                audio_width = wav_data.getsampwidth()
+                channels = wav_data.getnchannels()
+                read_period = lambda size: wav_data.readframes(
+                    size // (audio_width * channels))
+            else:
+                read_period = reader.read
+
+            period_bytes = (self._config.frames_per_buffer *
+                            audio_width * channels)
+            data = read_period(period_bytes)
+
+            while data and not voice.finished:
+                samples = self._convert(
+                    _to_float(data, audio_width, channels),
+                    self._config.sample_rate)
+
+                if not self._put(voice, samples):
+                    return
+
+                data = read_period(period_bytes)
+
+            self._put(voice, None)
+        except Exception:
+            logging.exception('failed to mix audio stream')
+            self._put(voice, None)
+
+    @staticmethod
+    def _put(voice, samples):
+        """ queues samples for a voice, False once it has been stopped """
+
+        while not voice.finished:
+            try:
+                voice.blocks.put(samples, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _stream_callback(self, dummy_in_data, frame_count,
+                         dummy_time_info, dummy_status):
+        start_time = time.time()
+        mix = self._mix[:frame_count]
+        mix.fill(0)
+
+        with self._lock:
+            voices = list(self._voices)
+
+        ducking = any([voice.ducks for voice in voices])
+        duck_target = self._config.duck_gain if ducking else 1.0
+        duck_start = self._duck_level
+        self._duck_level = min(max(duck_target,
+                                   duck_start - self._duck_step),
+                               duck_start + self._duck_step)
+
+        if duck_start != 1.0 or self._duck_level != 1.0:
+            ducked = numpy.zeros_like(mix)
+        else:
+            ducked = mix
+
+        finished = []
+
+        for voice in voices:
+            block, underrun = voice.read(frame_count, mix.shape[1])
+
+            if underrun and voice.started:
+                self.stats.underruns += 1
+
+            if len(block) and not voice.started:
+                voice.started = True
+
+                if voice.clip is not None:
+                    self._note_clip_start(start_time - voice.requested)
+
+            target = mix if voice.ducks else ducked
+            target[:len(block)] += block * voice.gain
+
+            if voice.finished:
+                finished.append(voice)
+
+        if ducked is not mix:
+            ramp = numpy.linspace(duck_start, self._duck_level, frame_count,
+                                  dtype=numpy.float32)
+            mix += ducked * ramp[:, None]
+
+        mix *= self._config.gain * self._scale
+        output = numpy.clip(mix, *self._limits).astype(self._sample_type)
+
+        self.stats.blocks += 1
+        self.stats.mix_seconds += time.time() - start_time
+
+        if finished:
+            self._remove(finished)
+
+        return output.tobytes(), pyaudio.paContinue
+
+    def _note_clip_start(self, seconds):
+        self.stats.last_clip_start_seconds = seconds
+        self.stats.max_clip_start_seconds = max(
+            self.stats.max_clip_start_seconds, seconds)
+
+    def _remove(self, voices):
+        """ removes voices from the mix and calls their finish callbacks """
+
+        with self._lock:
+            removed = [voice for voice in voices if voice in self._voices]
+
+            for voice in removed:
+                voice.finished = True
+                self._voices.remove(voice)
+
+            if all([voice.clip is not None for voice in self._voices]):
+                self._idle.set()
+
+        # callbacks may start new playback, so run them off the audio thread
+        for voice in removed:
+            if voice.on_finish_cb:
+                callback_thread = threading.Thread(target=voice.on_finish_cb)
+                callback_thread.daemon = True
+                callback_thread.start()
+
+    def set_gain(self, voice_id, gain):
+        """ changes a playing voice's gain from the next period """
+
+        for voice in list(self._voices):
+            if voice.voice_id == voice_id:
+                voice.gain = gain
+
+    def stop(self, voice_id=None):
+        """ stops a voice, or all playback except clips """
+
+        with self._lock:
+            voices = [voice for voice in self._voices
+                      if voice.voice_id == voice_id or
+                      (voice_id is None and voice.clip is None)]
+
+        self._remove(voices)
+
+    def terminate(self):
+        """ closes the output stream and terminates pyaudio """
+
+        self.stop()
+
+        if self._audio_stream:
+            self._audio_stream.stop_stream()
+            self._audio_stream.close()
+            self._audio_stream = None
+
+        if self._pyaudio:
+            self._pyaudio.terminate()
+            self._pyaudio = None
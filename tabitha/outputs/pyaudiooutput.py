@@ -2,84 +2,310 @@
 
 from __future__ import absolute_import
 from __future__ import unicode_literals
+from __future__ import division
 import io
+import logging
+import queue
+import threading
+import time
 import wave
 import pyaudio
 from tabitha.objectdict import ObjectDict
+from tabitha.outputs.streamreader import StreamReader
+
+_END_OF_STREAM = None
+
+
+def _is_compressed(header):
+    """ True if header starts an MP3 file, which would play as noise """
+
+    return header[:3] == b'ID3' or (len(header) >= 2 and
+                                    header[0] == 0xFF and
+                                    header[1] & 0xE0 == 0xE0)
+
+
+def _check_playable(header):
+    if _is_compressed(header):
+        raise ValueError('PyAudioOutput only plays WAV or raw PCM, use ' +
+                         'MixerOutput with output.mixer.decoder_command ' +
+                         'for compressed audio')
 
 
 class PyAudioOutput(object):
-    """ uses PyAudio to play audio data """
+    """ uses PyAudio to play audio data
+
+        Audio is played through one callback mode PortAudio stream which
+        stays open between responses and is only reopened when the audio
+        format changes. play_stream() starts a thread which decodes WAV or
+        raw PCM from a file-like object or an iterator of chunks into a
+        queue of output.pyaudio.buffer_periods periods, playback starts as
+        soon as the first period is queued. play_audio() does the same for
+        response audio, which is what VoiceClient uses, and calls its
+        on_finish_cb once the audio has drained. When the queue runs dry
+        during playback, or PortAudio reports an output underflow, silence
+        is played and one underrun is counted in stats for the period.
+        Compressed audio such as MP3 is rejected with a ValueError.
+    """
+
+    # pylint: disable=too-many-instance-attributes
 
     def __init__(self, config=None):
         config = config or {}
-        audio_width = config.get('audio.width', 2)
 
         self._config = ObjectDict({
-            'format': pyaudio.get_format_from_width(audio_width),
+            'audio_width': config.get('audio.width', 2),
             'channels': config.get('audio.channels', 1),
             'sample_rate': config.get('audio.sample_rate', 16000),
             'output_device_index':
                 config.get('output.pyaudio.output_device_index', None),
             'frames_per_buffer':
-                config.get('output.pyaudio.frames_per_buffer', 1024)})
+                config.get('output.pyaudio.frames_per_buffer', 1024),
+            'buffer_periods':
+                config.get('output.pyaudio.buffer_periods', 2)})
 
         self._pyaudio = pyaudio.PyAudio()
         self._audio_stream = None
+        self._stream_format = None
+        self._period_bytes = 0
+        self._silence = b''
+        self._queue = queue.Queue(self._config.buffer_periods)
+        self._play_lock = threading.Lock()
+        self._play_id = 0
+        self._play_start = None
+        self._first_period = False
+        self._on_finish_cb = None
+        self._finished = threading.Event()
+        self._finished.set()
+        self.playing = False
+        self.stats = ObjectDict({'periods': 0, 'underruns': 0,
+                                 'underrun_seconds': 0.0,
+                                 'last_first_audio_seconds': None})
+
+    def _reset(self, audio_width, channels, sample_rate):
+        """ opens the output stream unless it is open in this format """
+
+        stream_format = (audio_width, channels, sample_rate)
+
+        if self._audio_stream and self._stream_format == stream_format:
+            return
 
-    def _reset(self):
         self._stop()
 
+        frames_per_buffer = self._config.frames_per_buffer
+        self._period_bytes = frames_per_buffer * audio_width * channels
+        self._silence = bytes(self._period_bytes)
+        self._stream_format = stream_format
         self._audio_stream = self._pyaudio.open(
             input=False,
             output=True,
-            format=self._config.format,
-            channels=self._config.channels,
-            rate=self._config.sample_rate,
-            output_device_index=self._config.output_device_index)
+            format=pyaudio.get_format_from_width(audio_width),
+            channels=channels,
+            rate=sample_rate,
+            frames_per_buffer=frames_per_buffer,
+            output_device_index=self._config.output_device_index,
+            stream_callback=self._stream_callback)
 
     def _stop(self):
-        """ stops capturing audio data """
+        """ closes the output stream """
 
         if self._audio_stream:
+            self._audio_stream.stop_stream()
             self._audio_stream.close()
             self._audio_stream = None
+            self._stream_format = None
 
-    def play(self, audio_response):
-        """ determines the response type and plays it """
+    def _stream_callback(self, dummy_in_data, frame_count,
+                         dummy_time_info, status):
+        underflow = bool(status & pyaudio.paOutputUnderflow)
 
-        if not self._pyaudio:
-            raise ValueError('Can not play after calling terminate')
+        try:
+            play_id, data = self._queue.get_nowait()
+        except queue.Empty:
+            if underflow or (self.playing and not self._first_period):
+                self._note_underrun(frame_count)
+
+            return self._silence, pyaudio.paContinue
+
+        if underflow:
+            self._note_underrun(frame_count)
+
+        if play_id != self._play_id:
+            # queued just before the play was stopped
+            return self._silence, pyaudio.paContinue
+
+        if data is _END_OF_STREAM:
+            self._finish(play_id)
+            return self._silence, pyaudio.paContinue
+
+        self.stats.periods += 1
+
+        if self._first_period:
+            self._first_period = False
+            self.stats.last_first_audio_seconds = (time.time() -
+                                                   self._play_start)
+
+        return data, pyaudio.paContinue
+
+    def _note_underrun(self, frame_count):
+        self.stats.underruns += 1
+        self.stats.underrun_seconds += (frame_count /
+                                        self._stream_format[2])
+
+    def _finish(self, play_id, stop=False):
+        with self._play_lock:
+            if play_id != self._play_id:
+                return
+
+            if stop:
+                self._play_id += 1
+
+            if not self.playing:
+                return
+
+            self.playing = False
+            on_finish_cb = self._on_finish_cb
+            self._on_finish_cb = None
+
+        self._finished.set()
+
+        if on_finish_cb:
+            on_finish_cb()
+
+    def _drain_queue(self):
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _put(self, play_id, data):
+        """ queues a period, False once the play has been stopped """
+
+        while play_id == self._play_id:
+            try:
+                self._queue.put((play_id, data), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _open_format(self, reader):
+        """ returns a function reading PCM periods from the stream """
+
+        header = reader.peek(4)
+        _check_playable(header)
+
+        if header == b'RIFF':
+            wav_data = wave.open(reader, 'rb')
+            self._reset(wav_data.getsampwidth(), wav_data.getnchannels(),
+                        wav_data.getframerate())
+            frames_per_buffer = self._config.frames_per_buffer
+            return lambda: wav_data.readframes(frames_per_buffer)
+
+        self._reset(self._config.audio_width, self._config.channels,
+                    self._config.sample_rate)
+        period_bytes = self._period_bytes
+        return lambda: reader.read(period_bytes)
+
+    def _feed_thread(self, play_id, reader):
+        # pylint: disable=broad-except
+        try:
+            read_period = self._open_format(reader)
+
+            if not self._audio_stream.is_active():
+                self._audio_stream.start_stream()
+
+            data = read_period()
+
+            while data:
+                if len(data) < self._period_bytes:
+                    data += self._silence[len(data):]
+
+                if not self._put(play_id, data):
+                    return
+
+                data = read_period()
+
+            self._put(play_id, _END_OF_STREAM)
+        except Exception:
+            logging.exception('failed to play audio stream')
+            self._finish(play_id)
+
+    def play(self, audio_response, on_finish_cb=None):
+        """ determines the response type and plays it, returns once it
+            has finished """
 
         if audio_response.is_stream:
-            self.play_stream(audio_response)
+            self.play_stream(getattr(audio_response, 'stream',
+                                     audio_response), on_finish_cb)
         elif audio_response.data:
-            self.play_data(audio_response.data)
+            _check_playable(audio_response.data[:4])
+            self.play_stream(io.BytesIO(audio_response.data), on_finish_cb)
         else:
             raise ValueError('audio_response is invalid')
 
-    def play_stream(self, stream_response):
-        """ plays an audio stream """
-        pass
+        self.wait()
+
+    def play_stream(self, stream, on_finish_cb=None):
+        """ starts playing WAV or raw PCM from a file-like object or an
+            iterator of chunks and returns immediately, on_finish_cb is
+            called when it has played or was stopped """
+
+        if not self._pyaudio:
+            raise ValueError('Can not play after calling terminate')
+
+        self.stop()
+
+        with self._play_lock:
+            self._play_id += 1
+            self._play_start = time.time()
+            self._first_period = True
+            self._on_finish_cb = on_finish_cb
+            self._finished.clear()
+            self.playing = True
+            play_id = self._play_id
+
+        feed_thread = threading.Thread(
+            target=self._feed_thread,
+            args=(play_id, StreamReader(stream)))
+        feed_thread.daemon = True
+        feed_thread.start()
+
+    def play_audio(self, audio_data, on_finish_cb=None):
+        """ starts playing response audio, WAV or raw PCM bytes or, while
+            it is still arriving, a file-like object or an iterator of
+            chunks, and returns immediately, on_finish_cb is called once
+            the queued audio has drained or playback was stopped """
+
+        if isinstance(audio_data, (bytes, bytearray)):
+            audio_data = io.BytesIO(audio_data)
+
+        reader = StreamReader(audio_data)
+        _check_playable(reader.peek(4))
+        self.play_stream(reader, on_finish_cb)
 
     def play_data(self, audio_data):
-        """ plays audio data """
+        """ plays WAV or raw PCM audio data, returns once it has finished """
 
-        wav_stream = io.BytesIO(audio_data)
-        wav_data = wave.open(wav_stream, 'rb')
+        _check_playable(audio_data[:4])
+        self.play_stream(io.BytesIO(audio_data))
+        self.wait()
 
-        buffer_data = wav_data.readframes(self._config.frames_per_buffer)
+    def wait(self, timeout=None):
+        """ blocks until the current playback finishes or is stopped """
+        return self._finished.wait(timeout)
 
-        while buffer_data != '':
-            self._audio_stream.write(buffer_data)
-            buffer_data = wav_data.readframes(self._config.frames_per_buffer)
+    def stop(self):
+        """ stops the current playback within one period """
 
-        wav_data.close()
-        wav_stream.close()
+        self._finish(self._play_id, stop=True)
+        self._drain_queue()
 
     def terminate(self):
         """ terminates pyaudio, releasing resources """
 
+        self.stop()
         self._stop()
 
         if self._pyaudio:
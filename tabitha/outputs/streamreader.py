@@ -0,0 +1,46 @@
+""" StreamReader gives outputs file-like reads over response audio """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+
+class StreamReader(object):
+    """ file-like reads over a file-like object or an iterator of chunks,
+        with enough look ahead to sniff the format """
+
+    def __init__(self, stream):
+        self._pending = bytearray()
+
+        if hasattr(stream, 'read'):
+            self._next_chunk = lambda: stream.read(8192)
+        else:
+            chunks = iter(stream)
+            self._next_chunk = lambda: next(chunks, b'')
+
+    def _fill(self, size):
+        while size < 0 or len(self._pending) < size:
+            chunk = self._next_chunk()
+
+            if not chunk:
+                break
+
+            self._pending.extend(chunk)
+
+    def peek(self, size):
+        """ returns up to size bytes without consuming them """
+
+        self._fill(size)
+        return bytes(self._pending[:size])
+
+    def read(self, size=-1):
+        """ returns size bytes, fewer only at the end of the stream """
+
+        self._fill(size)
+
+        if size < 0:
+            size = len(self._pending)
+
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+
+        return data
@@ -2,15 +2,35 @@
 
 from __future__ import absolute_import
 from __future__ import unicode_literals
+import itertools
+import logging
 import os
+import re
 import subprocess
 import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 
 _MACOSX_VLC_PATH = '/Applications/VLC.app/Contents/MacOS/VLC'
 _VLC_PARAMS = ['-I', 'rc', '--play-and-exit']
+_VLC_RC_PARAMS = ['-I', 'rc', '--rc-fake-tty', '--no-video']
+_NEW_INPUT = re.compile(r'new input: (\S+)')
+_STOPPED = re.compile(r'stop state|state stopped')
+_RESTART_DELAY = 1.0
 _DEVNULL = open(os.devnull, 'w')
 
 
+def _find_vlc_path(config):
+    if 'output.vlc.path' in config:
+        return config['output.vlc.path']
+
+    if os.path.isfile(_MACOSX_VLC_PATH):
+        return _MACOSX_VLC_PATH
+
+    raise ValueError('Failed to locate path to VLC, set output.vlc.path')
+
+
 class VlcOutput(object):
     """ allows playing of audio media files via the VLC command line """
     def __init__(self, config):
@@ -19,14 +39,7 @@ class VlcOutput(object):
         self._play_interrupted = threading.Event()
         self._process_lock = threading.Lock()
         self._on_finish_cb = None
-
-        if 'output.vlc.path' in config:
-            self._vlc_path = config['output.vlc.path']
-        elif os.path.isfile(_MACOSX_VLC_PATH):
-            self._vlc_path = _MACOSX_VLC_PATH
-        else:
-            raise ValueError('Failed to locate path to VLC, ' +
-                             'set output.vlc.path')
+        self._vlc_path = _find_vlc_path(config)
 
     def play(self, audio_url, on_finish_cb=None):
         """ starts playing the audio file and immediately returns """
@@ -78,3 +91,186 @@ class VlcOutput(object):
 
         if self._on_finish_cb:
             self._on_finish_cb()
+
+
+class _ResponseServer(ThreadingMixIn, HTTPServer):
+    """ serves response audio to VLC from memory over loopback HTTP """
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _ResponseHandler)
+        self.responses = {}
+
+
+class _ResponseHandler(BaseHTTPRequestHandler):
+    """ sends bytes whole, file-like objects and iterators as they arrive """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ serves /<response id> """
+
+        audio = self.server.responses.get(self.path.lstrip('/'))
+
+        if audio is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+
+        if isinstance(audio, bytes):
+            self.send_header('Content-Length', str(len(audio)))
+            self.end_headers()
+            self.wfile.write(audio)
+            return
+
+        # streamed responses are delimited by closing the connection
+        self.end_headers()
+        chunks = (iter(lambda: audio.read(8192), b'')
+                  if hasattr(audio, 'read') else audio)
+
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    def log_message(self, *args):
+        pass
+
+
+class PersistentVlcOutput(object):
+    """ plays audio through one long-lived VLC process
+
+        VLC is started once and driven through its rc interface on stdin.
+        Response audio is handed over from memory by a loopback HTTP
+        server, so nothing touches the filesystem and streamed responses
+        start playing as they arrive. Completion is read from VLC's status
+        change events on stdout rather than polled, and VLC is restarted
+        if it exits. play() accepts paths and URLs like VlcOutput.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, config):
+        self.playing = False
+        self._vlc_path = _find_vlc_path(config)
+        self._vlc_params = config.get('output.vlc.rc_params', _VLC_RC_PARAMS)
+        self._process = None
+        self._process_lock = threading.Lock()
+        self._play_lock = threading.Lock()
+        self._response_ids = itertools.count(1)
+        self._current_url = None
+        self._playing_url = None
+        self._on_finish_cb = None
+        self._terminated = False
+        self._server = _ResponseServer()
+        self._server_thread = threading.Thread(
+            target=self._server.serve_forever)
+        self._server_thread.daemon = True
+        self._server_thread.start()
+        self._start_vlc()
+
+    def _start_vlc(self):
+        with self._process_lock:
+            self._process = subprocess.Popen(
+                [self._vlc_path] + self._vlc_params,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=_DEVNULL, universal_newlines=True, bufsize=1)
+
+        events_thread = threading.Thread(target=self._read_events,
+                                         args=(self._process,))
+        events_thread.daemon = True
+        events_thread.start()
+
+    def _send(self, *commands):
+        with self._process_lock:
+            try:
+                self._process.stdin.write(''.join(
+                    command + '\n' for command in commands))
+                self._process.stdin.flush()
+            except (IOError, OSError, ValueError):
+                logging.warning('VLC is not accepting commands')
+
+    def _read_events(self, process):
+        for line in process.stdout:
+            new_input = _NEW_INPUT.search(line)
+
+            if new_input:
+                self._playing_url = new_input.group(1)
+            elif _STOPPED.search(line):
+                self._finish(self._playing_url)
+
+        process.wait()
+
+        if self._terminated:
+            return
+
+        logging.warning('VLC exited with %s, restarting', process.returncode)
+        self._finish(self._current_url)
+        time.sleep(_RESTART_DELAY)
+
+        if not self._terminated:
+            self._start_vlc()
+
+    def _finish(self, url):
+        with self._play_lock:
+            if not self.playing or url != self._current_url:
+                return
+
+            self.playing = False
+            on_finish_cb = self._on_finish_cb
+            self._on_finish_cb = None
+            self._server.responses.pop(url.rsplit('/', 1)[-1], None)
+
+        if on_finish_cb:
+            on_finish_cb()
+
+    def play_audio(self, audio_data, on_finish_cb=None):
+        """ starts playing audio bytes, a file-like object or an iterator
+            of chunks and immediately returns """
+
+        response_id = '%d.mp3' % next(self._response_ids)
+        self._server.responses[response_id] = audio_data
+        self.play('http://127.0.0.1:%d/%s' % (self._server.server_port,
+                                              response_id), on_finish_cb)
+
+    def play(self, audio_url, on_finish_cb=None):
+        """ starts playing the audio file or URL and immediately returns """
+
+        self.stop()
+
+        with self._play_lock:
+            self._current_url = audio_url
+            # events about the previous input must not end this one
+            self._playing_url = None
+            self._on_finish_cb = on_finish_cb
+            self.playing = True
+
+        self._send('clear', 'add %s' % audio_url)
+
+    def blocking_play(self, audio_url):
+        """ plays the audio file or URL and only returns when complete """
+
+        finished = threading.Event()
+        self.play(audio_url, finished.set)
+        finished.wait()
+
+    def stop(self):
+        """ stops the current response """
+
+        if self.playing:
+            self._send('stop')
+            self._finish(self._current_url)
+
+    def terminate(self):
+        """ quits VLC and the response server """
+
+        self._terminated = True
+        self.stop()
+        self._send('quit')
+
+        try:
+            self._process.wait(2)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,45 @@
+""" shared helpers for measuring and converting PCM audio """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+
+# numpy dtypes of the supported audio.width values
+SAMPLE_TYPES = {2: '<i2', 4: '<i4'}
+
+
+class NoiseFloor(object):
+    """ tracks the background noise level from the RMS of audio frames
+
+        The level starts at initial rather than at the first audio seen,
+        which may well be speech. It falls immediately to quieter frames
+        and rises by at most rise_db per second, so continuous speech is
+        not learnt as noise.
+    """
+
+    def __init__(self, initial, rise_db, frame_ms):
+        self._initial = float(initial)
+        self.level = self._initial
+        self._rise_db = rise_db
+        self._frame_ms = frame_ms
+
+    def reset(self):
+        """ forgets the noise heard so far """
+        self.level = self._initial
+
+    def threshold(self, ratio, min_rms):
+        """ the RMS above which a frame is taken to be more than noise """
+        return max(min_rms, self.level * ratio)
+
+    def update(self, rms):
+        """ follows the quietest of a numpy array of frame RMS values """
+
+        quietest = float(rms.min())
+
+        if quietest < self.level:
+            self.level = quietest
+            return
+
+        seconds = rms.size * self._frame_ms / 1000
+        rise = 10 ** (self._rise_db * seconds / 20)
+        self.level = min(quietest, self.level * rise)
@@ -0,0 +1,195 @@
+""" converts streams of audio between sample rates """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import fractions
+import numpy
+from tabitha.metrics import thread_time
+from tabitha.objectdict import ObjectDict
+from tabitha.pcm import SAMPLE_TYPES
+
+
+class StreamingResampler(object):
+    """ resamples a stream of float blocks with a polyphase sinc filter
+
+        The rates are reduced to up / down factors and a Kaiser windowed
+        sinc of resample.zero_crossings zero crossings either side,
+        cut off at resample.rolloff of the lower Nyquist frequency, is
+        split into up phases. Each output sample is the dot product of
+        one phase with the latest inputs, computed for a whole block at
+        once. The last inputs are kept between blocks, so a stream cut
+        into blocks anywhere resamples exactly like the whole stream, with
+        no clicks at block boundaries. The filter delays the audio by
+        about zero_crossings samples at the lower rate.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, from_rate, to_rate, config=None):
+        config = config or {}
+        ratio = fractions.Fraction(int(to_rate), int(from_rate))
+        zero_crossings = config.get('resample.zero_crossings', 16)
+        rolloff = config.get('resample.rolloff', 0.9)
+        beta = config.get('resample.kaiser_beta', 8.0)
+
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        self._up = ratio.numerator
+        self._down = ratio.denominator
+        self._taps = 2 * zero_crossings * max(1, -(-self._down // self._up))
+
+        # the prototype filter runs at up times the input rate
+        cutoff = rolloff * min(1, self._up / self._down) / self._up
+        length = self._taps * self._up
+        times = numpy.arange(length) - (length - 1) / 2
+        prototype = (numpy.sinc(cutoff * times) * cutoff *
+                     numpy.kaiser(length, beta)) * self._up
+        self._phases = prototype.reshape(self._taps, self._up).T[:, ::-1] \
+            .astype(numpy.float32).copy()
+        self._offsets = numpy.arange(self._taps)
+        self.reset()
+
+    def reset(self):
+        """ forgets the stream so far """
+
+        self._history = numpy.zeros(self._taps - 1, numpy.float32)
+        self._inputs = 0
+        self._outputs = 0
+
+    def process(self, samples):
+        """ returns the output samples completed by a block of samples """
+
+        if self._up == self._down:
+            return samples
+
+        samples = numpy.concatenate([self._history, samples])
+        first_input = self._inputs - (self._taps - 1)
+        self._inputs += len(samples) - (self._taps - 1)
+        end = -(-self._inputs * self._up // self._down)
+        outputs = numpy.arange(self._outputs, end, dtype=numpy.int64)
+        self._outputs = end
+        self._history = samples[len(samples) - (self._taps - 1):]
+
+        steps = outputs * self._down
+        phases = steps % self._up
+        newest = steps // self._up - first_input
+        window = samples[newest[:, None] - (self._taps - 1) +
+                         self._offsets[None, :]]
+
+        return numpy.einsum('ij,ij->i', self._phases[phases], window)
+
+
+class ResamplingWriter(object):
+    """ resamples PCM written to extend() before writing it to a sink
+
+        Used between a source and its AudioBuffer, so a device delivering
+        source.sample_rate audio fills a buffer at audio.sample_rate.
+        stats records the audio and the CPU it took.
+    """
+
+    def __init__(self, config, sink, from_rate, to_rate):
+        audio_width = config.get('audio.width', 2)
+
+        if audio_width not in SAMPLE_TYPES:
+            raise ValueError('ResamplingWriter does not support ' +
+                             'audio.width %s' % audio_width)
+
+        self._sink = sink
+        self._sample_type = numpy.dtype(SAMPLE_TYPES[audio_width])
+        self._scale = float(2 ** (8 * audio_width - 1))
+        self._partial = bytearray()
+        self.resampler = StreamingResampler(from_rate, to_rate, config)
+        self.stats = ObjectDict({'input_samples': 0, 'output_samples': 0,
+                                 'cpu_seconds': 0.0})
+
+    @property
+    def cpu_per_audio_second(self):
+        """ resampling CPU seconds per second of input audio """
+
+        if not self.stats.input_samples:
+            return None
+
+        audio_seconds = self.stats.input_samples / self.resampler.from_rate
+        return self.stats.cpu_seconds / audio_seconds
+
+    def convert(self, data):
+        """ returns the resampled PCM completed by data """
+
+        start_time = thread_time()
+
+        if self._partial:
+            self._partial.extend(data)
+            data = self._partial
+            self._partial = bytearray()
+
+        itemsize = self._sample_type.itemsize
+        usable = len(data) - len(data) % itemsize
+
+        if usable < len(data):
+            self._partial.extend(memoryview(data)[usable:])
+
+        samples = numpy.frombuffer(data, self._sample_type,
+                                   usable // itemsize)
+        output = self.resampler.process(samples.astype(numpy.float32) /
+                                        self._scale)
+        data = numpy.clip(output * self._scale, -self._scale,
+                          self._scale - 1).astype(self._sample_type).tobytes()
+        self.stats.input_samples += len(samples)
+        self.stats.output_samples += len(output)
+        self.stats.cpu_seconds += thread_time() - start_time
+
+        return data
+
+    def extend(self, data):
+        """ resamples data and writes it to the sink """
+
+        data = self.convert(data)
+
+        if data:
+            self._sink.extend(data)
+
+    def reset(self):
+        """ forgets the stream so far """
+
+        del self._partial[:]
+        self.resampler.reset()
+
+
+class ResampledDetector(object):
+    """ feeds a detector expecting to_rate audio with from_rate audio
+
+        Every chunk passed to detect() or is_break() is resampled on the
+        way, reset() also restarts the stream. resample_stats are the
+        resampling's stats, other attributes the wrapped detector's.
+    """
+
+    def __init__(self, detector, config, from_rate, to_rate):
+        self.detector = detector
+        self._writer = ResamplingWriter(config, None, from_rate, to_rate)
+
+    def __getattr__(self, name):
+        return getattr(self.detector, name)
+
+    @property
+    def resample_stats(self):
+        """ the audio resampled and the CPU it took """
+        return self._writer.stats
+
+    def detect(self, data):
+        """ returns the wrapped detector's result for the resampled data """
+
+        data = self._writer.convert(data)
+        return self.detector.detect(data) if data else None
+
+    def is_break(self, data):
+        """ returns the wrapped detector's result for the resampled data """
+
+        data = self._writer.convert(data)
+        return self.detector.is_break(data) if data else False
+
+    def reset(self):
+        """ resets the resampler and the wrapped detector """
+
+        self._writer.reset()
+        return self.detector.reset()
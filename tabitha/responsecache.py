@@ -0,0 +1,451 @@
+""" caches handler responses for repeated requests """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import collections
+import copy
+import hashlib
+import io
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import numpy
+from tabitha.objectdict import ObjectDict
+from tabitha.pcm import SAMPLE_TYPES
+
+_FINGERPRINT_SEGMENTS = 32
+_FINGERPRINT_BANDS = 17
+
+
+def _response_audio(response):
+    return getattr(response, 'audio_data', None) or b''
+
+
+def _digest(data):
+    return hashlib.sha1(bytes(data)).hexdigest()
+
+
+class AudioFingerprint(object):
+    """ a compact acoustic fingerprint of a captured request
+
+        The voiced part of the capture is split into a fixed number of
+        segments and the sign of the energy difference between each pair
+        of neighbouring bands in a segment gives one bit, much like Haitsma
+        and Kalker's audio fingerprints. Loudness, leading silence and
+        background noise change few bits, so two captures of the same
+        words differ in a small fraction of them.
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self._sample_rate = config.get('audio.sample_rate', 16000)
+        self._sample_type = SAMPLE_TYPES[config.get('audio.width', 2)]
+        self._frame_samples = int(self._sample_rate * 0.032)
+        self._hop_samples = self._frame_samples // 2
+
+        frequencies = numpy.fft.rfftfreq(self._frame_samples,
+                                         1 / self._sample_rate)
+        edges = numpy.geomspace(300, 3000, _FINGERPRINT_BANDS + 1)
+        self._bands = [numpy.where((frequencies >= low) &
+                                   (frequencies < high))[0]
+                       for low, high in zip(edges[:-1], edges[1:])]
+        self._window = numpy.hanning(self._frame_samples)
+
+    def bits(self, audio_data):
+        """ returns the fingerprint bits, None for too little or silent
+            audio """
+
+        samples = numpy.frombuffer(bytes(audio_data), self._sample_type)
+        frame_count = 1 + (samples.size - self._frame_samples) // \
+            self._hop_samples
+
+        if frame_count < 4:
+            return None
+
+        indices = (numpy.arange(self._frame_samples)[None, :] +
+                   self._hop_samples * numpy.arange(frame_count)[:, None])
+        spectrum = numpy.abs(numpy.fft.rfft(
+            samples[indices] * self._window, axis=1)) ** 2
+        energy = numpy.stack([spectrum[:, band].sum(axis=1)
+                              for band in self._bands], axis=1)
+        loudness = energy.sum(axis=1)
+        voiced = numpy.where(loudness > loudness.max() * 0.01)[0]
+
+        if not voiced.size:
+            return None
+
+        energy = energy[voiced[0]:voiced[-1] + 1]
+
+        if energy.shape[0] < _FINGERPRINT_SEGMENTS:
+            return None
+
+        energy = numpy.stack([segment.mean(axis=0) for segment in
+                              numpy.array_split(energy,
+                                                _FINGERPRINT_SEGMENTS)])
+        energy = numpy.log(numpy.maximum(energy, energy.max() * 1e-3))
+
+        return (energy[:, :-1] - energy[:, 1:]) > 0
+
+    @staticmethod
+    def distance(bits, other_bits):
+        """ the fraction of bits which differ """
+        return numpy.count_nonzero(bits != other_bits) / bits.size
+
+
+class ResponseCache(object):
+    """ LRU cache of handler responses with a TTL and a byte budget
+
+        Requests match when their handler context is equal and either the
+        captured audio is identical (cache.match 'exact') or its
+        AudioFingerprint differs in at most cache.max_bit_error of its
+        bits (cache.match 'acoustic', the default). Entries expire after
+        cache.ttl seconds and the least recently used are evicted beyond
+        cache.max_entries or cache.max_bytes. Responses played
+        cache.pcm_after_plays times are decoded to PCM with
+        cache.decoder_command, if set, which then also counts toward the
+        byte budget.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, config=None):
+        config = config or {}
+
+        self._config = ObjectDict({
+            'match': config.get('cache.match', 'acoustic'),
+            'max_bit_error': config.get('cache.max_bit_error', 0.2),
+            'ttl': config.get('cache.ttl', 60),
+            'max_entries': config.get('cache.max_entries', 256),
+            'max_bytes': config.get('cache.max_bytes', 32 * 1024 * 1024),
+            'pcm_after_plays': config.get('cache.pcm_after_plays', 2),
+            'decoder_command': config.get('cache.decoder_command', None)})
+
+        if self._config.match not in ('acoustic', 'exact'):
+            raise ValueError('cache.match must be acoustic or exact')
+
+        self._fingerprint = AudioFingerprint(config)
+        self._entries = collections.OrderedDict()
+        self._by_audio = {}
+        self._lock = threading.Lock()
+        self._keys = iter(range(1, 2 ** 62))
+        self.nbytes = 0
+        self.stats = ObjectDict({'hits': 0, 'misses': 0, 'stores': 0,
+                                 'evictions': 0, 'expirations': 0,
+                                 'pcm_hits': 0, 'pcm_decodes': 0})
+
+    @property
+    def hit_rate(self):
+        """ fraction of lookups answered from the cache """
+
+        lookups = self.stats.hits + self.stats.misses
+        return self.stats.hits / lookups if lookups else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def request_key(self, audio_data):
+        """ returns what the capture is matched on """
+
+        if self._config.match == 'exact':
+            return _digest(audio_data)
+
+        return self._fingerprint.bits(audio_data)
+
+    def _matches(self, entry, context_key, request_key):
+        if entry.context_key != context_key:
+            return False
+
+        if self._config.match == 'exact':
+            return entry.request_key == request_key
+
+        return (entry.request_key.shape == request_key.shape and
+                AudioFingerprint.distance(entry.request_key, request_key) <=
+                self._config.max_bit_error)
+
+    def lookup(self, context_key, request_key):
+        """ returns the cached response for the request, or None """
+
+        now = time.time()
+
+        with self._lock:
+            if request_key is None:
+                self.stats.misses += 1
+                return None
+
+            for key, entry in list(self._entries.items()):
+                if now - entry.created > self._config.ttl:
+                    self._remove(key)
+                    self.stats.expirations += 1
+                    continue
+
+                if self._matches(entry, context_key, request_key):
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return entry.response
+
+            self.stats.misses += 1
+            return None
+
+    def store(self, context_key, request_key, response):
+        """ caches a response """
+
+        if request_key is None or response is None:
+            return
+
+        audio_digest = _digest(_response_audio(response))
+        entry = ObjectDict({'context_key': context_key,
+                            'request_key': request_key,
+                            'response': response,
+                            'audio_digest': audio_digest,
+                            'created': time.time(),
+                            'plays': 0,
+                            'pcm': None,
+                            'nbytes': len(_response_audio(response))})
+
+        with self._lock:
+            key = next(self._keys)
+            self._entries[key] = entry
+            self._by_audio[audio_digest] = key
+            self.nbytes += entry.nbytes
+            self.stats.stores += 1
+            self._evict()
+
+    def pcm_for(self, audio_data):
+        """ returns decoded PCM for a cached response's audio, or None,
+            counting the play and starting a decode once it is hot """
+
+        audio_digest = _digest(audio_data)
+
+        with self._lock:
+            key = self._by_audio.get(audio_digest)
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            entry.plays += 1
+            self._entries.move_to_end(key)
+
+            if entry.pcm is not None:
+                self.stats.pcm_hits += 1
+                return entry.pcm
+
+            start_decode = (entry.plays == self._config.pcm_after_plays and
+                            self._config.decoder_command)
+
+        if start_decode:
+            decode_thread = threading.Thread(
+                target=self._decode, args=(key, bytes(audio_data)))
+            decode_thread.daemon = True
+            decode_thread.start()
+
+        return None
+
+    def _decode(self, key, audio_data):
+        try:
+            decoder = subprocess.Popen(
+                self._config.decoder_command, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            pcm, _ = decoder.communicate(audio_data)
+        except OSError:
+            logging.exception('cache decoder failed to start')
+            return
+
+        if decoder.returncode != 0 or not pcm:
+            logging.warning('cache decoder exited with %s',
+                            decoder.returncode)
+            return
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return
+
+            entry.pcm = pcm
+            entry.nbytes += len(pcm)
+            self.nbytes += len(pcm)
+            self.stats.pcm_decodes += 1
+            self._evict()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry.nbytes
+
+        if self._by_audio.get(entry.audio_digest) == key:
+            del self._by_audio[entry.audio_digest]
+
+    def _evict(self):
+        while self._entries and (
+                len(self._entries) > self._config.max_entries or
+                self.nbytes > self._config.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+    def clear(self):
+        """ removes every entry """
+
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+
+def _context_key(context):
+    if context is None:
+        return None
+
+    if hasattr(context, 'get'):
+        return context.get('dialog_id', repr(sorted(context.items())))
+
+    return repr(context)
+
+
+def _restamp(response, dialog_id):
+    """ returns a copy of a cached response belonging to dialog_id """
+
+    response = copy.copy(response)
+
+    for name in ('dialog_id', 'dialog_request_id'):
+        if hasattr(response, name):
+            setattr(response, name, dialog_id)
+
+    return response
+
+
+class CachingHandler(object):
+    """ answers repeated requests from a ResponseCache
+
+        Wraps a handler's ask and respond_to. Responses are cached per
+        method and handler context (a respond_to context's dialog_id), so
+        a cached answer never crosses dialogs, and an ask() answered from
+        the cache is a copy re-stamped with a new dialog id, from the
+        handler's new_dialog_id() if it has one, so follow-ups continue
+        the new dialog rather than the one first cached. The complete
+        capture is needed for the fingerprint, so streamed captures are
+        read in full and the wrapped handler's ask_stream and async
+        methods are not exposed; other attributes are passed through.
+        Fingerprints need PCM, so it only accepts the pcm codec.
+    """
+
+    codecs = ('pcm',)
+
+    def __init__(self, handler, cache=None, config=None):
+        self._handler = handler
+        self.cache = cache if cache is not None else ResponseCache(config)
+
+    def __getattr__(self, name):
+        if name.endswith(('_stream', '_async')):
+            raise AttributeError(name)
+
+        return getattr(self._handler, name)
+
+    def _cached_call(self, name, audio_data, context):
+        context_key = (name, _context_key(context))
+        request_key = self.cache.request_key(audio_data)
+        response = self.cache.lookup(context_key, request_key)
+
+        if response is None:
+            method = getattr(self._handler, name)
+            response = (method(audio_data) if context is None
+                        else method(audio_data, context))
+            self.cache.store(context_key, request_key, response)
+        elif name == 'ask':
+            response = _restamp(response, self._new_dialog_id())
+
+        return response
+
+    def _new_dialog_id(self):
+        new_dialog_id = getattr(self._handler, 'new_dialog_id', None)
+        return new_dialog_id() if new_dialog_id else str(uuid.uuid4())
+
+    def ask(self, audio_data, dummy_context=None):
+        """ returns the cached or the handler's answer """
+        return self._cached_call('ask', audio_data, None)
+
+    def respond_to(self, audio_data, context):
+        """ returns the cached or the handler's answer in the dialog """
+        return self._cached_call('respond_to', audio_data, context)
+
+
+class CachingOutput(object):
+    """ plays hot cached responses from decoded PCM
+
+        Responses whose PCM the ResponseCache holds are played by
+        pcm_output (e.g. a PyAudioOutput, whose stream is already open)
+        within milliseconds, everything else goes to output, including
+        response audio streams. Paths and URLs are passed straight to
+        output.
+    """
+
+    def __init__(self, output, cache, pcm_output=None):
+        self._output = output
+        self._pcm_output = pcm_output
+        self._cache = cache
+
+    @property
+    def playing(self):
+        """ True while either output is playing """
+
+        return (getattr(self._output, 'playing', False) or
+                getattr(self._pcm_output, 'playing', False))
+
+    def play_audio(self, audio_data, on_finish_cb=None):
+        """ starts playing response audio and immediately returns """
+
+        self.stop()
+        pcm = (self._cache.pcm_for(audio_data)
+               if self._pcm_output and isinstance(audio_data, bytes)
+               else None)
+
+        if pcm is not None:
+            self._pcm_output.play_stream(io.BytesIO(pcm), on_finish_cb)
+            return
+
+        if hasattr(self._output, 'play_audio'):
+            self._output.play_audio(audio_data, on_finish_cb)
+            return
+
+        temp_file = tempfile.NamedTemporaryFile(suffix='.mp3', delete=False)
+
+        with temp_file:
+            if isinstance(audio_data, (bytes, bytearray)):
+                temp_file.write(audio_data)
+            elif hasattr(audio_data, 'read'):
+                temp_file.write(audio_data.read())
+            else:
+                for chunk in audio_data:
+                    temp_file.write(chunk)
+
+        def _on_finish():
+            os.remove(temp_file.name)
+
+            if on_finish_cb:
+                on_finish_cb()
+
+        self._output.play(temp_file.name, _on_finish)
+
+    def play(self, audio_url, on_finish_cb=None):
+        """ plays a path or URL on the wrapped output """
+
+        self.stop()
+        self._output.play(audio_url, on_finish_cb)
+
+    def stop(self):
+        """ stops both outputs """
+
+        self._output.stop()
+
+        if self._pcm_output:
+            self._pcm_output.stop()
+
+    def terminate(self):
+        """ releases both outputs """
+
+        for output in (self._output, self._pcm_output):
+            if hasattr(output, 'terminate'):
+                output.terminate()
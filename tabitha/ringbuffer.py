@@ -0,0 +1,218 @@
+""" RingBuffer is a preallocated byte ring shared by one writer and
+    any number of independent readers """
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import threading
+
+
+class RingBuffer(object):
+    """ fixed size byte ring with one writer and many independent readers
+
+        Every byte is stored twice (at offset and offset + capacity), so any
+        window of up to capacity bytes can be handed out as one contiguous
+        memoryview without copying. Positions are absolute byte counts since
+        the ring was created, so readers can tell when they have been lapped.
+        Readers can block on wait() and are woken by the next write, or
+        register a one-shot wakeup callback to avoid blocking a thread.
+        A writer replaying a recording can set a feeder instead of running
+        its own thread, it is then asked for audio whenever a reader is
+        about to block. storage can supply the 2 x capacity bytes, e.g.
+        shared memory, instead of a private bytearray.
+    """
+
+    def __init__(self, capacity, storage=None):
+        capacity = int(capacity)
+
+        if capacity <= 0:
+            raise ValueError('RingBuffer capacity must be positive')
+
+        if storage is not None and len(storage) != capacity * 2:
+            raise ValueError('RingBuffer storage must be twice capacity')
+
+        self.capacity = capacity
+        self._data = bytearray(capacity * 2) if storage is None else storage
+        self._view = memoryview(self._data)
+        self._written_cond = threading.Condition()
+        self._written = 0
+        self._wakeups = []
+        self._feeder = None
+
+    @property
+    def written(self):
+        """ absolute position of the writer, i.e. total bytes written """
+        return self._written
+
+    @property
+    def nbytes(self):
+        """ memory held by the ring storage """
+        return len(self._data)
+
+    @property
+    def oldest(self):
+        """ absolute position of the oldest byte still held by the ring """
+        return max(0, self._written - self.capacity)
+
+    def write(self, data):
+        """ copies data into the ring, overwriting the oldest bytes """
+
+        size = len(data)
+
+        if not size:
+            return
+
+        capacity = self.capacity
+        data = memoryview(data)
+
+        with self._written_cond:
+            position = self._written
+
+            if size > capacity:
+                position += size - capacity
+                data = data[size - capacity:]
+
+            length = len(data)
+            offset = position % capacity
+            end = offset + length
+            view = self._view
+
+            view[offset:end] = data
+
+            if end <= capacity:
+                view[offset + capacity:end + capacity] = data
+            else:
+                split = capacity - offset
+                view[offset + capacity:] = data[:split]
+                view[:length - split] = data[split:]
+
+            self._written += size
+            self._written_cond.notify_all()
+            wakeups = self._take_wakeups()
+
+        for wakeup in wakeups:
+            wakeup()
+
+    def add_wakeup(self, callback):
+        """ calls callback once, from the writer thread, after the next
+            write or interrupt """
+
+        with self._written_cond:
+            self._wakeups.append(callback)
+
+        if self._feeder:
+            self._feeder()
+
+    def set_feeder(self, feeder):
+        """ sets a callable which writes more data on demand, or None """
+        self._feeder = feeder
+
+    def wait(self, position, timeout=None):
+        """ blocks until the writer passes position or interrupt() is called,
+            returns True if data beyond position is available """
+
+        if self._feeder:
+            # the feeder is the only writer, so there is nothing to wait for
+            if self._written <= position:
+                self._feeder()
+
+            return self._written > position
+
+        with self._written_cond:
+            if self._written <= position:
+                self._written_cond.wait(timeout)
+
+            return self._written > position
+
+    def interrupt(self):
+        """ wakes every reader blocked in wait() """
+
+        with self._written_cond:
+            self._written_cond.notify_all()
+            wakeups = self._take_wakeups()
+
+        for wakeup in wakeups:
+            wakeup()
+
+    def _take_wakeups(self):
+        wakeups = self._wakeups
+
+        if wakeups:
+            self._wakeups = []
+
+        return wakeups
+
+    def view(self, start, end):
+        """ returns a memoryview of the absolute byte range [start, end)
+
+            the view aliases the ring and stays valid until the writer
+            passes start + capacity """
+
+        if start < self.oldest or end > self._written or start > end:
+            raise ValueError('RingBuffer range %d-%d is not available' %
+                             (start, end))
+
+        offset = start % self.capacity
+        return self._view[offset:offset + end - start]
+
+    def reader(self, position=None, window=None):
+        """ returns a new independent read cursor, by default at the end """
+        return RingReader(self, position, window)
+
+
+class RingReader(object):
+    """ independent read cursor into a RingBuffer
+
+        a reader that falls more than window bytes behind the writer
+        skips forward and records an overrun rather than silently
+        losing the oldest audio """
+
+    def __init__(self, ring, position=None, window=None):
+        self._ring = ring
+        self.window = min(int(window or ring.capacity), ring.capacity)
+        self.position = ring.written if position is None else position
+        self.overruns = 0
+        self.dropped_bytes = 0
+
+    def available(self):
+        """ returns the number of unread bytes """
+        return self._ring.written - self.position
+
+    def wait(self, timeout=None):
+        """ blocks until there is unread data, returns False on timeout """
+        return self._ring.wait(self.position, timeout)
+
+    def read(self, max_bytes=None):
+        """ returns a memoryview of unread data and advances the cursor """
+
+        written = self._ring.written
+        lag = written - self.position
+
+        if lag > self.window:
+            self.overruns += 1
+            self.dropped_bytes += lag - self.window
+            self.position = written - self.window
+            lag = self.window
+
+        if max_bytes is not None and lag > max_bytes:
+            lag = max_bytes
+
+        start = self.position
+        self.position += lag
+
+        return self._ring.view(start, start + lag)
+
+    def seek(self, position):
+        """ moves the cursor to an absolute ring position """
+
+        written = self._ring.written
+
+        if position > written:
+            raise ValueError('Can not seek past the ring writer')
+
+        self.position = max(position, written - self.window)
+
+    def seek_latest(self, history=0):
+        """ moves the cursor so only the most recent history bytes are
+            left to read """
+        self.seek(max(0, self._ring.written - history))
@@ -0,0 +1,204 @@
+""" SharedRingBuffer is a RingBuffer in shared memory which other local
+    processes can attach to read-only """
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import logging
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy
+from tabitha.ringbuffer import RingBuffer
+
+# written position and capacity, followed by the mirrored ring storage
+_HEADER = struct.Struct('<QQ')
+_DATA_OFFSET = 64
+_POLL_SECONDS = 0.005
+
+
+def _open_existing(name):
+    """ opens an existing segment without leaving it tracked
+
+        Before Python 3.13 opening a segment registers it with the
+        resource tracker, which unlinks it when the tracker's processes
+        exit. Processes started by multiprocessing share the creator's
+        tracker, where the entry only repeats the creator's, but a reader
+        started otherwise, e.g. a separate recorder, gets a tracker of its
+        own, so the segment is unregistered from that again.
+    """
+
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+
+    # pylint: disable=protected-access
+    had_tracker = resource_tracker._resource_tracker._fd is not None
+    memory = shared_memory.SharedMemory(name)
+
+    if not had_tracker:
+        resource_tracker.unregister(memory._name, 'shared_memory')
+
+    return memory
+
+
+class SharedRingBuffer(RingBuffer):
+    """ RingBuffer whose storage and written position live in a named
+        multiprocessing.shared_memory segment
+
+        The creating process is the only writer and behaves exactly like a
+        RingBuffer. attach() opens the same ring read-only from any local
+        process, e.g. a detector worker or a recorder; attached readers
+        cannot be woken by the writer's condition so wait() polls the
+        written position. Data is written before the position is
+        published, and copy() checks the writer has not lapped the range
+        while it was being copied.
+    """
+
+    def __init__(self, capacity, name=None, _memory=None):
+        capacity = int(capacity)
+        self._owner = _memory is None
+        self._memory = None
+
+        if self._owner:
+            _memory = shared_memory.SharedMemory(
+                name, create=True, size=_DATA_OFFSET + capacity * 2)
+            _HEADER.pack_into(_memory.buf, 0, 0, capacity)
+
+        self._memory = _memory
+        self._header = _memory.buf[:_HEADER.size]
+        storage = _memory.buf[_DATA_OFFSET:_DATA_OFFSET + capacity * 2]
+
+        if not self._owner:
+            storage = storage.toreadonly()
+
+        self._base_address = numpy.frombuffer(storage, numpy.uint8).ctypes.data
+
+        super(SharedRingBuffer, self).__init__(capacity, storage)
+
+    @classmethod
+    def attach(cls, name):
+        """ opens the ring created under name for reading only, from any
+            local process """
+
+        memory = _open_existing(name)
+        capacity = _HEADER.unpack_from(memory.buf, 0)[1]
+
+        return cls(capacity, _memory=memory)
+
+    @property
+    def name(self):
+        """ the shared memory name other processes attach with """
+        return self._memory.name
+
+    @property
+    def _written(self):
+        return _HEADER.unpack_from(self._header, 0)[0]
+
+    @_written.setter
+    def _written(self, position):
+        if self._owner:
+            _HEADER.pack_into(self._header, 0, position, self.capacity)
+
+    def write(self, data):
+        """ copies data into the ring, only the creating process can write """
+
+        if not self._owner:
+            raise ValueError('SharedRingBuffer is attached read-only')
+
+        super(SharedRingBuffer, self).write(data)
+
+    def wait(self, position, timeout=None):
+        if self._owner:
+            return super(SharedRingBuffer, self).wait(position, timeout)
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        while self._written <= position:
+            if deadline is not None and time.time() >= deadline:
+                return False
+
+            time.sleep(_POLL_SECONDS)
+
+        return True
+
+    def add_wakeup(self, callback):
+        if not self._owner:
+            raise ValueError('wakeups are only available to the writer')
+
+        super(SharedRingBuffer, self).add_wakeup(callback)
+
+    def copy(self, start, end):
+        """ returns bytes of the absolute range [start, end), or None if the
+            writer overwrote part of it before the copy completed """
+
+        try:
+            data = bytes(self.view(start, end))
+        except ValueError:
+            return None
+
+        if start < self.oldest:
+            return None
+
+        return data
+
+    def position_of(self, view):
+        """ returns the absolute (start, end) range of a memoryview handed
+            out by this ring, or None if view is not part of the ring """
+
+        if not isinstance(view, memoryview) or not len(view):
+            return None
+
+        try:
+            offset = (numpy.frombuffer(view, numpy.uint8).ctypes.data -
+                      self._base_address)
+        except (TypeError, ValueError):
+            return None
+
+        if offset < 0 or offset + len(view) > self.capacity * 2:
+            return None
+
+        written = self._written
+        end = written - (written - offset - len(view)) % self.capacity
+
+        return end - len(view), end
+
+    def close(self):
+        """ releases this process's mapping, the creator also destroys the
+            segment
+
+            The segment is unlinked first, so it never outlives the
+            creator. Views handed out earlier may still point into the
+            mapping, in which case it is unmapped once the last of them
+            is collected.
+        """
+
+        memory, self._memory = self._memory, None
+
+        if memory is None:
+            return
+
+        if self._owner:
+            memory.unlink()
+
+        self._view.release()
+        self._data.release()
+        self._header.release()
+
+        try:
+            memory.close()
+        except BufferError:
+            logging.debug('shared ring %s is still viewed, leaving it ' +
+                          'mapped until the views are collected', memory.name)
+            # the views keep the mmap alive, SharedMemory only needs to
+            # forget it before closing its file descriptor
+            # pylint: disable=protected-access
+            memory._mmap = None
+            memory.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
@@ -0,0 +1,268 @@
+""" reduces multi-channel microphone array audio, at any rate, to the mono
+    audio the detectors expect """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import numpy
+from tabitha.components import create_component, register_component
+from tabitha.metrics import thread_time
+from tabitha.objectdict import ObjectDict
+from tabitha.pcm import SAMPLE_TYPES
+from tabitha.resampler import ResamplingWriter
+
+
+def input_channels(config):
+    """ the number of channels sources deliver, source.channels
+
+        audio.channels is not used, it stays the channels of the mono
+        buffer the detectors, codecs and tools read after the source. """
+    return config.get('source.channels', 1)
+
+
+def input_rate(config):
+    """ the sample rate sources deliver, source.sample_rate or, when the
+        device already delivers it, audio.sample_rate """
+    return config.get('source.sample_rate',
+                      config.get('audio.sample_rate', 16000))
+
+
+class DownmixStage(object):
+    """ averages the channels, or weights them by source.reduce.weights """
+
+    def __init__(self, config, channels):
+        weights = config.get('source.reduce.weights') or [1.0] * channels
+
+        if len(weights) != channels:
+            raise ValueError('source.reduce.weights needs %d weights' %
+                             channels)
+
+        self._weights = numpy.asarray(weights, numpy.float32)
+        self._weights /= self._weights.sum()
+
+    def process(self, block):
+        """ returns the mono mix of a (frames, channels) block """
+        return block.dot(self._weights)
+
+
+class BestChannelStage(object):
+    """ passes on the channel with the best signal to noise ratio
+
+        Each channel's noise floor falls immediately to quieter blocks and
+        rises by at most source.reduce.noise_rise_db per second. The
+        selection only moves to another channel when it is better by
+        source.reduce.switch_db, and a switch crossfades over one block,
+        so there is no click.
+    """
+
+    def __init__(self, config, channels):
+        sample_rate = input_rate(config)
+        self._rise_db_per_sample = (config.get('source.reduce.noise_rise_db',
+                                               3.0) / sample_rate)
+        self._switch_db = config.get('source.reduce.switch_db', 3.0)
+        self._noise = numpy.full(channels, numpy.inf)
+        self.channel = 0
+        self.snr_db = numpy.zeros(channels)
+
+    def process(self, block):
+        """ returns the best channel of a (frames, channels) block """
+
+        energy = numpy.maximum(numpy.einsum('ij,ij->j', block, block) /
+                               max(len(block), 1), 1e-9)
+        rise = 10 ** (self._rise_db_per_sample * len(block) / 10)
+        self._noise = numpy.minimum(self._noise * rise, energy)
+        self.snr_db = 10 * numpy.log10(energy / self._noise)
+        best = int(numpy.argmax(self.snr_db))
+        previous = self.channel
+
+        if (best == previous or
+                self.snr_db[best] - self.snr_db[previous] < self._switch_db):
+            return block[:, previous]
+
+        self.channel = best
+        fade = numpy.linspace(0, 1, len(block), dtype=numpy.float32)
+
+        return block[:, previous] * (1 - fade) + block[:, best] * fade
+
+
+class DelayAndSumStage(object):
+    """ steers the array with a delay and sum beamformer
+
+        Each channel is shifted by its delay relative to the first channel
+        (source.reduce.delays, in samples) before averaging, so sound from
+        the steered direction adds up while noise from elsewhere does not.
+        Without fixed delays they are estimated by GCC-PHAT every
+        source.reduce.estimate_ms of audio, within source.reduce.max_delay
+        samples, the largest delay the array's geometry allows. The stage
+        delays the audio by max_delay samples, the history it keeps to
+        shift across block boundaries.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, config, channels):
+        sample_rate = input_rate(config)
+        delays = config.get('source.reduce.delays')
+        max_delay = config.get('source.reduce.max_delay', 16)
+
+        if delays is not None:
+            if len(delays) != channels:
+                raise ValueError('source.reduce.delays needs %d delays' %
+                                 channels)
+
+            max_delay = max(max_delay, max(abs(delay) for delay in delays))
+
+        self._max_delay = max_delay
+        self._estimate = delays is None and max_delay > 0
+        self._estimate_samples = int(
+            config.get('source.reduce.estimate_ms', 500) * sample_rate / 1000)
+        self._min_coherence = config.get('source.reduce.min_coherence', 0.1)
+        self._history = numpy.zeros((2 * max_delay, channels),
+                                    numpy.float32)
+        self._pending = []
+        self._pending_samples = 0
+        self.delays = numpy.asarray(delays or [0] * channels, int)
+
+    def _estimate_delays(self, window):
+        """ GCC-PHAT of every channel against the first """
+
+        size = 2 * len(window)
+        spectra = numpy.fft.rfft(window, size, axis=0)
+        cross = spectra * numpy.conj(spectra[:, :1])
+        cross /= numpy.maximum(numpy.abs(cross), 1e-12)
+        correlation = numpy.fft.irfft(cross, size, axis=0)
+        max_delay = self._max_delay
+        lags = numpy.concatenate([correlation[-max_delay:],
+                                  correlation[:max_delay + 1]])
+        peaks = lags.argmax(axis=0)
+
+        if lags.max(axis=0)[1:].min(initial=1.0) >= self._min_coherence:
+            self.delays = peaks - max_delay
+
+    def process(self, block):
+        """ returns the beamformed mono of a (frames, channels) block """
+
+        if self._estimate:
+            self._pending.append(block)
+            self._pending_samples += len(block)
+
+            if self._pending_samples >= self._estimate_samples:
+                self._estimate_delays(numpy.concatenate(self._pending))
+                self._pending = []
+                self._pending_samples = 0
+
+        frames = len(block)
+        extended = numpy.concatenate([self._history, block])
+        self._history = extended[frames:]
+        output = numpy.zeros(frames, numpy.float32)
+
+        for channel, delay in enumerate(self.delays):
+            start = self._max_delay + delay
+            output += extended[start:start + frames, channel]
+
+        return output / len(self.delays)
+
+
+register_component('reduction', 'downmix', DownmixStage)
+register_component('reduction', 'best_channel', BestChannelStage)
+register_component('reduction', 'delay_and_sum', DelayAndSumStage)
+
+
+class ChannelReducer(object):
+    """ reduces interleaved multi-channel audio to mono before a sink
+
+        Sources write source.channels interleaved audio to extend(). Each
+        chunk is viewed as a (frames, channels) array, channel(n) slices
+        of which are strided views of the chunk rather than copies, and
+        the source.reduce stage (downmix, the default, best_channel or
+        delay_and_sum, or any registered 'reduction' component) turns the
+        block into mono for the sink, normally the AudioBuffer the mono
+        detectors read. A partial trailing frame is kept for the next
+        chunk. stats records the blocks, audio and CPU, cpu_per_channel
+        the CPU per second of audio per channel.
+    """
+
+    def __init__(self, config, sink, channels=None):
+        audio_width = config.get('audio.width', 2)
+
+        if audio_width not in SAMPLE_TYPES:
+            raise ValueError('ChannelReducer does not support ' +
+                             'audio.width %s' % audio_width)
+
+        self.channels = channels or input_channels(config)
+        self._sink = sink
+        self._sample_type = numpy.dtype(SAMPLE_TYPES[audio_width])
+        self._frame_bytes = self.channels * audio_width
+        self._scale = float(2 ** (8 * audio_width - 1))
+        self._sample_rate = input_rate(config)
+        self._partial = bytearray()
+        self._block = None
+        self.stage = create_component(
+            'reduction', config, self.channels,
+            name=config.get('source.reduce', 'downmix'))
+        self.stats = ObjectDict({'blocks': 0, 'frames': 0,
+                                 'cpu_seconds': 0.0})
+
+    @property
+    def cpu_per_channel(self):
+        """ reduction CPU seconds per second of audio per channel """
+
+        if not self.stats.frames:
+            return None
+
+        audio_seconds = self.stats.frames / self._sample_rate
+        return self.stats.cpu_seconds / audio_seconds / self.channels
+
+    def channel(self, index):
+        """ a view of one channel of the latest block, without copying """
+        return self._block[:, index]
+
+    def extend(self, data):
+        """ reduces interleaved audio and writes it to the sink """
+
+        start_time = thread_time()
+
+        if self._partial:
+            self._partial.extend(data)
+            data = self._partial
+            self._partial = bytearray()
+
+        usable = len(data) - len(data) % self._frame_bytes
+
+        if usable < len(data):
+            self._partial.extend(memoryview(data)[usable:])
+
+        if not usable:
+            return
+
+        self._block = numpy.frombuffer(
+            data, self._sample_type, usable // self._sample_type.itemsize
+            ).reshape(-1, self.channels)
+        mono = self.stage.process(self._block.astype(numpy.float32) /
+                                  self._scale)
+        pcm = numpy.clip(mono * self._scale, -self._scale,
+                         self._scale - 1).astype(self._sample_type)
+
+        self.stats.blocks += 1
+        self.stats.frames += len(pcm)
+        self.stats.cpu_seconds += thread_time() - start_time
+        self._sink.extend(pcm.tobytes())
+
+
+def source_writer(config, audio_buffer):
+    """ what a source writes to: the buffer itself for mono sources at
+        audio.sample_rate, otherwise a ResamplingWriter in front of it
+        converting source.sample_rate audio and a ChannelReducer in front
+        of that, reducing the channels before they are resampled """
+
+    writer = audio_buffer
+    sample_rate = config.get('audio.sample_rate', 16000)
+
+    if input_rate(config) != sample_rate:
+        writer = ResamplingWriter(config, writer, input_rate(config),
+                                  sample_rate)
+
+    if input_channels(config) != 1:
+        writer = ChannelReducer(config, writer)
+
+    return writer
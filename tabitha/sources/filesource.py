@@ -0,0 +1,225 @@
+""" provides a source of audio data replayed from recordings """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import io
+import os
+import threading
+import time
+import wave
+from tabitha.audiobuffer import AudioBuffer
+from tabitha.clock import SystemClock, VirtualClock
+from tabitha.objectdict import ObjectDict
+from tabitha.sources.channels import input_channels, input_rate
+from tabitha.sources.channels import source_writer
+
+_WAV_EXTENSIONS = ('.wav', '.wave')
+_PCM_EXTENSIONS = ('.pcm', '.raw')
+
+
+class _PcmReader(object):
+    """ reads headerless PCM in frames, mirroring the wave reader API """
+
+    def __init__(self, path, frame_bytes):
+        self._file = io.open(path, 'rb')
+        self._frame_bytes = frame_bytes
+
+    def readframes(self, frame_count):
+        """ returns up to frame_count frames """
+        return self._file.read(frame_count * self._frame_bytes)
+
+    def close(self):
+        """ closes the file """
+        self._file.close()
+
+
+class FileSource(object):
+    """ replays WAV or raw PCM recordings into an AudioBuffer
+
+        With source.file.realtime a thread delivers audio at the recorded
+        pace. Otherwise audio is delivered on demand, in the consumer's
+        thread, whenever a reader runs out, so recordings play as fast as
+        the detectors can consume them. clock is then a VirtualClock that
+        advances with the audio delivered, VoiceClient uses it for its
+        timeouts. files lists each recording's start and end position in
+        the buffer, and exhausted is set once everything was delivered.
+        Recordings with source.channels channels are reduced to mono and
+        those at a source.sample_rate other than audio.sample_rate
+        resampled on the way into the buffer.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, paths, config=None, audio_buffer=None):
+        config = config or {}
+
+        self._config = ObjectDict({
+            'channels': input_channels(config),
+            'sample_rate': input_rate(config),
+            'audio_width': config.get('audio.width', 2),
+            'frames_per_buffer': config.get('source.file.frames_per_buffer',
+                                            1024),
+            'realtime': config.get('source.file.realtime', False),
+            'gap_ms': config.get('source.file.gap_ms', 0)})
+
+        self._frame_bytes = self._config.channels * self._config.audio_width
+        self._paths = list(paths)
+        self._pending = []
+        self._current = None
+        self._feed_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+        self.buffer = audio_buffer or AudioBuffer(config)
+        self.writer = source_writer(config, self.buffer)
+        self.clock = (SystemClock() if self._config.realtime
+                      else VirtualClock())
+        self.files = []
+        self.exhausted = False
+
+    def _open(self, path):
+        if path.lower().endswith(_PCM_EXTENSIONS):
+            return _PcmReader(path, self._frame_bytes)
+
+        reader = wave.open(path, 'rb')
+        expected = (self._config.channels, self._config.audio_width,
+                    self._config.sample_rate)
+        actual = (reader.getnchannels(), reader.getsampwidth(),
+                  reader.getframerate())
+
+        if actual != expected:
+            reader.close()
+            raise ValueError(('%s has channels, width, sample_rate %s ' +
+                              'but was configured with %s') %
+                             (path, actual, expected))
+
+        return reader
+
+    def _next_file(self):
+        if self._current:
+            self._current.close()
+            self.files[-1].end = self.buffer.written
+
+        if not self._pending:
+            self._current = None
+            return False
+
+        path = self._pending.pop(0)
+
+        if self.files and self._config.gap_ms:
+            self._write(bytes(int(self._config.gap_ms *
+                                  self._config.sample_rate / 1000) *
+                              self._frame_bytes))
+
+        self._current = self._open(path)
+        self.files.append(ObjectDict({'path': path,
+                                      'start': self.buffer.written,
+                                      'start_time': self.clock.time(),
+                                      'end': None}))
+        return True
+
+    def _write(self, data):
+        self.writer.extend(data)
+
+        if not self._config.realtime:
+            self.clock.advance(len(data) / self._frame_bytes /
+                               self._config.sample_rate)
+
+    def _read_chunk(self):
+        """ delivers the next chunk, returns False once all files are done """
+
+        while self._current or self._next_file():
+            data = self._current.readframes(self._config.frames_per_buffer)
+
+            if data:
+                self._write(data)
+                return True
+
+            self._next_file()
+
+        if not self.exhausted:
+            self.exhausted = True
+            self.buffer.interrupt()
+
+        return False
+
+    def _feed(self):
+        with self._feed_lock:
+            if self._running:
+                self._read_chunk()
+
+    def _replay_thread(self):
+        chunk_seconds = (self._config.frames_per_buffer /
+                         self._config.sample_rate)
+        next_time = time.time()
+
+        while self._running and self._read_chunk():
+            next_time += chunk_seconds
+            delay = next_time - time.time()
+
+            if delay > 0:
+                time.sleep(delay)
+
+    def start(self):
+        """ starts replaying the recordings from the beginning """
+
+        self.stop()
+        self._pending = list(self._paths)
+        self.files = []
+        self.exhausted = False
+        self._running = True
+
+        if self._config.realtime:
+            self._thread = threading.Thread(target=self._replay_thread)
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self.buffer.set_feeder(self._feed)
+
+    def stop(self):
+        """ stops replaying """
+
+        self._running = False
+        self.buffer.set_feeder(None)
+
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+        if self._current:
+            self._current.close()
+            self._current = None
+
+    def terminate(self):
+        """ releases the open file """
+        self.stop()
+
+
+class WavFileSource(FileSource):
+    """ replays a single WAV file """
+
+    def __init__(self, path, config=None, audio_buffer=None):
+        super(WavFileSource, self).__init__([path], config, audio_buffer)
+
+
+class PcmFileSource(FileSource):
+    """ replays a single headerless PCM file in the configured format """
+
+    def __init__(self, path, config=None, audio_buffer=None):
+        super(PcmFileSource, self).__init__([path], config, audio_buffer)
+
+    def _open(self, path):
+        return _PcmReader(path, self._frame_bytes)
+
+
+class DirectorySource(FileSource):
+    """ replays every WAV and PCM file in a directory in name order,
+        separated by source.file.gap_ms of silence """
+
+    def __init__(self, directory, config=None, audio_buffer=None):
+        paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(_WAV_EXTENSIONS + _PCM_EXTENSIONS))
+
+        super(DirectorySource, self).__init__(paths, config, audio_buffer)
@@ -0,0 +1,467 @@
+""" provides audio data streamed as PCM packets over UDP or TCP """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import logging
+import selectors
+import socket
+import struct
+import threading
+from tabitha.audiobuffer import AudioBuffer
+from tabitha.objectdict import ObjectDict
+from tabitha.sources.channels import source_writer
+
+# stream id, sequence number, payload length
+_HEADER = struct.Struct('!IIH')
+_MAX_PAYLOAD = 8192
+_SEQUENCE_MOD = 2 ** 32
+# gaps longer than this are treated as a sender restart, not packet loss
+_MAX_CONCEAL_PACKETS = 50
+# remembers which recent sequence numbers were concealed, must be larger
+# than _MAX_CONCEAL_PACKETS
+_CONCEALED_SLOTS = 64
+
+
+def _sequence_delta(sequence, expected):
+    """ signed distance between two wrapping 32 bit sequence numbers """
+    return ((sequence - expected + 2 ** 31) % _SEQUENCE_MOD) - 2 ** 31
+
+
+class JitterBuffer(object):
+    """ reorders packets and conceals gaps before audio reaches a buffer
+
+        In-order packets are written straight through. Packets after a gap
+        are held in preallocated slots until the missing packet arrives or
+        more than depth packets are waiting, then the gap is filled with
+        silence. A packet arriving after its gap was filled grows depth,
+        a long run without reordering shrinks it again, packets which were
+        already written are counted as duplicates and ignored. A jump of
+        more than _MAX_CONCEAL_PACKETS in either direction resynchronises
+        on the new sequence instead.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, write, min_depth=1, max_depth=8, shrink_after=500):
+        self._write = write
+        self._min_depth = min_depth
+        self._max_depth = max_depth
+        self._shrink_after = shrink_after
+        self._slots = [bytearray(_MAX_PAYLOAD) for _ in range(max_depth)]
+        self._free = list(range(max_depth))
+        self._held = {}
+        self._silence = bytes(_MAX_PAYLOAD)
+        self._concealed = [None] * _CONCEALED_SLOTS
+        self._payload_size = 0
+        self._expected = None
+        self._in_order_run = 0
+        self.depth = min_depth
+        self.stats = ObjectDict({'packets': 0, 'reordered': 0, 'late': 0,
+                                 'lost': 0, 'duplicates': 0, 'resyncs': 0})
+
+    def push(self, sequence, payload):
+        """ adds a packet, payload is only read during the call """
+
+        self.stats.packets += 1
+        self._payload_size = len(payload)
+
+        if self._expected is None:
+            self._expected = sequence
+
+        delta = _sequence_delta(sequence, self._expected)
+
+        if abs(delta) > _MAX_CONCEAL_PACKETS:
+            self._resync(sequence)
+            delta = 0
+
+        if delta < 0:
+            slot = sequence % _CONCEALED_SLOTS
+
+            if self._concealed[slot] != sequence:
+                self.stats.duplicates += 1
+                return
+
+            self._concealed[slot] = None
+            self.stats.late += 1
+            self._grow()
+            return
+
+        if delta == 0:
+            self._write_next(payload)
+            self._note_in_order()
+            return
+
+        if sequence in self._held:
+            self.stats.duplicates += 1
+            return
+
+        if delta >= self._max_depth or not self._free:
+            self._conceal_until(sequence)
+            self._write_next(payload)
+            return
+
+        self.stats.reordered += 1
+        slot = self._free.pop()
+        self._slots[slot][:len(payload)] = payload
+        self._held[sequence] = (slot, len(payload))
+
+        if len(self._held) > self.depth:
+            self._conceal_until(min(self._held, key=lambda held: (
+                _sequence_delta(held, self._expected))))
+
+    def _resync(self, sequence):
+        self.stats.resyncs += 1
+
+        for held in sorted(self._held, key=lambda held: (
+                _sequence_delta(held, self._expected))):
+            slot, size = self._held.pop(held)
+            self._write(memoryview(self._slots[slot])[:size])
+            self._free.append(slot)
+
+        self._concealed = [None] * _CONCEALED_SLOTS
+        self._expected = sequence
+
+    def _write_next(self, payload):
+        """ writes the expected packet and any held packets following it """
+
+        self._write(payload)
+        self._advance()
+        self._release_held()
+
+    def _advance(self):
+        self._expected = (self._expected + 1) % _SEQUENCE_MOD
+
+    def _release_held(self):
+        while self._expected in self._held:
+            slot, size = self._held.pop(self._expected)
+            self._write(memoryview(self._slots[slot])[:size])
+            self._free.append(slot)
+            self._advance()
+
+    def _conceal_until(self, sequence):
+        while _sequence_delta(sequence, self._expected) > 0:
+            if self._expected in self._held:
+                self._release_held()
+                continue
+
+            self.stats.lost += 1
+            self._concealed[self._expected % _CONCEALED_SLOTS] = \
+                self._expected
+            self._write(memoryview(self._silence)[:self._payload_size])
+            self._advance()
+
+        self._release_held()
+
+    def _grow(self):
+        self._in_order_run = 0
+        self.depth = min(self.depth + 1, self._max_depth)
+
+    def _note_in_order(self):
+        self._in_order_run += 1
+
+        if self._in_order_run >= self._shrink_after:
+            self._in_order_run = 0
+            self.depth = max(self.depth - 1, self._min_depth)
+
+
+class NetworkStream(object):
+    """ one device's audio stream, usable anywhere a source is expected
+
+        Devices send source.sample_rate audio with source.channels
+        channels, which the stream's writer reduces to mono and resamples
+        to audio.sample_rate after the JitterBuffer.
+    """
+
+    def __init__(self, source, stream_id, config):
+        self.stream_id = stream_id
+        self.buffer = AudioBuffer(config)
+        self.writer = source_writer(config, self.buffer)
+        self.is_active = True
+        self._source = source
+        self.jitter = JitterBuffer(
+            self.writer.extend,
+            config.get('source.network.jitter_min_packets', 1),
+            config.get('source.network.jitter_max_packets', 8))
+
+    def start(self):
+        """ accepts packets for the stream, starting the server if needed """
+        self.is_active = True
+        self._source.start()
+
+    def stop(self):
+        """ ignores further packets for the stream """
+        self.is_active = False
+
+
+class _TcpConnection(object):
+    """ reassembles framed packets from a TCP connection """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.packet = memoryview(bytearray(_HEADER.size + _MAX_PAYLOAD))
+        self.filled = 0
+        self.needed = _HEADER.size
+
+
+class NetworkSource(object):
+    """ receives PCM packets for many concurrent streams
+
+        Every packet is a header (stream id, sequence number and payload
+        length as network order uint32, uint32, uint16) followed by the
+        PCM payload, sent as one UDP datagram or back to back over TCP.
+        Each stream id gets its own NetworkStream with an AudioBuffer and
+        a JitterBuffer. Sockets are read with recv_into into preallocated
+        buffers from one selector thread, so ingest does not allocate per
+        packet. on_stream is called with each new NetworkStream.
+
+        At most source.network.max_streams (default 64) streams are
+        created, packets for further stream ids are dropped. A TCP packet
+        announcing a payload over 8192 bytes closes its connection.
+    """
+
+    def __init__(self, config=None, on_stream=None):
+        config = config or {}
+
+        self._config = config
+        self._host = config.get('source.network.host', '127.0.0.1')
+        self._udp_port = config.get('source.network.udp_port', 7100)
+        self._tcp_port = config.get('source.network.tcp_port', 7101)
+        self._max_streams = config.get('source.network.max_streams', 64)
+        self._on_stream = on_stream
+        self._refused_packets = 0
+        self._streams = {}
+        self._streams_lock = threading.Lock()
+        self._connections = {}
+        self._selector = None
+        self._thread = None
+        self._running = threading.Event()
+        self._datagram = memoryview(bytearray(_HEADER.size + _MAX_PAYLOAD))
+        self.udp_address = None
+        self.tcp_address = None
+
+    @property
+    def streams(self):
+        """ the known streams by stream id """
+        return dict(self._streams)
+
+    def stream(self, stream_id):
+        """ returns the stream for stream_id, creating it if needed """
+
+        with self._streams_lock:
+            stream = self._streams.get(stream_id)
+
+            if stream:
+                return stream
+
+            if len(self._streams) >= self._max_streams:
+                raise ValueError('NetworkSource already has %d streams' %
+                                 self._max_streams)
+
+            stream = NetworkStream(self, stream_id, self._config)
+            self._streams[stream_id] = stream
+
+        if self._on_stream:
+            self._on_stream(stream)
+
+        return stream
+
+    def start(self):
+        """ binds the sockets and starts receiving packets """
+
+        if self._running.is_set():
+            return
+
+        self._selector = selectors.DefaultSelector()
+
+        if self._udp_port is not None:
+            udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp_socket.bind((self._host, self._udp_port))
+            udp_socket.setblocking(False)
+            self.udp_address = udp_socket.getsockname()
+            self._selector.register(udp_socket, selectors.EVENT_READ,
+                                    self._read_datagram)
+
+        if self._tcp_port is not None:
+            tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            tcp_socket.bind((self._host, self._tcp_port))
+            tcp_socket.listen(16)
+            tcp_socket.setblocking(False)
+            self.tcp_address = tcp_socket.getsockname()
+            self._selector.register(tcp_socket, selectors.EVENT_READ,
+                                    self._accept)
+
+        self._running.set()
+        self._thread = threading.Thread(target=self._receive_thread)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ stops receiving and closes all sockets """
+
+        if not self._running.is_set():
+            return
+
+        self._running.clear()
+        self._thread.join()
+
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+
+        self._selector.close()
+        self._selector = None
+        self._connections.clear()
+
+        for stream in self.streams.values():
+            stream.buffer.interrupt()
+
+    def terminate(self):
+        """ releases all resources """
+        self.stop()
+
+    def _receive_thread(self):
+        while self._running.is_set():
+            for key, _ in self._selector.select(timeout=0.2):
+                key.data(key.fileobj)
+
+    def _deliver(self, packet):
+        stream_id, sequence, length = _HEADER.unpack_from(packet)
+        payload = packet[_HEADER.size:_HEADER.size + length]
+
+        if len(payload) != length:
+            logging.warning('dropping truncated packet for stream %s',
+                            stream_id)
+            return
+
+        stream = self._streams.get(stream_id)
+
+        if stream is None:
+            try:
+                stream = self.stream(stream_id)
+            except ValueError:
+                if not self._refused_packets:
+                    logging.warning('dropping packets for stream %s, ' +
+                                    'source.network.max_streams is %d',
+                                    stream_id, self._max_streams)
+
+                self._refused_packets += 1
+                return
+
+        if stream.is_active:
+            stream.jitter.push(sequence, payload)
+
+    def _read_datagram(self, sock):
+        try:
+            size = sock.recv_into(self._datagram)
+        except (BlockingIOError, InterruptedError):
+            return
+
+        if size >= _HEADER.size:
+            self._deliver(self._datagram[:size])
+
+    def _accept(self, sock):
+        try:
+            connection, _ = sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+
+        connection.setblocking(False)
+        self._selector.register(connection, selectors.EVENT_READ,
+                                self._read_stream)
+        self._connections[connection] = _TcpConnection(connection)
+
+    def _read_stream(self, sock):
+        connection = self._connections[sock]
+
+        try:
+            size = sock.recv_into(
+                connection.packet[connection.filled:connection.needed])
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, socket.error):
+            size = 0
+
+        if not size:
+            self._close_connection(sock)
+            return
+
+        connection.filled += size
+
+        if connection.filled < connection.needed:
+            return
+
+        if connection.needed == _HEADER.size:
+            stream_id, _, length = _HEADER.unpack_from(connection.packet)
+
+            if length > _MAX_PAYLOAD:
+                logging.warning(('closing connection sending a %d byte ' +
+                                 'packet for stream %s, the limit is %d'),
+                                length, stream_id, _MAX_PAYLOAD)
+                self._close_connection(sock)
+                return
+
+            if length:
+                connection.needed += length
+                return
+
+        self._deliver(connection.packet[:connection.needed])
+        connection.filled = 0
+        connection.needed = _HEADER.size
+
+    def _close_connection(self, sock):
+        self._selector.unregister(sock)
+        del self._connections[sock]
+        sock.close()
+
+
+class NetworkAudioClient(object):
+    """ sends PCM to a NetworkSource, e.g. from a device or a test """
+
+    def __init__(self, address, stream_id, protocol='udp',
+                 payload_bytes=640):
+        if protocol not in ('udp', 'tcp'):
+            raise ValueError('protocol must be udp or tcp')
+
+        if payload_bytes > _MAX_PAYLOAD:
+            raise ValueError('payload_bytes can be at most %d' % _MAX_PAYLOAD)
+
+        self.sequence = 0
+        self._stream_id = stream_id
+        self._payload_bytes = payload_bytes
+        self._packet = bytearray(_HEADER.size + payload_bytes)
+
+        if protocol == 'udp':
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        self._socket.connect(tuple(address))
+
+    def packets(self, data):
+        """ splits data into (sequence, payload) pairs, numbering them """
+
+        data = memoryview(data)
+
+        for offset in range(0, len(data), self._payload_bytes):
+            yield self.sequence, data[offset:offset + self._payload_bytes]
+            self.sequence = (self.sequence + 1) % _SEQUENCE_MOD
+
+    def send_packet(self, sequence, payload):
+        """ sends a single packet with an explicit sequence number """
+
+        size = _HEADER.size + len(payload)
+        _HEADER.pack_into(self._packet, 0, self._stream_id, sequence,
+                          len(payload))
+        self._packet[_HEADER.size:size] = payload
+        self._socket.sendall(memoryview(self._packet)[:size])
+
+    def send(self, data):
+        """ sends data as consecutive packets """
+
+        for sequence, payload in self.packets(data):
+            self.send_packet(sequence, payload)
+
+    def close(self):
+        """ closes the connection """
+        self._socket.close()
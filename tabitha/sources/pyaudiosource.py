@@ -4,24 +4,31 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 import pyaudio
 from tabitha.objectdict import ObjectDict
+from tabitha.sources.channels import input_channels, input_rate
+from tabitha.sources.channels import source_writer
 
 
 class PyAudioSource(object):
-    """ uses PyAudio to capture audio data """
+    """ uses PyAudio to capture audio data
+
+        The device is opened at source.sample_rate with source.channels
+        channels, microphone arrays are reduced to mono and other rates
+        resampled to audio.sample_rate on the way into the buffer.
+    """
 
     def __init__(self, config=None, audio_buffer=None):
         config = config or {}
 
         if not audio_buffer:
             from tabitha.audiobuffer import AudioBuffer
-            audio_buffer = AudioBuffer()
+            audio_buffer = AudioBuffer(config)
 
         audio_width = config.get('audio.width', 2)
 
         self._config = ObjectDict({
             'format': pyaudio.get_format_from_width(audio_width),
-            'channels': config.get('audio.channels', 1),
-            'rate': config.get('audio.sample_rate', 16000),
+            'channels': input_channels(config),
+            'rate': input_rate(config),
             'frames_per_buffer': config.get('source.pyaudio.frames_per_buffer',
                                             1024),
             'input_device_index':
@@ -30,12 +37,12 @@ class PyAudioSource(object):
         self._pyaudio = pyaudio.PyAudio()
         self._audio_stream = None
         self.buffer = audio_buffer
+        self.writer = source_writer(config, audio_buffer)
 
     def _stream_callback(self, in_data, dummy_frame_count,
                          dummy_time_info, dummy_status):
-        self.buffer.extend(in_data)
-        play_data = chr(0) * len(in_data)
-        return play_data, pyaudio.paContinue
+        self.writer.extend(in_data)
+        return None, pyaudio.paContinue
 
     def start(self):
         """ starts filling the audio buffer with data """
@@ -69,3 +76,4 @@ class PyAudioSource(object):
         if self._pyaudio:
             self._pyaudio.terminate()
             self._pyaudio = None
+            self.buffer.close()
@@ -0,0 +1,135 @@
+""" measures concurrent dialog throughput and latency of AlexaVoiceService
+
+    Dialogs are run against FakeAvsClient, an in-process stand-in for AVS,
+    so the handler's multiplexing and connection pool can be measured
+    without the real service.
+
+    usage: python -m tabitha.tools.avsbench [--dialogs 200] \\
+               [--concurrency 8] [--connections 2] [--audio-s 3] \\
+               [--set fakeavs.jitter_ms=200] [--async] [--json]
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import print_function
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+from tabitha.handlers.alexa import AlexaVoiceService
+from tabitha.handlers.fakeavs import FakeAvsClient
+from tabitha.tools.common import format_summary, parse_value
+
+_PERCENTILES = (50, 90, 95, 99)
+
+
+def _timed_ask(avs, audio_data):
+    start_time = time.time()
+    response = avs.ask(audio_data)
+    return time.time() - start_time, response is not None
+
+
+async def _timed_ask_async(avs, audio_data, semaphore):
+    async with semaphore:
+        start_time = time.time()
+        response = await avs.ask_async(audio_data)
+        return time.time() - start_time, response is not None
+
+
+async def _run_async(avs, audio_data, dialogs, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(concurrency))
+
+    return await asyncio.gather(*[
+        _timed_ask_async(avs, audio_data, semaphore)
+        for _ in range(dialogs)])
+
+
+def run_benchmark(config, dialogs=200, concurrency=8, audio_s=3.0,
+                  use_async=False):
+    """ runs dialogs asks, concurrency at a time, and summarises them """
+
+    config = dict(config)
+    config.setdefault('handlers.alexa.client_id', 'fake')
+    config.setdefault('handlers.alexa.client_secret', 'fake')
+    config.setdefault('handlers.alexa.refresh_token', 'fake')
+    config['handlers.alexa.client_factory'] = FakeAvsClient.factory(config)
+
+    avs = AlexaVoiceService(config)
+    audio_data = bytes(int(audio_s * 32000) // 2 * 2)
+    wall_start = time.time()
+
+    try:
+        if use_async:
+            results = asyncio.run(_run_async(avs, audio_data, dialogs,
+                                             concurrency))
+        else:
+            with ThreadPoolExecutor(concurrency) as pool:
+                results = list(pool.map(lambda _: _timed_ask(avs, audio_data),
+                                        range(dialogs)))
+    finally:
+        avs.terminate()
+
+    wall_s = time.time() - wall_start
+    latencies = [latency for latency, answered in results if answered]
+
+    return {
+        'dialogs': dialogs,
+        'concurrency': concurrency,
+        'connections': int(config.get('handlers.alexa.connections', 1)),
+        'answered': len(latencies),
+        'timeouts': avs.stats.timeouts,
+        'unmatched_directives': avs.stats.unmatched_directives,
+        'max_in_flight': avs.stats.max_in_flight,
+        'wall_s': wall_s,
+        'dialogs_per_s': dialogs / wall_s if wall_s else None,
+        'latency_s': (dict(('p%d' % percentile,
+                            float(numpy.percentile(latencies, percentile)))
+                           for percentile in _PERCENTILES + (100,))
+                      if latencies else None)}
+
+
+def main(argv=None):
+    """ command line entry point """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark concurrent AlexaVoiceService dialogs')
+    parser.add_argument('--dialogs', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--connections', type=int, default=2,
+                        help='handlers.alexa.connections')
+    parser.add_argument('--audio-s', type=float, default=3.0,
+                        help='seconds of audio uploaded per dialog')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='KEY=VALUE', help='override a config value')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='use ask_async on an event loop')
+    parser.add_argument('--json', action='store_true',
+                        help='print machine readable results')
+    args = parser.parse_args(argv)
+
+    config = {'handlers.alexa.connections': args.connections}
+
+    for override in args.set:
+        key, _, value = override.partition('=')
+        config[key] = parse_value(value)
+
+    summary = run_benchmark(config, args.dialogs, args.concurrency,
+                            args.audio_s, args.use_async)
+
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print(format_summary(summary))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+""" helpers shared by the command line tools """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import json
+
+
+def parse_value(value):
+    """ parses a --set value as JSON, falling back to the plain string """
+
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def format_summary(summary):
+    """ formats a summary dict as aligned key value lines """
+
+    lines = []
+
+    for key in sorted(summary):
+        value = summary[key]
+
+        if isinstance(value, dict):
+            value = ' '.join('%s=%.3f' % (name, value[name])
+                             for name in sorted(value))
+        elif isinstance(value, float):
+            value = '%.4f' % value
+
+        lines.append('%-28s %s' % (key, value))
+
+    return '\n'.join(lines)
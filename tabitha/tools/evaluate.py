@@ -0,0 +1,328 @@
+""" evaluates trigger and break detectors against a labelled corpus
+
+    The corpus manifest is a JSON lines file, one recording per line:
+
+        {"path": "kitchen-01.wav",
+         "hotwords": [3.42, 17.8],
+         "utterances": [{"start": 3.42, "end": 5.9}]}
+
+    hotwords are the times (seconds) at which each spoken hotword ends and
+    utterances give, for each request, the time capture would start and
+    the time speech really ends. Paths are relative to the manifest.
+
+    usage: python -m tabitha.tools.evaluate corpus.jsonl \\
+               [--set trigger.snowboy.sensitivity=0.6] [--break rms] \\
+               [--gate] [--jobs 4] [--json]
+
+    --set values are read as JSON where they parse, so 0.6 is a number,
+    and as plain strings otherwise, e.g. a sensitivity per hotword as
+    --set trigger.snowboy.sensitivity=0.5,0.6.
+
+    Running with and without --gate compares GatedTriggerDetector against
+    the bare trigger: trigger_cpu_s_per_audio_s gives the CPU saving and
+    trigger_latency_s any added latency.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import print_function
+import argparse
+import bisect
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+import yaml
+from tabitha.tools.common import format_summary, parse_value
+
+_PERCENTILES = (50, 90, 95, 99)
+_detectors = {}
+
+
+def _create_trigger(config):
+    if config.get('evaluate.gate'):
+        from tabitha.triggers.gated import GatedTriggerDetector
+        return GatedTriggerDetector(config)
+
+    from tabitha.triggers.snowboy import SnowboyTriggerDetector
+    return SnowboyTriggerDetector(config)
+
+
+def _create_break(config):
+    if config.get('evaluate.break') == 'rms':
+        from tabitha.breakdetectors.rmssilence import RmsSilenceDetector
+        return RmsSilenceDetector(config)
+
+    from tabitha.breakdetectors.vadsilence import VadSilenceDetector
+    return VadSilenceDetector(config)
+
+
+def _trigger_detector(config):
+    """ the trigger detector is built once per worker process, as loading
+        the model is slow, and reset for each recording """
+
+    if 'trigger' not in _detectors:
+        _detectors['trigger'] = _create_trigger(config)
+
+    detector = _detectors['trigger']
+    detector.reset()
+
+    return detector
+
+
+def _read_chunks(path, config):
+    """ yields (end_time, chunk) for the recording at path """
+
+    frames_per_buffer = config.get('source.file.frames_per_buffer', 1024)
+    reader = wave.open(path, 'rb')
+
+    try:
+        expected = (config.get('audio.channels', 1),
+                    config.get('audio.width', 2),
+                    config.get('audio.sample_rate', 16000))
+        actual = (reader.getnchannels(), reader.getsampwidth(),
+                  reader.getframerate())
+
+        if actual != expected:
+            raise ValueError(('%s has channels, width, sample_rate %s ' +
+                              'but was configured with %s') %
+                             (path, actual, expected))
+
+        frames = 0
+        data = reader.readframes(frames_per_buffer)
+
+        while data:
+            frames += len(data) // (actual[0] * actual[1])
+            yield frames / actual[2], data
+            data = reader.readframes(frames_per_buffer)
+    finally:
+        reader.close()
+
+
+def _evaluate_triggers(chunks, labels, config):
+    detector = _trigger_detector(config)
+    refractory = config.get('evaluate.refractory_s', 1.0)
+    max_latency = config.get('evaluate.max_trigger_latency_s', 1.0)
+    detections = []
+    duration = 0
+    cpu_seconds = 0.0
+
+    for end_time, chunk in chunks:
+        duration = end_time
+        start_time = time.process_time()
+        trigger_result = detector.detect(chunk)
+        cpu_seconds += time.process_time() - start_time
+
+        if not trigger_result:
+            continue
+
+        if not detections or end_time - detections[-1] > refractory:
+            detections.append(end_time)
+
+    unmatched = list(detections)
+    latencies = []
+    rejects = 0
+
+    for hotword_end in labels:
+        match = next((detection for detection in unmatched
+                      if 0 <= detection - hotword_end <= max_latency), None)
+
+        if match is None:
+            rejects += 1
+            continue
+
+        unmatched.remove(match)
+        latencies.append(match - hotword_end)
+
+    return {'duration_s': duration, 'hotwords': len(labels),
+            'false_accepts': len(unmatched), 'false_rejects': rejects,
+            'trigger_latencies_s': latencies, 'trigger_cpu_s': cpu_seconds}
+
+
+def _evaluate_breaks(chunks, utterances, config):
+    # a new detector per recording, so no noise floor is carried over
+    detector = _create_break(config)
+    end_times = [end_time for end_time, _ in chunks]
+    max_capture_s = config.get('audio.buffer.max_capture_ms', 6000) / 1000
+    latencies = []
+    early = 0
+    missed = 0
+
+    for utterance in utterances:
+        detector.reset()
+        break_time = None
+        first = bisect.bisect_right(end_times, utterance['start'])
+
+        for end_time, chunk in itertools.islice(chunks, first, None):
+            if end_time - utterance['start'] > max_capture_s:
+                break
+
+            if detector.is_break(chunk):
+                break_time = end_time
+                break
+
+        if break_time is None:
+            missed += 1
+        elif break_time < utterance['end']:
+            early += 1
+        else:
+            latencies.append(break_time - utterance['end'])
+
+    return {'utterances': len(utterances), 'early_breaks': early,
+            'missed_breaks': missed, 'break_latencies_s': latencies}
+
+
+def evaluate_recording(path, labels, config):
+    """ runs the detectors over one recording, returns its raw results """
+
+    cpu_start = time.process_time()
+    chunks = list(_read_chunks(path, config))
+    result = {'path': path}
+    result.update(_evaluate_triggers(chunks, labels.get('hotwords', []),
+                                     config))
+    result.update(_evaluate_breaks(chunks, labels.get('utterances', []),
+                                   config))
+    result['cpu_s'] = time.process_time() - cpu_start
+
+    return result
+
+
+def _percentiles(values):
+    if not values:
+        return None
+
+    return dict(('p%d' % percentile,
+                 float(numpy.percentile(values, percentile)))
+                for percentile in _PERCENTILES)
+
+
+def summarise(results):
+    """ combines per recording results into corpus metrics """
+
+    def total(key):
+        return sum(result[key] for result in results)
+
+    audio_s = total('duration_s')
+    hotwords = total('hotwords')
+    utterances = total('utterances')
+    trigger_latencies = [latency for result in results
+                         for latency in result['trigger_latencies_s']]
+    break_latencies = [latency for result in results
+                       for latency in result['break_latencies_s']]
+
+    return {
+        'recordings': len(results),
+        'audio_s': audio_s,
+        'cpu_s': total('cpu_s'),
+        'hotwords': hotwords,
+        'false_accepts': total('false_accepts'),
+        'false_accepts_per_hour': (total('false_accepts') * 3600 / audio_s
+                                   if audio_s else None),
+        'false_reject_rate': (total('false_rejects') / hotwords
+                              if hotwords else None),
+        'trigger_latency_s': _percentiles(trigger_latencies),
+        'utterances': utterances,
+        'early_break_rate': (total('early_breaks') / utterances
+                             if utterances else None),
+        'missed_break_rate': (total('missed_breaks') / utterances
+                              if utterances else None),
+        'end_of_speech_latency_s': _percentiles(break_latencies),
+        'audio_s_per_cpu_s': (audio_s / total('cpu_s')
+                              if total('cpu_s') else None),
+        'trigger_cpu_s_per_audio_s': (total('trigger_cpu_s') / audio_s
+                                      if audio_s else None)}
+
+
+def load_manifest(manifest_path):
+    """ returns (path, labels) pairs from a JSON lines manifest """
+
+    corpus_dir = os.path.dirname(os.path.abspath(manifest_path))
+    recordings = []
+
+    with io.open(manifest_path, 'r') as manifest:
+        for line in manifest:
+            if not line.strip():
+                continue
+
+            labels = json.loads(line)
+            recordings.append((os.path.join(corpus_dir, labels['path']),
+                               labels))
+
+    return recordings
+
+
+def evaluate_corpus(manifest_path, config, jobs=None):
+    """ evaluates every recording in the manifest in a process pool """
+
+    recordings = load_manifest(manifest_path)
+    wall_start = time.time()
+
+    with ProcessPoolExecutor(jobs or multiprocessing.cpu_count()) as pool:
+        futures = [pool.submit(evaluate_recording, path, labels, config)
+                   for path, labels in recordings]
+        results = [future.result() for future in futures]
+
+    summary = summarise(results)
+    summary['wall_s'] = time.time() - wall_start
+
+    return summary, results
+
+
+def main(argv=None):
+    """ command line entry point """
+
+    parser = argparse.ArgumentParser(
+        description='Evaluate Tabitha trigger and break detectors')
+    parser.add_argument('manifest', help='JSON lines corpus manifest')
+    parser.add_argument('--config', help='YAML client config')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='KEY=VALUE', help='override a config value')
+    parser.add_argument('--break', dest='break_detector', default='vad',
+                        choices=['vad', 'rms'], help='break detector to use')
+    parser.add_argument('--gate', action='store_true',
+                        help='gate the trigger with GatedTriggerDetector')
+    parser.add_argument('--jobs', type=int, help='worker processes')
+    parser.add_argument('--json', action='store_true',
+                        help='print machine readable results')
+    parser.add_argument('--per-file', action='store_true',
+                        help='include per recording results in the JSON')
+    args = parser.parse_args(argv)
+
+    config = {}
+
+    if args.config:
+        with io.open(args.config, 'r') as config_file:
+            config.update(yaml.safe_load(config_file) or {})
+
+    for override in args.set:
+        key, _, value = override.partition('=')
+        config[key] = parse_value(value)
+
+    config['evaluate.break'] = args.break_detector
+    config['evaluate.gate'] = args.gate
+
+    summary, results = evaluate_corpus(args.manifest, config, args.jobs)
+
+    if args.json:
+        output = {'config': config, 'summary': summary}
+
+        if args.per_file:
+            output['recordings'] = results
+
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print(format_summary(summary))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+""" measures how long the components a config selects take to import and
+    construct
+
+    Each run should be a fresh process, imports are only slow once. The
+    import of tabitha itself is best measured with
+    python -X importtime -c 'import tabitha'.
+
+    usage: python -m tabitha.tools.startup [--config client_config.yml] \\
+               [--set output.component=mixer] [--preload] [--json]
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import print_function
+import argparse
+import io
+import json
+import sys
+import time
+import yaml
+import tabitha
+from tabitha import components
+from tabitha.tools.common import format_summary, parse_value
+
+
+def measure(config, preload=False):
+    """ builds a VoiceClient from config, preloading its lazily built
+        components if asked, and returns the times """
+
+    start_time = time.time()
+    client = tabitha.VoiceClient(config)
+    construct_s = time.time() - start_time
+    preload_s = None
+
+    if preload:
+        start_time = time.time()
+        client.preload()
+        preload_s = time.time() - start_time
+
+    client.terminate()
+
+    summary = {'client_construct_s': construct_s,
+               'preload_s': preload_s}
+
+    for key, times in components.load_times.items():
+        summary[key] = dict(times)
+
+    return summary
+
+
+def main(argv=None):
+    """ command line entry point """
+
+    parser = argparse.ArgumentParser(
+        description='Measure tabitha import and component construction')
+    parser.add_argument('--config', help='YAML client config')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='KEY=VALUE', help='override a config value')
+    parser.add_argument('--preload', action='store_true',
+                        help='also build the detectors and the output')
+    parser.add_argument('--json', action='store_true',
+                        help='print machine readable results')
+    args = parser.parse_args(argv)
+
+    config = {}
+
+    if args.config:
+        with io.open(args.config, 'r') as cfile:
+            config = yaml.safe_load(cfile) or {}
+
+    for override in args.set:
+        key, _, value = override.partition('=')
+        config[key] = parse_value(value)
+
+    summary = measure(config, args.preload)
+
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print(format_summary(summary))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
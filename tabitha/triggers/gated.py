@@ -0,0 +1,206 @@
+""" gates an expensive trigger detector behind a cheap voice check """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import logging
+import numpy
+from tabitha.breakdetectors.framer import Framer
+from tabitha.metrics import thread_time
+from tabitha.objectdict import ObjectDict
+from tabitha.pcm import SAMPLE_TYPES, NoiseFloor
+
+
+class GatedTriggerDetector(object):
+    """ only runs the wrapped trigger detector while there may be a voice
+
+        Every chunk gets a cheap check, the largest frame RMS against a
+        NoiseFloor starting at trigger.gate.noise_floor, default min_rms,
+        (trigger.gate.mode 'rms') or webrtcvad ('vad'). While the gate is
+        closed the wrapped detector is not called and the last
+        trigger.gate.preroll_ms of audio is kept. When a chunk looks
+        voiced the pre-roll and the chunk are passed on together, so a
+        hotword whose first syllable was quiet is still heard in full,
+        and the gate stays open for trigger.gate.hangover_ms after the
+        last voiced chunk.
+
+        stats records the CPU used by the gate and by the detector, from
+        which cpu_reduction estimates the saving against running the
+        detector on everything. Triggers are never reported later than
+        without the gate, the only added latency is the time taken to
+        process the pre-roll when the gate opens, kept in
+        stats.last_open_delay_seconds and stats.max_open_delay_seconds.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, config=None, detector=None):
+        config = config or {}
+        audio_width = config.get('audio.width', 2)
+
+        if audio_width not in SAMPLE_TYPES:
+            raise ValueError('GatedTriggerDetector does not support ' +
+                             'audio.width %s' % audio_width)
+
+        if detector is None:
+            from tabitha.triggers.snowboy import SnowboyTriggerDetector
+            detector = SnowboyTriggerDetector(config)
+
+        self._config = ObjectDict({
+            'mode': config.get('trigger.gate.mode', 'rms'),
+            'frame_ms': config.get('trigger.gate.frame_ms', 20),
+            'noise_ratio': config.get('trigger.gate.noise_ratio', 3.0),
+            'noise_rise_db': config.get('trigger.gate.noise_rise_db', 3.0),
+            'min_rms': config.get('trigger.gate.min_rms', 100),
+            'sample_rate': config.get('audio.sample_rate', 16000)})
+
+        bytes_per_ms = self._config.sample_rate * audio_width / 1000
+
+        self._detector = detector
+        self._sample_type = numpy.dtype(SAMPLE_TYPES[audio_width])
+        self._frame_samples = int(self._config.frame_ms *
+                                  self._config.sample_rate / 1000)
+        self._preroll_bytes = int(
+            config.get('trigger.gate.preroll_ms', 800) *
+            bytes_per_ms) // audio_width * audio_width
+        self._hangover_bytes = int(
+            config.get('trigger.gate.hangover_ms', 1500) * bytes_per_ms)
+        self._preroll = bytearray()
+        self._position = 0
+        self._open_until = None
+        self._vad = None
+
+        if self._config.mode == 'vad':
+            import webrtcvad
+            self._vad = webrtcvad.Vad(config.get('trigger.gate.vad_mode', 1))
+            self._framer = Framer(self._frame_samples * audio_width)
+        elif self._config.mode != 'rms':
+            raise ValueError('trigger.gate.mode must be rms or vad')
+
+        self._noise = NoiseFloor(
+            config.get('trigger.gate.noise_floor', self._config.min_rms),
+            self._config.noise_rise_db, self._config.frame_ms)
+        self.stats = ObjectDict({'chunks': 0, 'bytes': 0,
+                                 'passed_chunks': 0, 'passed_bytes': 0,
+                                 'gate_opens': 0,
+                                 'gate_cpu_seconds': 0.0,
+                                 'detector_cpu_seconds': 0.0,
+                                 'last_open_delay_seconds': 0.0,
+                                 'max_open_delay_seconds': 0.0})
+
+        logging.debug('__init__ with: %s', config)
+
+    @property
+    def noise_floor(self):
+        """ the tracked RMS of the background noise """
+        return self._noise.level
+
+    @property
+    def is_open(self):
+        """ True while audio is being passed to the wrapped detector """
+
+        return (self._open_until is not None and
+                self._position <= self._open_until)
+
+    @property
+    def cpu_reduction(self):
+        """ estimated fraction of detector CPU saved by the gate """
+
+        if not self.stats.passed_bytes:
+            return None
+
+        ungated = (self.stats.detector_cpu_seconds / self.stats.passed_bytes *
+                   self.stats.bytes)
+
+        if not ungated:
+            return None
+
+        return 1 - (self.stats.gate_cpu_seconds +
+                    self.stats.detector_cpu_seconds) / ungated
+
+    def reset(self):
+        """ closes the gate and forgets the pre-roll and the noise floor,
+            resetting the wrapped detector if it can be """
+
+        del self._preroll[:]
+        self._position = 0
+        self._open_until = None
+        self._noise.reset()
+
+        if hasattr(self._detector, 'reset'):
+            self._detector.reset()
+
+    def detect(self, data):
+        """ returns the 1-based index of the word detected """
+
+        start_time = thread_time()
+        data = memoryview(data)
+        voiced = self._is_voiced(data)
+        self.stats.gate_cpu_seconds += thread_time() - start_time
+
+        was_open = self.is_open
+        self._position += len(data)
+        self.stats.chunks += 1
+        self.stats.bytes += len(data)
+
+        if voiced:
+            self._open_until = self._position + self._hangover_bytes
+
+        if not self.is_open:
+            self._keep_preroll(data)
+            return None
+
+        if not was_open:
+            self.stats.gate_opens += 1
+            data = bytes(self._preroll) + bytes(data)
+            del self._preroll[:]
+
+        start_time = thread_time()
+        trigger_result = self._detector.detect(data)
+        cpu_seconds = thread_time() - start_time
+
+        self.stats.passed_chunks += 1
+        self.stats.passed_bytes += len(data)
+        self.stats.detector_cpu_seconds += cpu_seconds
+
+        if not was_open:
+            self.stats.last_open_delay_seconds = cpu_seconds
+            self.stats.max_open_delay_seconds = max(
+                self.stats.max_open_delay_seconds, cpu_seconds)
+
+        return trigger_result
+
+    def _keep_preroll(self, data):
+        self._preroll.extend(data)
+
+        if len(self._preroll) > self._preroll_bytes:
+            del self._preroll[:len(self._preroll) - self._preroll_bytes]
+
+    def _is_voiced(self, data):
+        if self._vad:
+            is_speech = self._vad.is_speech
+            sample_rate = self._config.sample_rate
+
+            # every frame is checked so the framer keeps its alignment
+            return any([is_speech(frame, sample_rate)
+                        for frame in self._framer.frames(data)])
+
+        samples = numpy.frombuffer(
+            data, self._sample_type,
+            len(data) // self._sample_type.itemsize).astype(numpy.float32)
+
+        if not samples.size:
+            return False
+
+        frame_samples = min(self._frame_samples, samples.size)
+        frame_count = samples.size // frame_samples
+        frames = samples[:frame_count * frame_samples].reshape(
+            frame_count, frame_samples)
+        rms = numpy.sqrt(numpy.einsum('ij,ij->i', frames, frames) /
+                         frame_samples)
+
+        threshold = self._noise.threshold(self._config.noise_ratio,
+                                          self._config.min_rms)
+        self._noise.update(rms)
+
+        return bool(rms.max() > threshold)
@@ -20,7 +20,8 @@ class SnowboyTriggerDetector(object):
         resource = config.get('trigger.snowboy.commonres', resource_file)
         model = config.get('trigger.snowboy.model', model_file)
         audio_gain = config.get('trigger.snowboy.audio_gain', 1)
-        sensitivity = config.get('trigger.snowboy.sensitivity', '0.5')
+        # YAML and --set give numbers, Snowboy takes a string like '0.5,0.6'
+        sensitivity = str(config.get('trigger.snowboy.sensitivity', '0.5'))
 
         self._detector = SnowboyDetect(
             resource_filename=resource.encode('ascii', 'ignore'),
@@ -43,7 +44,9 @@ class SnowboyTriggerDetector(object):
 
         if config_sample_rate != snowboy_sample_rate:
             raise ValueError(('Snowboy expected sample_rate to be %s ' +
-                              'but was configured with %s') %
+                              'but was configured with %s, set ' +
+                              'source.sample_rate or trigger.sample_rate ' +
+                              'to resample') %
                              (snowboy_sample_rate, config_sample_rate))
 
         if config_channels != snowboy_channels:
@@ -56,10 +59,15 @@ class SnowboyTriggerDetector(object):
                               'be %s but was configured with %s') %
                              (snowboy_bits_per_sample, config_bits_per_sample))
 
+    def reset(self):
+        """ clears Snowboy's audio history, e.g. between recordings """
+        self._detector.Reset()
+
     def detect(self, data):
         """ returns the 1-based index of the word detected """
 
-        hotword_index = self._detector.RunDetection(data)
+        # the SWIG wrapper only accepts bytes, not buffer views
+        hotword_index = self._detector.RunDetection(bytes(data))
 
         if hotword_index > 0:
             return hotword_index
@@ -9,26 +9,53 @@ from __future__ import unicode_literals
 
 from sys import version_info
 if version_info >= (2, 6, 0):
+    def _platform_dirs():
+        """ resources/snowboy directories with a build for this platform,
+            best match first, TABITHA_SNOWBOY_PLATFORM overrides them """
+        import os
+        import platform
+        override = os.environ.get('TABITHA_SNOWBOY_PLATFORM')
+        if override:
+            return [override]
+        if platform.system() == 'Darwin':
+            return ['osx']
+        if platform.machine().startswith('arm'):
+            return ['raspbian_8_0']
+        return ['x64ubuntu_14_04', 'x64ubuntu_12_04']
+
     def swig_import_helper():
+        import importlib.machinery
+        import importlib.util
+        import logging
         import os.path
-        import imp
-        fp = None
-        try:
-            resources_dir = os.path.join(os.path.dirname(__file__),
-                                         '../../resources/snowboy/osx/')
-            search_paths = [os.path.dirname(__file__), resources_dir]
-            fp, pathname, description = imp.find_module('_snowboydetect', search_paths)
-        except ImportError:
-            import _snowboydetect
-            return _snowboydetect
-        if fp is not None:
+        resources_dir = os.path.join(os.path.dirname(__file__),
+                                     '../../resources/snowboy/')
+        search_paths = [os.path.dirname(__file__)] + [
+            os.path.join(resources_dir, name) for name in _platform_dirs()]
+        for search_path in search_paths:
+            pathname = os.path.join(search_path, '_snowboydetect.so')
+            if not os.path.exists(pathname):
+                continue
+            loader = importlib.machinery.ExtensionFileLoader(
+                '_snowboydetect', pathname)
+            spec = importlib.util.spec_from_file_location(
+                '_snowboydetect', pathname, loader=loader)
             try:
-                _mod = imp.load_module('_snowboydetect', fp, pathname, description)
-            finally:
-                fp.close()
+                _mod = importlib.util.module_from_spec(spec)
+                loader.exec_module(_mod)
+            except ImportError as error:
+                logging.info('could not load %s: %s', pathname, error)
+                continue
             return _mod
+        import _snowboydetect
+        return _snowboydetect
+    import time as _time
+    _load_start = _time.time()
     _snowboydetect = swig_import_helper()
-    del swig_import_helper
+    # which build was loaded and how long loading it took
+    library_path = getattr(_snowboydetect, '__file__', None)
+    load_seconds = _time.time() - _load_start
+    del swig_import_helper, _platform_dirs, _time, _load_start
 else:
     import _snowboydetect
 del version_info
@@ -2,36 +2,108 @@
 
 from __future__ import absolute_import
 from __future__ import unicode_literals
-import time
 import tempfile
 import os
+import threading
 from tabitha.objectdict import ObjectDict
-from tabitha.sources.pyaudiosource import PyAudioSource
-from tabitha.outputs.vlcoutput import VlcOutput
-from tabitha.breakdetectors.vadsilence import VadSilenceDetector
-from tabitha.triggers.snowboy import SnowboyTriggerDetector
+from tabitha.capturestream import CaptureStream
+from tabitha.codecs.encoder import CaptureEncoder, EncodingStream
+from tabitha.codecs.registry import create_encoder, negotiate
+from tabitha.clock import SystemClock
+from tabitha.components import component_name, create_component
+from tabitha.metrics import Metrics, monotonic_time, thread_time
 
 
 class VoiceClient(object):
-    """ Listens to audio input and execs triggers based vocal commands """
+    """ Listens to audio input and execs triggers based vocal commands
+
+        Each stage of an interaction is timed into metrics, a Metrics
+        instance taken from config['metrics'] or built from the metrics.*
+        config: trigger.latency and break.latency (newest audio written to
+        detection), trigger.detect_cpu and break.is_break_cpu (detector CPU
+        per wait or capture), capture.duration, handler.ask and
+        handler.respond_to, play.write_file, play.start (play called to
+        output started), response.first_audio (break to output started),
+        play.duration and, on barge-in, play.stop and play.interrupted_after.
+
+        The source, trigger and break detectors and output not passed in
+        config are built on first use from the components registry:
+        <kind>.component names one (see tabitha.components), their import
+        and construction times are recorded as startup.<kind>.import and
+        startup.<kind>.construct, preload() builds them up front.
+        Sources deliver source.sample_rate audio, resampled to
+        audio.sample_rate, the rate of the buffer and of captures, and
+        built detectors with a trigger.sample_rate or break.sample_rate
+        of their own are fed through a streaming resampler. With
+        trigger.process or break.process set the default detectors run in
+        worker processes, reading audio from shared memory when the
+        source's buffer has audio.buffer.shared set. output.vlc.persistent
+        selects PersistentVlcOutput and output.mixer MixerOutput, outputs
+        with play_audio() are given the response audio without writing a
+        temp file, or a response's audio_stream so they can decode it
+        while it arrives. Outputs with play_clip() play the trigger.earcon
+        clip ('ding') as soon as a trigger is accepted, not for triggers
+        play()'s stop_on ignores, and break.earcon ('dong') when a capture
+        ends, None disables either.
+
+        Captures are encoded while they are captured with the codec last
+        negotiated with a handler: the first of the handler's codecs
+        (default ('pcm',)) which capture.codecs, if set, allows. ask() and
+        respond_to() pass handlers the EncodedAudio, or an EncodingStream
+        for capture streams, when they accept its codec and PCM otherwise.
+        capture.encode_cpu, capture.encode_cpu_per_audio_s and
+        capture.compression_ratio are recorded for each encoded capture.
+
+        Captures start with the next audio unless capture.from_trigger is
+        set, when the first capture after a trigger starts at the end of
+        the audio the trigger was detected in, keeping words spoken
+        straight after the hotword. capture.preroll_ms, or the preroll_ms
+        argument, moves the start further back into the buffer's history.
+        timings and ms_since_playback let a Conversation lay out each
+        turn's stages and start a follow-up capture where playback ended.
+    """
 
     # pylint: disable=too-many-instance-attributes
 
     def __init__(self, config=None):
         config = config or {}
         self.is_listening = False
-        self._source = config.get('source', PyAudioSource(config))
-        self._break_detector = config.get('break', VadSilenceDetector(config))
-        self._trigger_detector = config.get(
-            'trigger', SnowboyTriggerDetector(config))
-        self._output = config.get('output', VlcOutput(config))
+        self.metrics = config.get('metrics') or Metrics(config)
+        self._components = ObjectDict({
+            'source': config.get('source'),
+            'trigger': config.get('trigger'),
+            'break': config.get('break'),
+            'output': config.get('output')})
+        self._component_config = config
+        # resolved on first use, so the source is not built to find it
+        self._clock = config.get('clock')
+        self._timings = ObjectDict({
+            'detect_cpu': 0.0,
+            'break_cpu': 0.0,
+            'capture_start': None,
+            'break_time': None,
+            'play_start': None,
+            'output_start': None,
+            'playback_end': None})
+        self._capture_encoder = None
+        self._codec = 'pcm'
         self._current_context = ObjectDict({
             'capture': None,
+            'encoded_capture': None,
+            'trigger_end': None,
+            'playback_end': None,
             'response': None})
 
         self._config = ObjectDict({
             'triggers': {},
-            'sleep_time': config.get('listen_sleep_time', 0.2)
+            'trigger_names': config.get('trigger.names', ['alexa']),
+            'trigger_earcon': config.get('trigger.earcon', 'ding'),
+            'break_earcon': config.get('break.earcon', 'dong'),
+            'codecs': config.get('capture.codecs', None),
+            'capture_from_trigger': config.get('capture.from_trigger', False),
+            'capture_preroll_ms': config.get('capture.preroll_ms', 0),
+            'codec_config': config,
+            'wait_timeout': config.get('listen_wait_timeout', 0.5)
             })
 
     def listen(self):
@@ -42,14 +114,247 @@ class VoiceClient(object):
     def terminate(self):
         """ shuts down the client """
         self.is_listening = False
-        self._source.stop()
 
-    def wait_for_hotword(self, watchfor=None):
+        if self._components.source is not None:
+            self._source.stop()
+            self._source.buffer.interrupt()
+
+        for kind in ('trigger', 'break', 'output'):
+            component = self._components[kind]
+
+            if hasattr(component, 'terminate'):
+                component.terminate()
+
+    def _component(self, kind):
+        """ returns the component of kind, building it on first use """
+
+        component = self._components[kind]
+
+        if component is None:
+            config = self._component_config
+            # process detectors read the audio from the source's buffer
+            args = ((self._source.buffer,)
+                    if kind != 'source' and
+                    component_name(kind, config) == 'process' else ())
+            sample_rate = config.get('audio.sample_rate', 16000)
+            detector_rate = (config.get(kind + '.sample_rate', sample_rate)
+                             if kind in ('trigger', 'break') else sample_rate)
+
+            if detector_rate != sample_rate:
+                config = dict(config)
+                config['audio.sample_rate'] = detector_rate
+
+            component = create_component(kind, config, *args,
+                                         metrics=self.metrics)
+
+            if detector_rate != sample_rate:
+                # numpy is only imported when a detector needs resampling
+                from tabitha.resampler import ResampledDetector
+                component = ResampledDetector(component, config, sample_rate,
+                                              detector_rate)
+
+            self._components[kind] = component
+
+        return component
+
+    @property
+    def _source(self):
+        return self._component('source')
+
+    @property
+    def _trigger_detector(self):
+        return self._component('trigger')
+
+    @property
+    def _break_detector(self):
+        return self._component('break')
+
+    @property
+    def _output(self):
+        return self._component('output')
+
+    def preload(self):
+        """ builds the trigger and break detectors and the output now
+            rather than when first used """
+
+        for kind in ('trigger', 'break', 'output'):
+            self._component(kind)
+
+    @property
+    def clock(self):
+        """ the clock timeouts are measured with, virtual for sources
+            replaying recordings faster than real time """
+
+        if self._clock is None:
+            self._clock = (getattr(self._source, 'clock', None) or
+                           SystemClock())
+
+        return self._clock
+
+    def _source_exhausted(self):
+        return getattr(self._source, 'exhausted', False)
+
+    def _is_active(self):
+        return self.is_listening and not self._source_exhausted()
+
+    def _wait_for_audio(self):
+        """ blocks until new audio arrives, stops listening once a source
+            replaying recordings has run out """
+
+        if self._source_exhausted():
+            self.is_listening = False
+            return
+
+        self._source.buffer.wait_for_snapshot(self._config.wait_timeout)
+
+    def _detect(self, data):
+        """ runs the trigger detector, accounting for its CPU time """
+
+        start_time = thread_time()
+        trigger_result = self._trigger_detector.detect(data)
+        cpu_seconds = thread_time() - start_time
+
+        self._timings.detect_cpu += cpu_seconds
+        self.metrics.observe('trigger.detect_cpu_chunk', cpu_seconds,
+                             export=False)
+
+        if trigger_result:
+            self.metrics.since('trigger.latency',
+                               self._source.buffer.last_write_time)
+            self.metrics.observe('trigger.detect_cpu',
+                                 self._timings.detect_cpu)
+            self._timings.detect_cpu = 0.0
+
+        return trigger_result
+
+    def _accept_trigger(self, trigger_result):
+        """ marks where the accepted trigger ended and plays its earcon """
+
+        self._current_context.trigger_end = \
+            self._source.buffer.snapshot_reader.position
+        self._play_earcon(self._config.trigger_earcon)
+
+        return trigger_result
+
+    def _is_break(self, data):
+        """ runs the break detector, accounting for its CPU time """
+
+        start_time = thread_time()
+        found_break = self._break_detector.is_break(data)
+        cpu_seconds = thread_time() - start_time
+
+        self._timings.break_cpu += cpu_seconds
+        self.metrics.observe('break.is_break_cpu_chunk', cpu_seconds,
+                             export=False)
+
+        if found_break:
+            self._timings.break_time = monotonic_time()
+            self._play_earcon(self._config.break_earcon)
+            self.metrics.since('break.latency',
+                               self._source.buffer.last_write_time)
+            self.metrics.observe('break.is_break_cpu',
+                                 self._timings.break_cpu)
+            self.metrics.since('capture.duration',
+                               self._timings.capture_start)
+
+        return found_break
+
+    def _play_earcon(self, name):
+        if not name:
+            return
+
+        play_clip = getattr(self._output, 'play_clip', None)
+
+        if play_clip:
+            play_clip(name)
+
+    def _start_capture(self, preroll_ms=None):
+        position = None
+
+        if self._config.capture_from_trigger:
+            position = self._current_context.trigger_end
+
+        if preroll_ms is None:
+            preroll_ms = self._config.capture_preroll_ms
+
+        self._current_context.trigger_end = None
+        self._source.buffer.start_capture(position, preroll_ms)
+        self._break_detector.reset()
+        self._timings.break_cpu = 0.0
+        self._timings.capture_start = monotonic_time()
+        self._timings.break_time = None
+        self._current_context.encoded_capture = None
+        self._capture_encoder = None
+
+    def _start_capture_encoding(self):
+        """ encodes the capture as it arrives with the negotiated codec,
+            capture streams are encoded as the handler reads them instead
+        """
+
+        if self._codec != 'pcm':
+            self._capture_encoder = CaptureEncoder(
+                self._source.buffer,
+                create_encoder(self._codec, self._config.codec_config))
+
+    def _encode_capture(self):
+        if self._capture_encoder:
+            self._capture_encoder.update()
+
+    def _finish_capture_encoding(self):
+        """ completes the encoding of the capture, recording its cost """
+
+        if not self._capture_encoder:
+            return
+
+        encoded = self._capture_encoder.finish()
+        encoder = self._capture_encoder.encoder
+        self._capture_encoder = None
+        self._current_context.encoded_capture = encoded
+
+        self.metrics.observe('capture.encode_cpu', encoder.stats.cpu_seconds)
+
+        if encoder.cpu_per_audio_second is not None:
+            self.metrics.observe('capture.encode_cpu_per_audio_s',
+                                 encoder.cpu_per_audio_second, export=False)
+
+        if encoder.compression_ratio is not None:
+            self.metrics.observe('capture.compression_ratio',
+                                 encoder.compression_ratio, export=False)
+
+    def negotiate_codec(self, handler):
+        """ picks the codec following captures are encoded with for the
+            handler and returns its name """
+
+        self._codec = negotiate(handler, self._config.codecs or
+                                getattr(handler, 'codecs', ('pcm',)),
+                                self._config.codec_config)
+        return self._codec
+
+    def _handler_audio(self, handler, name, audio_data):
+        """ returns the capture in an encoding the handler accepts """
+
+        codecs = getattr(handler, 'codecs', ('pcm',))
+        encoded = self._current_context.encoded_capture
+        codec = self.negotiate_codec(handler)
+
+        if (encoded is not None and encoded.codec in codecs and
+                audio_data is self._current_context.capture):
+            return encoded
+
+        if (hasattr(audio_data, 'read') and codec != 'pcm' and
+                hasattr(handler, name + '_stream')):
+            return EncodingStream(audio_data, create_encoder(
+                codec, self._config.codec_config))
+
+        return audio_data
+
+    def wait_for_hotword(self, watchfor=None, timeout=None):
         """ alias for wait_for_trigger """
-        return self.wait_for_trigger(watchfor)
+        return self.wait_for_trigger(watchfor, timeout)
 
-    def wait_for_trigger(self, watchfor=None):
-        """ blocks until a trigger is detected """
+    def wait_for_trigger(self, watchfor=None, timeout=None):
+        """ blocks until a trigger is detected, returns None if the client
+            stops listening or timeout seconds pass on the client clock """
 
         if not self.is_listening:
             raise ValueError('VoiceClient must be listening to be triggered')
@@ -59,17 +364,26 @@ class VoiceClient(object):
         if not isinstance(watchfor, list):
             watchfor = [watchfor]
 
+        self._source.buffer.sync_snapshot()
+        self._timings.detect_cpu = 0.0
+
+        if timeout is not None:
+            timeout += self.clock.time()
+
         while True:
             if not self.is_listening:
                 return None
 
+            if timeout is not None and self.clock.time() >= timeout:
+                return None
+
             data = self._source.buffer.get_snapshot_data()
 
             if len(data) == 0:
-                time.sleep(self._config.sleep_time)
+                self._wait_for_audio()
                 continue
 
-            trigger_result = self._trigger_detector.detect(data)
+            trigger_result = self._detect(data)
 
             if not trigger_result:
                 continue
@@ -78,16 +392,17 @@ class VoiceClient(object):
             #        (not watchfor or trigger_result in watchfor)):
             #    return self._config.triggers[trigger_result]
 
-            return trigger_result
+            return self._accept_trigger(trigger_result)
 
-    def capture_until_break(self):
-        """ blocks and captures audio until a break is detected """
+    def capture_until_break(self, preroll_ms=None):
+        """ blocks and captures audio until a break is detected, starting
+            preroll_ms (default capture.preroll_ms) back in the history """
 
         if not self.is_listening:
             raise ValueError('VoiceClient must be listening to be triggered')
 
-        self._source.buffer.start_capture()
-        self._break_detector.reset()
+        self._start_capture(preroll_ms)
+        self._start_capture_encoding()
 
         while self._source.buffer.is_capturing:
             if not self.is_listening:
@@ -96,24 +411,63 @@ class VoiceClient(object):
             data = self._source.buffer.get_snapshot_data()
 
             if len(data) == 0:
-                time.sleep(self._config.sleep_time)
+                self._wait_for_audio()
                 continue
 
-            if self._break_detector.is_break(data):
+            if self._is_break(data):
                 self._source.buffer.stop_capture()
                 break
 
+            self._encode_capture()
+
         audio_data = self._source.buffer.get_capture_data()
         self._current_context.capture = audio_data
+        self._finish_capture_encoding()
 
         return audio_data
 
+    def capture_stream(self, preroll_ms=None):
+        """ starts capturing and returns a CaptureStream which yields the
+            audio as it arrives and ends when a break is detected """
+
+        if not self.is_listening:
+            raise ValueError('VoiceClient must be listening to be triggered')
+
+        self._start_capture(preroll_ms)
+
+        return CaptureStream(self._source.buffer, self._is_break,
+                             self._is_active,
+                             self._config.wait_timeout,
+                             self._set_capture)
+
+    def _set_capture(self, audio_data):
+        self._current_context.capture = audio_data
+
+    @staticmethod
+    def _call_handler(handler, name, audio_data, *args):
+        """ passes capture streams to handlers supporting <name>_stream,
+            other handlers get the complete capture """
+
+        if hasattr(audio_data, 'read'):
+            stream_method = getattr(handler, name + '_stream', None)
+
+            if stream_method:
+                return stream_method(audio_data, *args)
+
+            audio_data = audio_data.read()
+
+        return getattr(handler, name)(audio_data, *args)
+
     def ask(self, handler, audio_data=None):
-        """ sends the audio data to the handler and waits for response """
+        """ sends the audio data to the handler and waits for response,
+            audio_data may be a CaptureStream from capture_stream() """
         if not audio_data:
             audio_data = self._current_context.capture
 
-        response = handler.ask(audio_data)
+        audio_data = self._handler_audio(handler, 'ask', audio_data)
+        start_time = monotonic_time()
+        response = self._call_handler(handler, 'ask', audio_data)
+        self.metrics.since('handler.ask', start_time)
         self._current_context.response = response
 
         return response
@@ -126,21 +480,152 @@ class VoiceClient(object):
         if not response_context:
             response_context = self._current_context.response
 
-        response = handler.respond_to(audio_data, response_context)
+        audio_data = self._handler_audio(handler, 'respond_to', audio_data)
+        start_time = monotonic_time()
+        response = self._call_handler(handler, 'respond_to', audio_data,
+                                      response_context)
+        self.metrics.since('handler.respond_to', start_time)
         self._current_context.response = response
 
         return response
 
-    def play(self, audio_response, dummy_stop_on=None):
-        """ plays the audio response """
+    def _start_output(self, audio_response, on_finish_cb):
+        """ starts playing the response, returns the path of the temp file
+            written for outputs which can not play audio data directly
+
+            a response with an audio_stream, a file-like object or an
+            iterator of chunks, is handed to play_audio() as it arrives """
+
+        self._timings.play_start = monotonic_time()
+        self._timings.playback_end = None
+        play_audio = getattr(self._output, 'play_audio', None)
+        audio_stream = getattr(audio_response, 'audio_stream', None)
+
+        if play_audio:
+            play_audio(audio_stream or audio_response.audio_data,
+                       on_finish_cb)
+            self._note_output_started()
+            return None
 
         temp_file = tempfile.NamedTemporaryFile(suffix='.mp3', delete=False)
 
         with temp_file:
-            temp_file.write(audio_response.audio_data)
+            if audio_stream is None:
+                temp_file.write(audio_response.audio_data)
+            elif hasattr(audio_stream, 'read'):
+                temp_file.write(audio_stream.read())
+            else:
+                for chunk in audio_stream:
+                    temp_file.write(chunk)
+
+        self.metrics.since('play.write_file', self._timings.play_start)
+        self._output.play(temp_file.name, on_finish_cb)
+        self._note_output_started()
+
+        return temp_file.name
+
+    def _note_output_started(self):
+        self._timings.output_start = monotonic_time()
+        self.metrics.since('play.start', self._timings.play_start)
+        self.metrics.since('response.first_audio', self._timings.break_time)
+        self._timings.break_time = None
+
+    def _note_playback_finished(self):
+        self._timings.playback_end = monotonic_time()
+        self._current_context.playback_end = self._source.buffer.written
+        self.metrics.since('play.duration', self._timings.output_start)
+
+    @property
+    def timings(self):
+        """ monotonic times of the latest interaction's stages:
+            capture_start, break_time, play_start, output_start and
+            playback_end, None for stages which have not happened """
+
+        return ObjectDict((name, self._timings[name])
+                          for name in ('capture_start', 'break_time',
+                                       'play_start', 'output_start',
+                                       'playback_end'))
+
+    @property
+    def ms_since_playback(self):
+        """ milliseconds of audio received since the last response finished
+            playing, None if it was interrupted or nothing has played """
+
+        playback_end = self._current_context.playback_end
+
+        if playback_end is None:
+            return None
+
+        audio_buffer = self._source.buffer
+        return audio_buffer.duration_ms(audio_buffer.written - playback_end)
+
+    def _stops_playback(self, trigger_result, stop_on):
+        """ True if the trigger is one stop_on allows to interrupt """
+
+        if stop_on is None:
+            return True
+
+        if not isinstance(stop_on, list):
+            stop_on = [stop_on]
+
+        names = self._config.trigger_names
+        name = (names[trigger_result - 1]
+                if 0 < trigger_result <= len(names) else None)
+
+        return trigger_result in stop_on or name in stop_on
+
+    def _barge_in(self, trigger_result):
+        self._current_context.playback_end = None
+        stop_start = monotonic_time()
+        self._output.stop()
+        self.metrics.since('play.stop', stop_start)
+        self.metrics.since('play.interrupted_after',
+                           self._timings.output_start)
+
+        return self._accept_trigger(trigger_result)
+
+    def play(self, audio_response, stop_on=None):
+        """ plays the audio response while listening for triggers
+
+            playback is stopped as soon as a trigger is detected on the
+            source and the trigger result is returned, the following audio
+            can be captured straight away. Returns None when the response
+            played to the end. stop_on limits the interrupting triggers to
+            the listed results or trigger.names, [] never interrupts """
+
+        finished = threading.Event()
+        audio_buffer = self._source.buffer
+        temp_file = None
+
+        def _on_finish():
+            finished.set()
+            audio_buffer.interrupt()
+
+        try:
+            temp_file = self._start_output(audio_response, _on_finish)
+
+            if self.is_listening and stop_on != []:
+                audio_buffer.sync_snapshot()
+
+            while not finished.is_set():
+                if not self.is_listening or stop_on == []:
+                    finished.wait(self._config.wait_timeout)
+                    continue
+
+                data = audio_buffer.get_snapshot_data()
+
+                if len(data) == 0:
+                    self._wait_for_audio()
+                    continue
+
+                trigger_result = self._detect(data)
 
-        self._output.blocking_play(temp_file.name)
-        os.remove(temp_file.name)
+                if (trigger_result and
+                        self._stops_playback(trigger_result, stop_on)):
+                    return self._barge_in(trigger_result)
 
-        # wait for trigger in another thread
-        # first one to return (trigger or play)
+            self._note_playback_finished()
+            return None
+        finally:
+            if temp_file:
+                os.remove(temp_file)
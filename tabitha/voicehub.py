@@ -0,0 +1,273 @@
+""" VoiceHub hosts trigger and break detection for many audio streams """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tabitha.components import create_component
+from tabitha.objectdict import ObjectDict
+
+
+class VoiceSession(object):
+    """ one audio stream hosted by a VoiceHub
+
+        A session only holds a read cursor into its source's AudioBuffer,
+        its detectors and its dialog context. Idle memory is therefore the
+        buffer ring, 2 x audio.buffer.ring_ms of audio (~390 KB with the
+        16 kHz defaults, ~64 KB with ring_ms 1000 and max_capture_ms 0),
+        plus detector state; nbytes reports the buffer part.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    LISTENING = 'listening'
+    CAPTURING = 'capturing'
+    PAUSED = 'paused'
+
+    def __init__(self, session_id, source, trigger_detector, break_detector,
+                 on_trigger=None, on_capture=None):
+        self.session_id = session_id
+        self.source = source
+        self.state = VoiceSession.LISTENING
+        self.context = ObjectDict({'capture': None, 'response': None})
+        self.last_lag_ms = 0
+        self.max_lag_ms = 0
+        self.closed = False
+        self.on_trigger = on_trigger
+        self.on_capture = on_capture
+        self._buffer = source.buffer
+        self._reader = self._buffer.reader()
+        self._trigger_detector = trigger_detector
+        self._break_detector = break_detector
+        self._schedule_lock = threading.Lock()
+        self._scheduled = False
+
+    @property
+    def lag_ms(self):
+        """ how far behind real time the session's detectors are """
+        return self._buffer.duration_ms(self._reader.available())
+
+    @property
+    def overruns(self):
+        """ number of times the session fell further behind than its ring """
+        return self._reader.overruns
+
+    @property
+    def nbytes(self):
+        """ memory held by the session's audio buffer """
+        return self._buffer.nbytes
+
+    def has_unread(self):
+        """ True if audio is waiting to be processed """
+        return self._reader.available() > 0
+
+    def claim(self):
+        """ marks the session as scheduled, False if it already was """
+
+        with self._schedule_lock:
+            if self._scheduled or self.closed:
+                return False
+
+            self._scheduled = True
+            return True
+
+    def release(self):
+        """ marks a scheduled run of the session as finished """
+
+        with self._schedule_lock:
+            self._scheduled = False
+
+    def pause(self):
+        """ stops running detectors, e.g. while a response is played """
+        self.state = VoiceSession.PAUSED
+
+    def resume(self):
+        """ skips audio received while paused and listens for a trigger """
+        self._reader.seek_latest()
+        self.state = VoiceSession.LISTENING
+
+    def process(self):
+        """ runs the detectors over all unread audio
+
+            returns a (callback, result) pair when a trigger or a complete
+            capture was found, otherwise None """
+
+        self.last_lag_ms = self.lag_ms
+        self.max_lag_ms = max(self.max_lag_ms, self.last_lag_ms)
+        data = self._reader.read()
+
+        if not data or self.state == VoiceSession.PAUSED:
+            return None
+
+        if self.state == VoiceSession.LISTENING:
+            trigger_result = self._trigger_detector.detect(data)
+
+            if trigger_result:
+                # the reader may lag the buffer, the capture starts where
+                # the trigger ended rather than at the newest audio
+                self._buffer.start_capture(self._reader.position)
+                self._break_detector.reset()
+                self.state = VoiceSession.CAPTURING
+                return self.on_trigger, trigger_result
+
+            return None
+
+        if (self._break_detector.is_break(data) or
+                not self._buffer.is_capturing):
+            self._buffer.stop_capture()
+            self.context.capture = self._buffer.get_capture_data()
+            self.state = VoiceSession.LISTENING
+            return self.on_capture, self.context.capture
+
+        return None
+
+
+class VoiceHub(object):
+    """ runs many VoiceSessions in one process
+
+        Sessions are only scheduled when their source delivers audio, and
+        each session is processed by at most one worker at a time. The
+        detection pool defaults to one thread per core (hub.workers),
+        trigger and capture callbacks run on a separate pool
+        (hub.callback_workers) so slow handlers never delay detection.
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        workers = config.get('hub.workers') or multiprocessing.cpu_count()
+
+        self._config = config
+        self._max_lag_ms = config.get('hub.max_lag_ms', 500)
+        self._detect_pool = ThreadPoolExecutor(workers)
+        self._callback_pool = ThreadPoolExecutor(
+            config.get('hub.callback_workers', 4))
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._lagging = set()
+        self._terminated = False
+        self.is_running = False
+
+    @property
+    def sessions(self):
+        """ the hosted sessions by session id """
+        return dict(self._sessions)
+
+    def add_session(self, session_id, source=None, trigger_detector=None,
+                    break_detector=None, on_trigger=None, on_capture=None):
+        """ hosts a new session, on_trigger and on_capture are called with
+            the session and the trigger index or captured audio, missing
+            components are the ones the hub's config selects """
+
+        session = VoiceSession(
+            session_id,
+            source or create_component('source', self._config),
+            trigger_detector or create_component('trigger', self._config),
+            break_detector or create_component('break', self._config),
+            on_trigger, on_capture)
+
+        with self._sessions_lock:
+            if session_id in self._sessions:
+                raise ValueError('VoiceHub already has a session %s' %
+                                 session_id)
+
+            self._sessions[session_id] = session
+
+        if self.is_running:
+            self._start_session(session)
+
+        return session
+
+    def remove_session(self, session_id):
+        """ stops and removes a session """
+
+        with self._sessions_lock:
+            session = self._sessions.pop(session_id)
+
+        session.closed = True
+        session.source.stop()
+
+    def start(self):
+        """ starts every session's source and begins detection """
+
+        if self._terminated:
+            raise ValueError('Can not start VoiceHub after terminate')
+
+        self.is_running = True
+
+        for session in self.sessions.values():
+            self._start_session(session)
+
+    def terminate(self):
+        """ stops all sources and worker pools """
+
+        # once set under the lock no wakeup can submit to the pools
+        with self._sessions_lock:
+            self._terminated = True
+            self.is_running = False
+
+        for session in self.sessions.values():
+            session.source.stop()
+
+        self._detect_pool.shutdown(wait=True)
+        self._callback_pool.shutdown(wait=False)
+
+    def stats(self):
+        """ returns per session lag, overruns, memory and state """
+
+        return dict((session_id, ObjectDict({
+            'state': session.state,
+            'lag_ms': session.lag_ms,
+            'last_lag_ms': session.last_lag_ms,
+            'max_lag_ms': session.max_lag_ms,
+            'overruns': session.overruns,
+            'nbytes': session.nbytes}))
+                    for session_id, session in self.sessions.items())
+
+    def _start_session(self, session):
+        session.source.start()
+        self._arm(session)
+
+    def _arm(self, session):
+        session.source.buffer.add_wakeup(
+            functools.partial(self._schedule, session))
+
+        if session.has_unread():
+            self._schedule(session)
+
+    def _schedule(self, session):
+        with self._sessions_lock:
+            if self._terminated or not self.is_running:
+                return
+
+            if session.claim():
+                self._detect_pool.submit(self._run, session)
+
+    def _run(self, session):
+        # pylint: disable=broad-except
+        try:
+            event = session.process()
+
+            if event and event[0]:
+                self._callback_pool.submit(event[0], session, event[1])
+
+            self._check_lag(session)
+        except Exception:
+            logging.exception('session %s failed to process audio',
+                              session.session_id)
+        finally:
+            session.release()
+
+        if self.is_running and not session.closed:
+            self._arm(session)
+
+    def _check_lag(self, session):
+        if session.last_lag_ms <= self._max_lag_ms:
+            self._lagging.discard(session.session_id)
+        elif session.session_id not in self._lagging:
+            self._lagging.add(session.session_id)
+            logging.warning('session %s is %d ms behind real time',
+                            session.session_id, session.last_lag_ms)
@@ -0,0 +1,152 @@
+""" tests for ChannelReducer and its reduction stages """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import unittest
+import numpy
+from tabitha.sources.channels import (BestChannelStage, ChannelReducer,
+                                      DelayAndSumStage, DownmixStage,
+                                      input_channels, source_writer)
+
+
+class _Sink(object):
+    def __init__(self):
+        self.data = bytearray()
+
+    def extend(self, data):
+        self.data.extend(data)
+
+    @property
+    def samples(self):
+        return numpy.frombuffer(bytes(self.data), '<i2')
+
+
+def _noise(frames, seed=0, level=0.3):
+    return numpy.random.RandomState(seed).normal(0, level, frames) \
+        .astype(numpy.float32)
+
+
+class InputChannelsTest(unittest.TestCase):
+    """ audio.channels describes the mono buffer, not the device """
+
+    def test_audio_channels_is_not_the_source_channels(self):
+        self.assertEqual(input_channels({'audio.channels': 4}), 1)
+        self.assertEqual(input_channels({'source.channels': 4}), 4)
+
+    def test_mono_sources_write_straight_to_the_buffer(self):
+        sink = _Sink()
+        self.assertIs(source_writer({'audio.channels': 4}, sink), sink)
+        self.assertIsInstance(source_writer({'source.channels': 4}, sink),
+                              ChannelReducer)
+
+
+class ChannelReducerTest(unittest.TestCase):
+    """ interleaved writes of any size are reduced frame by frame """
+
+    def test_downmix_of_odd_sized_writes(self):
+        frames = numpy.tile(numpy.array([[1000, 3000]], '<i2'), (500, 1))
+        data = frames.tobytes()
+        sink = _Sink()
+        reducer = ChannelReducer({'source.channels': 2}, sink)
+
+        for offset in range(0, len(data), 7):
+            reducer.extend(data[offset:offset + 7])
+
+        self.assertEqual(len(sink.samples), 500)
+        self.assertTrue(numpy.all(sink.samples == 2000))
+        self.assertEqual(reducer.stats.frames, 500)
+
+    def test_channel_is_a_view_of_the_block(self):
+        reducer = ChannelReducer({'source.channels': 2}, _Sink())
+        reducer.extend(numpy.array([[1, 2], [3, 4]], '<i2').tobytes())
+
+        self.assertEqual(list(reducer.channel(1)), [2, 4])
+        self.assertFalse(reducer.channel(1).flags.owndata)
+
+
+class DownmixStageTest(unittest.TestCase):
+    """ channels are averaged or weighted """
+
+    def test_weights_are_normalised(self):
+        stage = DownmixStage({'source.reduce.weights': [1, 3]}, 2)
+        block = numpy.array([[4.0, 8.0]], numpy.float32)
+
+        self.assertAlmostEqual(float(stage.process(block)[0]), 7.0)
+
+    def test_weights_must_match_the_channels(self):
+        self.assertRaises(ValueError, DownmixStage,
+                          {'source.reduce.weights': [1, 1]}, 3)
+
+
+class BestChannelStageTest(unittest.TestCase):
+    """ the channel with the best SNR is chosen, switching smoothly """
+
+    def _stage(self):
+        stage = BestChannelStage({}, 2)
+        quiet = numpy.stack([_noise(512, 1, 0.01), _noise(512, 2, 0.01)], 1)
+        stage.process(quiet)
+        return stage
+
+    def test_switches_with_a_crossfade(self):
+        stage = self._stage()
+        block = numpy.stack([_noise(512, 3, 0.01), _noise(512, 4, 0.3)], 1)
+        output = stage.process(block)
+
+        self.assertEqual(stage.channel, 1)
+        self.assertAlmostEqual(float(output[0]), float(block[0, 0]))
+        self.assertAlmostEqual(float(output[-1]), float(block[-1, 1]))
+
+        output = stage.process(block)
+        self.assertTrue(numpy.array_equal(output, block[:, 1]))
+
+    def test_small_differences_do_not_switch(self):
+        stage = self._stage()
+        block = numpy.stack([_noise(512, 3, 0.1), _noise(512, 4, 0.12)], 1)
+        output = stage.process(block)
+
+        self.assertEqual(stage.channel, 0)
+        self.assertTrue(numpy.array_equal(output, block[:, 0]))
+
+
+class DelayAndSumStageTest(unittest.TestCase):
+    """ delays are estimated with GCC-PHAT and the channels aligned """
+
+    def _array(self, source, delays, max_delay=8):
+        """ the source as heard by channels delay samples behind """
+        return numpy.stack([source[max_delay - delay:len(source) - delay -
+                                   max_delay]
+                            for delay in delays], 1)
+
+    def _run(self, stage, block, block_frames=256):
+        return numpy.concatenate([
+            stage.process(block[offset:offset + block_frames])
+            for offset in range(0, len(block), block_frames)])
+
+    def test_estimates_the_delays(self):
+        source = _noise(16016)
+        block = self._array(source, [0, 3, -2])
+        stage = DelayAndSumStage({'source.reduce.max_delay': 8,
+                                  'source.reduce.estimate_ms': 250}, 3)
+        output = self._run(stage, block)
+
+        self.assertEqual(list(stage.delays), [0, 3, -2])
+        # once aligned the beam is the first channel, max_delay late
+        tail = slice(8000, len(output))
+        self.assertTrue(numpy.allclose(
+            output[tail], block[8000 - 8:len(output) - 8, 0], atol=1e-5))
+
+    def test_fixed_delays_align_across_blocks(self):
+        source = _noise(4016)
+        block = self._array(source, [0, 5])
+        stage = DelayAndSumStage({'source.reduce.delays': [0, 5],
+                                  'source.reduce.max_delay': 8}, 2)
+        output = self._run(stage, block, 100)
+
+        self.assertTrue(numpy.allclose(output[16:],
+                                       block[8:len(output) - 8, 0],
+                                       atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+""" tests for detectors hosted in worker processes """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import time
+import unittest
+from tabitha.detectorprocess import ProcessTriggerDetector
+
+
+class _SlowLoadingDetector(object):
+    """ takes longer to build than a call may take, like a large model """
+
+    def __init__(self, config):
+        time.sleep(config.get('test.load_seconds', 0))
+        self._resets = 0
+
+    def reset(self):
+        self._resets += 1
+
+    def detect(self, data):
+        return self._resets if data == b'resets' else None
+
+
+def _failing_detector(dummy_config):
+    raise IOError('model not found')
+
+
+class ProcessTriggerDetectorTest(unittest.TestCase):
+    """ the worker is ready before calls are timed """
+
+    def _detector(self, config, factory=_SlowLoadingDetector):
+        detector = ProcessTriggerDetector(config, factory=factory)
+        self.addCleanup(detector.terminate)
+        return detector
+
+    def test_slow_load_does_not_time_out_the_first_call(self):
+        detector = self._detector({'test.load_seconds': 0.5,
+                                   'detector.process.timeout': 0.2})
+
+        self.assertIsNone(detector.detect(b'\0\0'))
+
+    def test_reset_is_forwarded(self):
+        detector = self._detector({})
+        detector.reset()
+        detector.reset()
+
+        self.assertEqual(detector.detect(b'resets'), 2)
+
+    def test_failed_load_raises(self):
+        self.assertRaises(ValueError, ProcessTriggerDetector, {},
+                          factory=_failing_detector)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+""" tests for Framer """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import unittest
+from tabitha.breakdetectors.framer import Framer
+
+_DATA = bytes(bytearray(range(256))) * 8
+
+
+class FramerTest(unittest.TestCase):
+    """ frames span chunks and survive callers which stop early """
+
+    def test_frames_span_chunks(self):
+        framer = Framer(10)
+        frames = []
+
+        for offset in range(0, len(_DATA), 7):
+            frames.extend(bytes(frame) for frame
+                          in framer.frames(_DATA[offset:offset + 7]))
+
+        self.assertEqual(b''.join(frames), _DATA[:len(_DATA) // 10 * 10])
+
+    def test_frames_not_taken_come_first_next_time(self):
+        framer = Framer(10)
+        frames = []
+
+        for offset in range(0, 300, 50):
+            for frame in framer.frames(_DATA[offset:offset + 50]):
+                frames.append(bytes(frame))
+                break
+
+        frames.extend(bytes(frame) for frame in framer.frames(b''))
+
+        self.assertEqual(b''.join(frames), _DATA[:300])
+        self.assertEqual(framer.dropped_bytes, 0)
+
+    def test_carry_does_not_grow(self):
+        framer = Framer(10, carry_frames=4)
+        frames = []
+
+        for offset in range(0, 1000, 100):
+            for frame in framer.frames(_DATA[offset:offset + 100]):
+                frames.append(bytes(frame))
+                break
+
+        frames.extend(bytes(frame) for frame in framer.frames(b''))
+
+        # one frame per call and the 4 carried, the rest were dropped
+        self.assertEqual(len(frames), 14)
+        self.assertEqual(framer.dropped_bytes, 1000 - 14 * 10)
+        self.assertEqual(b''.join(frames[-4:]), _DATA[1000 - 40:1000])
+        aligned = set(_DATA[offset:offset + 10]
+                      for offset in range(0, 1000, 10))
+        self.assertTrue(aligned.issuperset(frames))
+
+    def test_reset_discards_the_carry(self):
+        framer = Framer(10)
+
+        for frame in framer.frames(_DATA[:35]):
+            break
+
+        framer.reset()
+
+        self.assertEqual([bytes(frame) for frame in framer.frames(b'x' * 10)],
+                         [b'x' * 10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+""" tests for NetworkSource's packet parsing and JitterBuffer """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import socket
+import time
+import unittest
+from tabitha.sources.networksource import (JitterBuffer, NetworkAudioClient,
+                                           NetworkSource, _HEADER)
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+
+    while not predicate():
+        if time.time() >= deadline:
+            return False
+
+        time.sleep(0.01)
+
+    return True
+
+
+class JitterBufferTest(unittest.TestCase):
+    """ JitterBuffer reorders, conceals and ignores duplicates """
+
+    def setUp(self):
+        self.written = []
+        self.jitter = JitterBuffer(
+            lambda data: self.written.append(bytes(data)), max_depth=4)
+
+    def test_reordered_packets_are_written_in_order(self):
+        for sequence in (0, 2, 1, 3):
+            self.jitter.push(sequence, bytes([sequence]) * 2)
+
+        self.assertEqual(self.written, [b'\0\0', b'\1\1', b'\2\2', b'\3\3'])
+        self.assertEqual(self.jitter.stats.reordered, 1)
+        self.assertEqual(self.jitter.stats.lost, 0)
+
+    def test_duplicates_are_not_late(self):
+        for sequence in (0, 1, 1, 2, 0):
+            self.jitter.push(sequence, b'ab')
+
+        self.assertEqual(len(self.written), 3)
+        self.assertEqual(self.jitter.stats.duplicates, 2)
+        self.assertEqual(self.jitter.stats.late, 0)
+        self.assertEqual(self.jitter.depth, 1)
+
+    def test_packet_after_its_gap_was_filled_is_late(self):
+        for sequence in (0, 2, 3, 1, 1):
+            self.jitter.push(sequence, b'ab')
+
+        self.assertEqual(self.written, [b'ab', b'\0\0', b'ab', b'ab'])
+        self.assertEqual(self.jitter.stats.lost, 1)
+        self.assertEqual(self.jitter.stats.late, 1)
+        self.assertEqual(self.jitter.stats.duplicates, 1)
+        self.assertEqual(self.jitter.depth, 2)
+
+    def test_gap_beyond_the_depth_counts_each_packet_once(self):
+        for sequence in (0, 1, 6):
+            self.jitter.push(sequence, b'ab')
+
+        self.assertEqual(self.written, [b'ab'] * 2 + [b'\0\0'] * 4 + [b'ab'])
+        self.assertEqual(self.jitter.stats.packets, 3)
+        self.assertEqual(self.jitter.stats.lost, 4)
+
+
+class NetworkSourceTest(unittest.TestCase):
+    """ NetworkSource parses packets from UDP datagrams and TCP streams """
+
+    def setUp(self):
+        self.source = NetworkSource({'source.network.udp_port': 0,
+                                     'source.network.tcp_port': 0,
+                                     'source.network.max_streams': 2})
+        self.source.start()
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+        self.source.terminate()
+
+    def _tcp_socket(self):
+        sock = socket.create_connection(self.source.tcp_address)
+        self.sockets.append(sock)
+        return sock
+
+    def _written(self, stream_id):
+        stream = self.source.streams.get(stream_id)
+        return stream.buffer.written if stream else 0
+
+    def test_tcp_packets_split_across_reads(self):
+        sock = self._tcp_socket()
+        packets = b''.join(_HEADER.pack(7, sequence, 4) + b'\1\2\3\4'
+                           for sequence in range(3))
+
+        for offset in range(0, len(packets), 5):
+            sock.sendall(packets[offset:offset + 5])
+            time.sleep(0.005)
+
+        self.assertTrue(_wait_until(lambda: self._written(7) == 12))
+        self.assertEqual(self.source.streams[7].jitter.stats.packets, 3)
+
+    def test_oversized_tcp_packet_closes_the_connection(self):
+        sock = self._tcp_socket()
+        sock.settimeout(2.0)
+        sock.sendall(_HEADER.pack(7, 0, 9000) + bytes(9000))
+
+        try:
+            closed = sock.recv(1) == b''
+        except ConnectionResetError:
+            closed = True
+
+        self.assertTrue(closed)
+        self.assertNotIn(7, self.source.streams)
+
+    def test_streams_are_converted_to_the_buffer_format(self):
+        source = NetworkSource({'source.sample_rate': 48000,
+                                'source.channels': 2})
+        stream = source.stream(3)
+
+        for sequence in range(2):
+            stream.jitter.push(sequence, bytes(960 * 2 * 2))
+
+        # 1920 stereo frames at 48 kHz are 640 mono samples at 16 kHz
+        self.assertEqual(stream.buffer.written, 640 * 2)
+
+    def test_streams_over_the_limit_are_dropped(self):
+        clients = [NetworkAudioClient(self.source.udp_address, stream_id,
+                                      payload_bytes=4)
+                   for stream_id in range(3)]
+
+        try:
+            for client in clients:
+                client.send(b'\1\2\3\4')
+
+            self.assertTrue(_wait_until(
+                lambda: self._written(0) and self._written(1)))
+            time.sleep(0.05)
+        finally:
+            for client in clients:
+                client.close()
+
+        self.assertEqual(sorted(self.source.streams), [0, 1])
+        self.assertRaises(ValueError, self.source.stream, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
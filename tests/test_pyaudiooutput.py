@@ -0,0 +1,125 @@
+""" tests for PyAudioOutput driven through VoiceClient.play """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import importlib
+import io
+import sys
+import threading
+import time
+import types
+import unittest
+import wave
+from unittest import mock
+from tabitha.audiobuffer import AudioBuffer
+from tabitha.objectdict import ObjectDict
+from tabitha.voiceclient import VoiceClient
+
+
+class _FakeStream(object):
+    """ calls the stream callback from a thread, like PortAudio """
+
+    def __init__(self, played, stream_callback, frames_per_buffer, rate,
+                 **dummy_kwargs):
+        self._played = played
+        self._callback = stream_callback
+        self._frames = frames_per_buffer
+        self._period = frames_per_buffer / rate
+        self._active = False
+
+    def _run(self):
+        while self._active:
+            data, _ = self._callback(None, self._frames, None, 0)
+            self._played.extend(data)
+            time.sleep(self._period / 10)
+
+    def start_stream(self):
+        self._active = True
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def is_active(self):
+        return self._active
+
+    def stop_stream(self):
+        self._active = False
+
+    def close(self):
+        pass
+
+
+def _fake_pyaudio(played):
+    module = types.ModuleType('pyaudio')
+    module.paContinue = 0
+    module.paOutputUnderflow = 4
+    module.get_format_from_width = lambda width: width
+    module.PyAudio = lambda: ObjectDict({
+        'open': lambda **kwargs: _FakeStream(played, **kwargs),
+        'terminate': lambda: None})
+    return module
+
+
+def _wav(samples):
+    data = io.BytesIO()
+    writer = wave.open(data, 'wb')
+    writer.setnchannels(1)
+    writer.setsampwidth(2)
+    writer.setframerate(16000)
+    writer.writeframes(samples)
+    writer.close()
+    return data.getvalue()
+
+
+class _Source(object):
+    def __init__(self):
+        self.buffer = AudioBuffer()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class PyAudioOutputTest(unittest.TestCase):
+    """ PyAudioOutput plays VoiceClient responses without blocking """
+
+    def setUp(self):
+        self.played = bytearray()
+        modules = {'pyaudio': _fake_pyaudio(self.played)}
+        patcher = mock.patch.dict(sys.modules, modules)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        sys.modules.pop('tabitha.outputs.pyaudiooutput', None)
+        self.addCleanup(sys.modules.pop, 'tabitha.outputs.pyaudiooutput',
+                        None)
+        module = importlib.import_module('tabitha.outputs.pyaudiooutput')
+        self.output = module.PyAudioOutput(
+            {'output.pyaudio.frames_per_buffer': 256})
+        self.addCleanup(self.output.terminate)
+
+    def test_play_audio_returns_before_playback_ends(self):
+        finished = threading.Event()
+        start_time = time.time()
+        self.output.play_audio(_wav(b'\1\0' * 8000), finished.set)
+
+        self.assertLess(time.time() - start_time, 0.1)
+        self.assertTrue(finished.wait(2.0))
+        self.assertIn(b'\1\0' * 256, bytes(self.played))
+
+    def test_voice_client_play(self):
+        client = VoiceClient({'source': _Source(), 'output': self.output})
+        response = ObjectDict({'audio_data': _wav(b'\1\0' * 8000)})
+
+        self.assertIsNone(client.play(response))
+        self.assertIsNotNone(client.timings.playback_end)
+        self.assertEqual(self.played.count(b'\1\0'), 8000)
+
+    def test_compressed_audio_is_rejected(self):
+        self.assertRaises(ValueError, self.output.play_audio,
+                          b'ID3\3\0' + bytes(100))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+""" tests for StreamingResampler and ResamplingWriter """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import unittest
+import numpy
+from tabitha.resampler import ResamplingWriter, StreamingResampler
+
+
+def _tone(frequency, rate, seconds, amplitude=0.5):
+    times = numpy.arange(int(rate * seconds)) / rate
+    return (amplitude * numpy.sin(2 * numpy.pi * frequency * times)) \
+        .astype(numpy.float32)
+
+
+def _blocks(data, sizes):
+    """ cuts data into blocks of the given sizes, repeated """
+
+    offset = 0
+
+    for size in sizes * len(data):
+        if offset >= len(data):
+            break
+
+        yield data[offset:offset + size]
+        offset += size
+
+
+def _rms(samples):
+    return float(numpy.sqrt(numpy.mean(numpy.square(samples))))
+
+
+class _Sink(object):
+    def __init__(self):
+        self.data = bytearray()
+
+    def extend(self, data):
+        self.data.extend(data)
+
+
+class StreamingResamplerTest(unittest.TestCase):
+    """ blocks resample like the whole stream, without aliasing """
+
+    def test_blocks_match_the_whole_stream(self):
+        samples = numpy.random.RandomState(0).uniform(
+            -0.5, 0.5, 20000).astype(numpy.float32)
+
+        for from_rate, to_rate in ((48000, 16000), (44100, 16000),
+                                   (8000, 16000)):
+            whole = StreamingResampler(from_rate, to_rate).process(samples)
+            resampler = StreamingResampler(from_rate, to_rate)
+            chunked = numpy.concatenate([
+                resampler.process(block)
+                for block in _blocks(samples, [1, 441, 1000, 37])])
+
+            self.assertEqual(len(chunked), len(whole))
+            self.assertTrue(numpy.allclose(chunked, whole, atol=1e-5))
+
+    def test_passband_keeps_its_level(self):
+        output = StreamingResampler(48000, 16000).process(
+            _tone(1000, 48000, 1.0))
+
+        # skip the filter's start up
+        self.assertAlmostEqual(_rms(output[1000:]), 0.5 / numpy.sqrt(2),
+                               delta=0.01)
+
+    def test_tones_above_nyquist_are_removed(self):
+        output = StreamingResampler(48000, 16000).process(
+            _tone(10000, 48000, 1.0))
+
+        self.assertLess(_rms(output[1000:]), 0.005)
+
+
+class ResamplingWriterTest(unittest.TestCase):
+    """ PCM written in any pieces is resampled like one write """
+
+    def test_odd_sized_writes_match_one_write(self):
+        pcm = (_tone(440, 44100, 0.5) * 32767).astype('<i2').tobytes()
+        whole = _Sink()
+        ResamplingWriter({}, whole, 44100, 16000).extend(pcm)
+        chunked = _Sink()
+        writer = ResamplingWriter({}, chunked, 44100, 16000)
+
+        for block in _blocks(pcm, [3, 1001, 2, 640]):
+            writer.extend(block)
+
+        self.assertEqual(bytes(chunked.data), bytes(whole.data))
+        self.assertEqual(writer.stats.input_samples, 22050)
+        self.assertEqual(writer.stats.output_samples, 8000)
+
+
+if __name__ == '__main__':
+    unittest.main()
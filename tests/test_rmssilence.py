@@ -0,0 +1,73 @@
+""" tests for RmsSilenceDetector """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import division
+import unittest
+import numpy
+from tabitha.breakdetectors.rmssilence import RmsSilenceDetector
+
+_SAMPLE_RATE = 16000
+_CHUNK_SAMPLES = 1024
+
+
+def _speech(seconds, rms=1500.0):
+    """ a tone whose level rises and falls a little at a syllable rate,
+        never pausing, like continuous speech """
+
+    times = numpy.arange(int(seconds * _SAMPLE_RATE)) / _SAMPLE_RATE
+    envelope = 0.9 + 0.1 * numpy.sin(2 * numpy.pi * 4 * times)
+    tone = numpy.sin(2 * numpy.pi * 300 * times) * numpy.sqrt(2)
+    return (tone * envelope * rms).astype('<i2').tobytes()
+
+
+def _silence(seconds, rms=20.0):
+    samples = numpy.random.RandomState(0).normal(
+        0, rms, int(seconds * _SAMPLE_RATE))
+    return samples.astype('<i2').tobytes()
+
+
+def _first_break(detector, data):
+    """ seconds into data the detector first reports a break, or None """
+
+    chunk_bytes = _CHUNK_SAMPLES * 2
+
+    for offset in range(0, len(data), chunk_bytes):
+        if detector.is_break(data[offset:offset + chunk_bytes]):
+            return (offset + chunk_bytes) / 2 / _SAMPLE_RATE
+
+    return None
+
+
+class RmsSilenceDetectorTest(unittest.TestCase):
+    """ the break is found after speech, and not during it """
+
+    def test_sustained_speech_has_no_break(self):
+        """ speech from the first chunk on is not learnt as noise """
+
+        detector = RmsSilenceDetector()
+
+        self.assertIsNone(_first_break(detector, _speech(5)))
+
+    def test_sustained_speech_after_reset(self):
+        """ a second capture of sustained speech also has no break """
+
+        detector = RmsSilenceDetector()
+        _first_break(detector, _speech(2) + _silence(1))
+        detector.reset()
+
+        self.assertIsNone(_first_break(detector, _speech(5)))
+
+    def test_silence_after_speech_is_a_break(self):
+        """ the break follows the end of speech by about silence_ms """
+
+        detector = RmsSilenceDetector()
+        found = _first_break(detector, _speech(2) + _silence(1))
+
+        self.assertIsNotNone(found)
+        self.assertGreater(found, 2.2)
+        self.assertLess(found, 2.4)
+
+
+if __name__ == '__main__':
+    unittest.main()
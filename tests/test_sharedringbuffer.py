@@ -0,0 +1,56 @@
+""" tests for SharedRingBuffer readers in other processes """
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import os
+import subprocess
+import sys
+import unittest
+from tabitha.sharedringbuffer import SharedRingBuffer
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a reader which is not started by multiprocessing, like a recorder
+_READER = '''
+import sys
+from tabitha.sharedringbuffer import SharedRingBuffer
+ring = SharedRingBuffer.attach(sys.argv[1])
+sys.stdout.write(ring.copy(0, ring.written).decode('ascii'))
+ring.close()
+'''
+
+
+class SharedRingBufferTest(unittest.TestCase):
+    """ separate processes can attach without destroying the segment """
+
+    def setUp(self):
+        self.ring = SharedRingBuffer(1024)
+        self.addCleanup(self.ring.close)
+        self.ring.write(b'hello')
+
+    def _attach_from_process(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [_ROOT] + [path for path in [env.get('PYTHONPATH')] if path])
+
+        return subprocess.run(
+            [sys.executable, '-c', _READER, self.ring.name], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30,
+            check=True)
+
+    def test_segment_outlives_a_separate_reader(self):
+        for _ in range(2):
+            result = self._attach_from_process()
+
+            self.assertEqual(result.stdout, b'hello')
+            self.assertNotIn(b'leaked', result.stderr)
+
+        reader = SharedRingBuffer.attach(self.ring.name)
+        self.addCleanup(reader.close)
+        self.ring.write(b' again')
+
+        self.assertEqual(reader.copy(0, reader.written), b'hello again')
+
+
+if __name__ == '__main__':
+    unittest.main()